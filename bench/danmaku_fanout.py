@@ -0,0 +1,85 @@
+"""实时弹幕推送压测：模拟大量客户端加入同一视频房间，测量推送延迟和吞吐
+
+需要先启动服务，并提供一个已登录用户的session cookie用于发送弹幕（每条弹幕消耗0.2积分）。
+依赖: pip install "python-socketio[asyncio_client]" aiohttp
+
+用法: python bench/danmaku_fanout.py --url http://127.0.0.1:5000 --cookie <session> --aid 1 --clients 500
+"""
+# 标准库导入
+import time
+import asyncio
+import argparse
+import statistics
+# 第三方库导入
+import aiohttp
+import socketio
+
+
+NAMESPACE = '/danmaku'
+
+
+async def run_client(url, aid, latencies, frames, ready):
+    """一个模拟观众：加入房间后记录收到每条弹幕的延迟"""
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on('danmaku', namespace=NAMESPACE)
+    async def on_danmaku(danmakus):
+        now = time.time()
+        frames.append(len(danmakus))
+        latencies.extend(now - dm['timestamp'] for dm in danmakus)
+
+    await client.connect(url, namespaces=[NAMESPACE], transports=['websocket'])
+    await client.call('join', {'aid': aid}, namespace=NAMESPACE)
+    ready.release()
+    return client
+
+
+async def send_danmakus(url, cookie, aid, messages, rate):
+    """按指定速率发送弹幕"""
+    async with aiohttp.ClientSession(cookies={'session': cookie}) as http:
+        for i in range(messages):
+            await http.post(f"{url}/api/danmaku/send", json={
+                'aid': aid, 'content': f'bench {i}', 'color': '#ffffff',
+                'type': 0, 'video_time': i % 600
+            })
+            await asyncio.sleep(1 / rate)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--cookie', required=True, help='已登录用户的session cookie')
+    parser.add_argument('--aid', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=50, help='每秒发送的弹幕数')
+    args = parser.parse_args()
+
+    latencies, frames = [], []
+    ready = asyncio.Semaphore(0)
+    clients = await asyncio.gather(*[
+        run_client(args.url, args.aid, latencies, frames, ready) for _ in range(args.clients)])
+
+    begin = time.perf_counter()
+    await send_danmakus(args.url, args.cookie, args.aid, args.messages, args.rate)
+    await asyncio.sleep(2)  # 等待最后一批推送到达
+    elapsed = time.perf_counter() - begin
+
+    await asyncio.gather(*[client.disconnect() for client in clients])
+
+    expected = args.clients * args.messages
+    print(f"客户端: {args.clients}, 发送弹幕: {args.messages}")
+    print(f"送达: {len(latencies)}/{expected} ({len(latencies) / elapsed:,.0f} 条/s)")
+    print(f"推送帧数: {len(frames)}, 平均每帧 {statistics.mean(frames) if frames else 0:.1f} 条")
+    if latencies:
+        print(f"延迟 p50={percentile(latencies, 50):.1f}ms "
+              f"p95={percentile(latencies, 95):.1f}ms p99={percentile(latencies, 99):.1f}ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
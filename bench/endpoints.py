@@ -0,0 +1,342 @@
+"""接口基准：在本地替身数据库上启动main.app，逐个接口压测并统计延迟和数据库命令数
+
+默认使用mongomock和fakeredis，不需要任何外部服务；--backend real时使用本地的
+mongod和Redis(会清空--mongo-uri指定的库和--redis-url指定的Redis库)。
+--scale 1对应10万视频、100万评论、1000万弹幕，替身数据库建议使用0.01左右。
+替身数据库需要先安装: pip install mongomock fakeredis lupa (fakeredis执行Lua脚本需要lupa；
+mongomock 4.3与pymongo 4.11及以上的bulk_write不兼容，需要使用较早的pymongo)
+上传、AI和COS代理接口依赖文件或外部服务，不在测试范围内。
+
+结果写入JSON文件，便于对比修改前后的数据。
+
+用法: python bench/endpoints.py --scale 0.01 --requests 200 --output bench_endpoints.json
+"""
+# 标准库导入
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASE_COUNTS = {"users": 10000, "videos": 100000, "comments": 1000000, "danmakus": 10000000}
+PAGE_TYPES = ["video", "index"]  # 视频页和首页的评论，都是handler/comment.py允许的页面类型
+BATCH_SIZE = 5000
+
+mongo_commands = [0]
+
+
+class CountingCollection:
+    """转发到真实集合，每次方法调用计为一次数据库命令"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        def counted(*args, **kwargs):
+            mongo_commands[0] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """替换mongo.db，取出的集合都会统计命令数"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return CountingCollection(self._db[name])
+
+    def __getitem__(self, name):
+        return CountingCollection(self._db[name])
+
+
+def setup_backend(args):
+    """导入应用并把MongoDB和Redis换成替身或本地的测试库，返回(app, 原始db)"""
+    from main import app
+    from extensions import mongo, redis_client, limiter
+
+    if args.backend == "mock":
+        import mongomock
+        import fakeredis
+        db = mongomock.MongoClient().maomao_bench
+        pool = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True).connection_pool
+    else:
+        from pymongo import MongoClient
+        from redis import ConnectionPool
+        client = MongoClient(args.mongo_uri)
+        db = client.get_default_database()
+        if not db.name.endswith("bench"):
+            sys.exit("--mongo-uri指定的库名需要以bench结尾，避免误删数据")
+        client.drop_database(db.name)
+        pool = ConnectionPool.from_url(args.redis_url, decode_responses=True)
+
+    # 各模块导入的是同一个客户端对象，替换连接池即可生效
+    redis_client.connection_pool = pool
+    redis_client.flushdb()
+    mongo.db = db
+    limiter.enabled = False
+    app.config["TESTING"] = True
+    return app, db
+
+
+def insert_batches(collection, documents):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= BATCH_SIZE:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def seed(db, counts, rng):
+    """按比例生成用户、视频、评论、弹幕、点赞、关注和访问统计"""
+    from handler.danmaku import SEGMENT_SECONDS, SEGMENT_MAX_DANMAKUS
+
+    now = time.time()
+    users, videos = counts["users"], counts["videos"]
+
+    insert_batches(db.user, ({
+        "uid": uid,
+        "name": f"user{uid}",
+        "email": f"user{uid}@example.com",
+        "password": "",
+        "status": 1 if uid == 1 else 0,
+        "time": now - rng.uniform(0, 365 * 86400),
+        "checkin": {"points": 1000000, "experience": rng.randint(0, 10000), "last_checkin": None},
+        "followers_count": 0,
+        "following_count": 0,
+    } for uid in range(1, users + 1)))
+
+    insert_batches(db.video, ({
+        "aid": aid,
+        "uid": rng.randint(1, users),
+        "title": f"video{aid}",
+        "description": "",
+        "tags": [],
+        "time": now - rng.uniform(0, 365 * 86400),
+        "data": {"view": rng.randint(0, 100000), "like": rng.randint(0, 5000),
+                 "danmaku": 0, "comment": 0},
+        "hidden": {"is_hidden": False},
+    } for aid in range(1, videos + 1)))
+
+    def comments():
+        for index in range(counts["comments"]):
+            page_type = rng.choice(PAGE_TYPES)
+            yield {
+                "aid": rng.randint(1, videos) if page_type == "video" else None,
+                "uid": rng.randint(1, users),
+                "content": "bench",
+                "time": now - rng.uniform(0, 365 * 86400),
+                "parent_id": None,
+                "replies": [],
+                "floor": index + 1,
+                "page_type": page_type,
+            }
+    insert_batches(db.comment, comments())
+
+    # 弹幕按视频和分段聚合后写入，每个视频时长10分钟以内
+    per_video = max(counts["danmakus"] // videos, 1)
+    danmaku_id = 0
+
+    def segments():
+        nonlocal danmaku_id
+        for aid in range(1, videos + 1):
+            by_segment = {}
+            for _ in range(per_video):
+                danmaku_id += 1
+                video_time = rng.uniform(0, 600)
+                by_segment.setdefault(int(video_time // SEGMENT_SECONDS), []).append({
+                    "danmaku_id": danmaku_id, "uid": rng.randint(1, users), "content": "bench",
+                    "color": "#FFFFFF", "type": 0, "video_time": video_time, "timestamp": now})
+            for segment, danmakus in by_segment.items():
+                for start in range(0, len(danmakus), SEGMENT_MAX_DANMAKUS):
+                    chunk = danmakus[start:start + SEGMENT_MAX_DANMAKUS]
+                    yield {"aid": aid, "segment": segment, "part": start // SEGMENT_MAX_DANMAKUS,
+                           "count": len(chunk), "danmakus": chunk}
+    insert_batches(db.danmaku_segment, segments())
+    db.counter.insert_one({"_id": "danmaku_id", "sequence_value": danmaku_id})
+
+    insert_batches(db.video_like_edge, ({"uid": uid, "aid": aid, "time": now}
+                                        for uid in range(1, users + 1)
+                                        for aid in set(rng.randint(1, videos) for _ in range(10))))
+    insert_batches(db.follow, ({"follower": uid, "followee": followee, "time": now}
+                               for uid in range(1, users + 1)
+                               for followee in set(rng.randint(1, users) for _ in range(10)) - {uid}))
+
+    hour = int(now) // 3600 * 3600
+    insert_batches(db.traffic, ({"resolution": "hour", "timestamp": hour - i * 3600,
+                                 "pv": rng.randint(0, 10000), "uv": rng.randint(0, 1000)}
+                                for i in range(24 * 30)))
+
+
+def build_routes(counts, rng):
+    """(名称, 方法, URL生成函数, JSON生成函数, 是否需要登录)"""
+    users, videos = counts["users"], counts["videos"]
+    aid = lambda: rng.randint(1, videos)  # noqa: E731
+    uid = lambda: rng.randint(1, users)  # noqa: E731
+    return [
+        ("video.list", "GET", lambda: f"/api/video/list?start={rng.randint(1, 50)}&count=10", None, False),
+        ("video.list_view", "GET", lambda: "/api/video/list?sort_by=view&count=10", None, False),
+        ("video.get", "GET", lambda: f"/api/video/get/{aid()}", None, True),
+        ("video.hot_list", "GET", lambda: "/api/video/hot-list?start=1&count=10", None, True),
+        ("video.liked", "GET", lambda: "/api/video/liked", None, True),
+        ("video.add_view", "POST", lambda: f"/api/video/add/view/{aid()}", None, False),
+        ("video.toggle_like", "POST", lambda: f"/api/video/toggle/like/{aid()}", None, True),
+        ("danmaku.get", "GET", lambda: f"/api/danmaku/{aid()}", None, False),
+        ("danmaku.get_range", "GET", lambda: f"/api/danmaku/{aid()}?from=0&to=60", None, False),
+        ("danmaku.send", "POST", lambda: "/api/danmaku/send",
+         lambda: {"aid": aid(), "content": "bench", "color": "#FFFFFF", "type": 0,
+                  "video_time": rng.uniform(0, 600)}, True),
+        ("comment.get", "GET", lambda: f"/api/comment/video/{aid()}", None, False),
+        ("comment.get_index", "GET", lambda: "/api/comment/index", None, False),
+        ("comment.post", "POST", lambda: f"/api/comment/video/{aid()}",
+         lambda: {"content": f"bench {rng.random()}"}, True),
+        ("space.videos", "GET", lambda: f"/api/space/videos/{uid()}", None, False),
+        ("space.info", "GET", lambda: f"/api/space/{uid()}", None, False),
+        ("space.followers", "GET", lambda: f"/api/space/{uid()}/followers", None, False),
+        ("space.following", "GET", lambda: f"/api/space/{uid()}/following", None, False),
+        ("space.is_following", "GET", lambda: f"/api/space/is_following?uids={uid()},{uid()},{uid()}", None, True),
+        ("space.follow", "POST", lambda: f"/api/space/follow/{uid()}", None, True),
+        ("user.session", "GET", lambda: "/api/user/session/get", None, True),
+        ("user.rank", "GET", lambda: "/api/user/rank", None, False),
+        ("user.rank_around", "GET", lambda: "/api/user/rank/around", None, True),
+        ("user.checkin", "POST", lambda: "/api/user/checkin", None, True),
+        ("online.visited", "POST", lambda: "/api/online/visited", None, False),
+        ("online.traffic", "GET", lambda: "/api/online/traffic?resolution=hour", None, False),
+        ("online.last_24h", "GET", lambda: "/api/online/get_last_24h_visits", None, False),
+        ("admin.adjust_points", "POST", lambda: "/api/admin/adjust_points",
+         lambda: {"adjustments": [{"uid": uid(), "points": 1, "exp": 1} for _ in range(10)]}, True),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run_route(app, route, requests_count, trace_memory):
+    """对一个接口发出requests_count次请求，返回统计结果"""
+    name, method, make_url, make_json, needs_login = route
+    client = app.test_client()
+    if needs_login:
+        # uid为1的用户是管理员
+        with client.session_transaction() as session:
+            session["user"] = {"uid": 1, "signin": True}
+
+    latencies = []
+    commands = []
+    errors = 0
+    if trace_memory:
+        tracemalloc.start()
+    begin = time.perf_counter()
+    for _ in range(requests_count):
+        url = make_url()
+        body = make_json() if make_json else None
+        commands_before = mongo_commands[0]
+        request_begin = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        latencies.append((time.perf_counter() - request_begin) * 1000)
+        commands.append(mongo_commands[0] - commands_before)
+        if response.status_code >= 500:
+            errors += 1
+    elapsed = time.perf_counter() - begin
+    peak_python_memory = None
+    if trace_memory:
+        peak_python_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "route": name,
+        "method": method,
+        "requests": requests_count,
+        "errors": errors,
+        "throughput": requests_count / elapsed if elapsed else 0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0,
+        },
+        "mongo_commands_per_request": sum(commands) / len(commands) if commands else 0,
+        "mongo_commands_max": max(commands) if commands else 0,
+        "peak_python_memory": peak_python_memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["mock", "real"], default="mock")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/maomao_bench")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--scale", type=float, default=0.01, help="数据量相对于10万视频的比例")
+    parser.add_argument("--requests", type=int, default=200, help="每个接口的请求次数")
+    parser.add_argument("--routes", default="", help="只测试名称包含这些关键字的接口，逗号分隔")
+    parser.add_argument("--trace-memory", action="store_true", help="统计每个接口的Python内存峰值，会拖慢请求")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_endpoints.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    counts = {key: max(int(value * args.scale), 1) for key, value in BASE_COUNTS.items()}
+    app, db = setup_backend(args)
+
+    from extensions import mongo
+    import indexes
+    import leaderboard
+    import hotlist
+
+    with app.app_context():
+        begin = time.perf_counter()
+        seed(db, counts, rng)
+        indexes.reconcile()
+        leaderboard.rebuild()
+        hotlist.recompute()
+        print(f"生成数据 {counts}，用时{time.perf_counter() - begin:.1f}s")
+
+        # 生成数据后才开始统计数据库命令
+        mongo.db = CountingDatabase(db)
+
+    keywords = [keyword for keyword in args.routes.split(",") if keyword]
+    results = []
+    for route in build_routes(counts, rng):
+        if keywords and not any(keyword in route[0] for keyword in keywords):
+            continue
+        result = run_route(app, route, args.requests, args.trace_memory)
+        results.append(result)
+        latency = result["latency_ms"]
+        print(f"{result['route']:<22} p50 {latency['p50']:7.2f}ms  p95 {latency['p95']:7.2f}ms  "
+              f"p99 {latency['p99']:7.2f}ms  {result['throughput']:8.1f} 次/s  "
+              f"{result['mongo_commands_per_request']:5.2f} 次数据库命令/请求  {result['errors']} 错误")
+
+    report = {
+        "time": datetime.now().isoformat(),
+        "backend": args.backend,
+        "scale": args.scale,
+        "counts": counts,
+        "requests_per_route": args.requests,
+        # Linux上ru_maxrss的单位是KB
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "routes": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入{args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""缩略图生成基准：用不同数量的进程处理合成图片，统计每秒处理的图片数
+
+用法: python bench/imaging.py --images 200 --kind cover
+"""
+# 标准库导入
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+# 第三方库导入
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imaging import make_variants  # noqa: E402
+
+
+def make_source_images(directory, count, width, height):
+    """生成随机内容的源图片"""
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"src_{i}.jpg")
+        Image.effect_noise((width, height), 64).convert("RGB").save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--kind", choices=["cover", "face"], default="cover")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        sources = make_source_images(workdir, args.images, args.width, args.height)
+        out_dir = os.path.join(workdir, "out")
+        os.makedirs(out_dir)
+
+        workers = 1
+        while True:
+            begin = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(make_variants, sources, [out_dir] * len(sources),
+                              [f"img{i}" for i in range(len(sources))], [args.kind] * len(sources)))
+            elapsed = time.perf_counter() - begin
+            print(f"{workers:>3}个进程: {len(sources) / elapsed:>8.1f} 张/s")
+            if workers >= os.cpu_count():
+                break
+            workers = min(workers * 2, os.cpu_count())
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
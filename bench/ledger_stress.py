@@ -0,0 +1,89 @@
+"""积分经验并发压测：多进程多线程同时调整同一用户，检查没有丢失更新或透支
+
+会在config.py配置的MongoDB/Redis中创建并删除一个测试用户。
+
+用法: python bench/ledger_stress.py --processes 4 --threads 8 --ops 500
+"""
+# 标准库导入
+import os
+import sys
+import time
+import random
+import argparse
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_UID = -20231  # 测试用户的uid，不会与真实用户冲突
+
+
+def worker(args):
+    """在子进程中并发调整积分，返回成功的(积分, 经验)变化总和"""
+    threads, ops, seed = args
+    from main import app
+    from utils import adjust_points_and_exp, flush_point_exp_logs
+
+    def run(thread_seed):
+        rng = random.Random(thread_seed)
+        points_sum = exp_sum = 0
+        with app.app_context():
+            for _ in range(ops):
+                points = rng.choice([-3, -1, 1, 2])
+                result = adjust_points_and_exp(BENCH_UID, points, 1, reason="压测")
+                if result["status"] == "success":
+                    points_sum += points
+                    exp_sum += 1
+        return points_sum, exp_sum
+
+    with ThreadPoolExecutor(threads) as executor:
+        totals = list(executor.map(run, [seed * 1000 + i for i in range(threads)]))
+    flush_point_exp_logs()
+    return sum(t[0] for t in totals), sum(t[1] for t in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="每个线程的调整次数")
+    parser.add_argument("--initial-points", type=int, default=50)
+    args = parser.parse_args()
+
+    from main import app
+    from extensions import mongo
+
+    with app.app_context():
+        mongo.db.user.delete_one({"uid": BENCH_UID})
+        mongo.db.point_exp_log.delete_many({"uid": BENCH_UID})
+        mongo.db.user.insert_one({"uid": BENCH_UID, "name": "bench", "checkin": {
+            "points": args.initial_points, "experience": 0, "last_checkin": None}})
+
+    begin = time.perf_counter()
+    with Pool(args.processes) as pool:
+        totals = pool.map(worker, [(args.threads, args.ops, seed) for seed in range(args.processes)])
+    elapsed = time.perf_counter() - begin
+
+    expected_points = args.initial_points + sum(t[0] for t in totals)
+    expected_exp = sum(t[1] for t in totals)
+    total_ops = args.processes * args.threads * args.ops
+
+    with app.app_context():
+        user = mongo.db.user.find_one({"uid": BENCH_UID})
+        logs = mongo.db.point_exp_log.count_documents({"uid": BENCH_UID})
+        mongo.db.user.delete_one({"uid": BENCH_UID})
+        mongo.db.point_exp_log.delete_many({"uid": BENCH_UID})
+
+    print(f"{total_ops}次调整，用时{elapsed:.2f}s ({total_ops / elapsed:,.0f} 次/s)")
+    print(f"积分: 实际{user['checkin']['points']} 期望{expected_points}")
+    print(f"经验: 实际{user['checkin']['experience']} 期望{expected_exp}")
+    print(f"日志: 实际{logs} 期望{expected_exp}")
+
+    ok = (user['checkin']['points'] == expected_points and user['checkin']['points'] >= 0
+          and user['checkin']['experience'] == expected_exp and logs == expected_exp)
+    print("通过" if ok else "失败：存在丢失更新或透支")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
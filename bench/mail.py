@@ -0,0 +1,230 @@
+"""邮件发送基准：在本地启动替身SMTP服务器，对比每封邮件新建连接和保持连接批量发送的吞吐量
+
+替身服务器只实现了EHLO/AUTH PLAIN/MAIL/RCPT/DATA/NOOP/RSET/QUIT，收到的邮件直接丢弃。
+--latency给每个应答加上延迟来模拟网络往返，--connect-delay模拟建立连接和TLS握手的耗时，
+都设为0时测到的只是本机的协议开销。
+
+--queue时再测一遍完整路径：把邮件放入config.py配置的Redis中的发送队列，由--workers个
+worker进程发送，统计从入队到替身服务器收完所有邮件的时间(会清空队列中未发送的邮件)。
+
+单独启动替身服务器用于手动测试(配置MAIL_SERVER = '127.0.0.1'、MAIL_PORT = 1025、MAIL_USE_SSL = False):
+    python bench/mail.py --serve --port 1025
+
+用法: python bench/mail.py --messages 500 --latency 0.01 --connect-delay 0.05 --output bench_mail.json
+"""
+# 标准库导入
+import os
+import sys
+import json
+import time
+import smtplib
+import argparse
+import threading
+import socketserver
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SENDER = "bench@localhost"
+HTML = "<div>验证代码是：<b>123456</b>，有效期为5分钟。</div>" * 20
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, *lines):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write("".join(line + "\r\n" for line in lines).encode("ascii"))
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        if self.server.connect_delay:
+            time.sleep(self.server.connect_delay)
+        self.reply("220 localhost ESMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost", "250-AUTH PLAIN", "250 8BITMIME")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    if line == b".\r\n":
+                        break
+                with self.server.lock:
+                    self.server.received += 1
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """替身SMTP服务器，记录收到的连接数和邮件数"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0, connect_delay=0):
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.received = 0
+        super().__init__(address, SMTPSinkHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name="smtp-sink").start()
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.connections = self.received = 0
+
+
+def mails(count):
+    return [{"to": f"user{i}@localhost", "subject": "猫猫站 - 点击查看验证码", "html": HTML}
+            for i in range(count)]
+
+
+def bench_per_message(port, messages):
+    """原来的做法：每封邮件新建连接、登录、发送"""
+    from mailer import build_message
+    for mail in messages:
+        smtp = smtplib.SMTP("127.0.0.1", port, timeout=30)
+        smtp.login("bench", "bench")
+        smtp.sendmail(SENDER, mail["to"], build_message(SENDER, mail["to"], mail["subject"], mail["html"]))
+        smtp.quit()
+
+
+def bench_pooled(port, messages, batch_size):
+    """保持一个已登录的连接，按批发送"""
+    from mailer import SMTPConnection, send_batch
+    connection = SMTPConnection("127.0.0.1", port, "bench", "bench", use_ssl=False)
+    try:
+        for start in range(0, len(messages), batch_size):
+            errors = send_batch(connection, SENDER, messages[start:start + batch_size])
+            if any(errors):
+                raise RuntimeError(f"发送失败: {errors}")
+    finally:
+        connection.close()
+
+
+def _create_app(port, batch_size):
+    from flask import Flask
+    from extensions import init_redis
+    import config
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=port, MAIL_USE_SSL=False,
+                      MAIL_USERNAME="bench", MAIL_PASSWORD="bench", MAIL_SENDER=SENDER,
+                      MAIL_BATCH_SIZE=batch_size)
+    init_redis(app)
+    return app
+
+
+def _run_queue_worker(port, batch_size):
+    from mailer import run_worker
+    run_worker(_create_app(port, batch_size))
+
+
+def bench_queue(sink, port, messages, workers, batch_size):
+    """经过Redis队列的完整路径：入队后等待worker发送完毕，返回(入队耗时, 总耗时)"""
+    from extensions import redis_client
+    from mailer import mail_queue, enqueue_mail
+
+    app = _create_app(port, batch_size)
+    with app.app_context():
+        redis_client.delete(mail_queue.ready_key, mail_queue.delayed_key)
+        ctx = get_context("spawn")
+        processes = [ctx.Process(target=_run_queue_worker, args=(port, batch_size), daemon=True)
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        # 先发几封预热邮件，等worker启动并建立好连接，避免把启动时间算进去
+        for mail in mails(workers):
+            enqueue_mail(mail["to"], mail["subject"], mail["html"])
+        deadline = time.time() + 60
+        while sink.received < workers:
+            if time.time() > deadline:
+                raise RuntimeError("worker启动超时")
+            time.sleep(0.05)
+        sink.reset()
+
+        begin = time.perf_counter()
+        for mail in messages:
+            enqueue_mail(mail["to"], mail["subject"], mail["html"])
+        enqueued = time.perf_counter() - begin
+        while sink.received < len(messages):
+            if time.perf_counter() - begin > 300:
+                raise RuntimeError(f"超时，只收到{sink.received}封")
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - begin
+
+        for process in processes:
+            process.terminate()
+            process.join()
+    return enqueued, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01, help="每个SMTP应答的延迟(秒)")
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="建立连接的延迟(秒)")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--serve", action="store_true", help="只启动替身服务器")
+    parser.add_argument("--queue", action="store_true", help="同时测试经过Redis队列的完整路径")
+    parser.add_argument("--workers", type=int, default=2, help="--queue时的worker进程数")
+    parser.add_argument("--output", default="bench_mail.json")
+    args = parser.parse_args()
+
+    sink = SMTPSink(("127.0.0.1", args.port), args.latency, args.connect_delay)
+    if args.serve:
+        print(f"替身SMTP服务器监听127.0.0.1:{args.port}")
+        sink.serve_forever()
+        return
+    sink.start()
+
+    messages = mails(args.messages)
+    results = {}
+    for name, run in (("per_message", lambda: bench_per_message(args.port, messages)),
+                      ("pooled", lambda: bench_pooled(args.port, messages, args.batch_size))):
+        sink.reset()
+        begin = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - begin
+        results[name] = {"seconds": elapsed, "throughput": len(messages) / elapsed,
+                         "connections": sink.connections, "received": sink.received}
+        print(f"{name:>12}: {results[name]['throughput']:8.1f} 封/s  "
+              f"{sink.connections}个连接  收到{sink.received}封")
+
+    if args.queue:
+        enqueued, elapsed = bench_queue(sink, args.port, messages, args.workers, args.batch_size)
+        results["queue"] = {"workers": args.workers, "enqueue_seconds": enqueued, "seconds": elapsed,
+                            "throughput": len(messages) / elapsed,
+                            "enqueue_latency": enqueued / len(messages)}
+        print(f"{'queue':>12}: {results['queue']['throughput']:8.1f} 封/s  "
+              f"{args.workers}个worker  平均入队耗时{enqueued / len(messages) * 1000:.2f}ms")
+
+    sink.shutdown()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"messages": args.messages, "batch_size": args.batch_size, "latency": args.latency,
+                   "connect_delay": args.connect_delay, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入{args.output}")
+
+
+if __name__ == "__main__":
+    main()
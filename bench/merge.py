@@ -0,0 +1,71 @@
+"""分片合并基准：原read()整块读入的实现 vs filemerge.merge_files，比较吞吐和峰值内存
+
+每种实现在独立的子进程中运行，峰值内存取子进程的ru_maxrss。
+
+用法: python bench/merge.py --chunks 20 --chunk-mb 5
+"""
+# 标准库导入
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filemerge import merge_files  # noqa: E402
+
+
+def legacy_merge(dst_path, src_paths):
+    """原merge_video_chunk中的实现"""
+    with open(dst_path, 'wb') as merged_file:
+        for chunk_path in src_paths:
+            with open(chunk_path, 'rb') as chunk_file:
+                merged_file.write(chunk_file.read())
+
+
+def run(method, dst_path, src_paths, queue):
+    begin = time.perf_counter()
+    if method == "legacy":
+        legacy_merge(dst_path, src_paths)
+    else:
+        merge_files(dst_path, src_paths)
+    elapsed = time.perf_counter() - begin
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--chunk-mb", type=int, default=5)
+    parser.add_argument("--dir", default=None, help="测试文件所在目录，默认系统临时目录")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        src_paths = []
+        for i in range(args.chunks):
+            path = os.path.join(workdir, f"chunk_{i}.part")
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.chunk_mb * 1024 * 1024))
+            src_paths.append(path)
+        total_mb = args.chunks * args.chunk_mb
+
+        ctx = get_context("spawn")
+        for method in ("legacy", "filemerge"):
+            queue = ctx.Queue()
+            dst_path = os.path.join(workdir, f"{method}.mp4")
+            process = ctx.Process(target=run, args=(method, dst_path, src_paths, queue))
+            process.start()
+            elapsed, max_rss_kb = queue.get()
+            process.join()
+            print(f"{method:>10}: {total_mb / elapsed:>8.1f} MB/s, 峰值内存 {max_rss_kb / 1024:.1f} MB")
+            os.remove(dst_path)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""COS代理内存基准：原整块读入的代理 vs 流式代理，在并发下载大文件时比较服务进程的峰值内存
+
+会在本地启动一个模拟COS的静态文件服务器，代理服务在独立进程中运行。
+仅支持Linux（通过/proc读取峰值内存）。
+
+用法: python bench/proxy_memory.py --size-mb 100 --concurrency 8
+"""
+# 标准库导入
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+from functools import partial
+from multiprocessing import get_context
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+# 第三方库导入
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_proxy(mode, port, upstream_url, cache_dir):
+    """在子进程中运行只注册了代理蓝图的Flask应用"""
+    from flask import Flask, request, make_response, Blueprint
+    from werkzeug.serving import run_simple
+
+    app = Flask(__name__)
+    app.config.update(COS_PUBLIC_URL=upstream_url, PROXY_CACHE_DIR=cache_dir)
+
+    if mode == "streaming":
+        from handler.public import bp
+    else:
+        bp = Blueprint('public', __name__, url_prefix='/api/public')
+
+        @bp.route('/cos/<path:subpath>', methods=['GET'])
+        def proxy(subpath):
+            """原实现：每次新建连接并把整个响应读入内存"""
+            resp = requests.request(
+                method=request.method,
+                url=f"{app.config['COS_PUBLIC_URL']}/{subpath}",
+                headers={key: value for (key, value) in request.headers if key != 'Host'},
+                data=request.get_data(), cookies=request.cookies, allow_redirects=False)
+            response = make_response(resp.content, resp.status_code)
+            for key, value in resp.headers.items():
+                if key.lower() not in ['transfer-encoding', 'connection']:
+                    response.headers[key] = value
+            return response
+
+    app.register_blueprint(bp)
+    run_simple('127.0.0.1', port, app, threaded=True)
+
+
+def peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def download(url):
+    size = 0
+    with requests.get(url, stream=True) as resp:
+        for chunk in resp.iter_content(256 * 1024):
+            size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        video_dir = os.path.join(workdir, "videos_original")
+        os.makedirs(video_dir)
+        with open(os.path.join(video_dir, "1.mp4"), "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        upstream_port = free_port()
+        upstream = ThreadingHTTPServer(('127.0.0.1', upstream_port),
+                                       partial(SimpleHTTPRequestHandler, directory=workdir))
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+        ctx = get_context("spawn")
+        for mode in ("legacy", "streaming"):
+            port = free_port()
+            process = ctx.Process(target=serve_proxy, args=(
+                mode, port, f"http://127.0.0.1:{upstream_port}", os.path.join(workdir, "cache")))
+            process.start()
+            time.sleep(2)
+
+            url = f"http://127.0.0.1:{port}/api/public/cos/videos_original/1.mp4"
+            begin = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                total = sum(executor.map(download, [url] * args.concurrency))
+            elapsed = time.perf_counter() - begin
+
+            print(f"{mode:>10}: {total / 1024 / 1024 / elapsed:>8.1f} MB/s, "
+                  f"峰值内存 {peak_rss_mb(process.pid):.1f} MB")
+            process.terminate()
+            process.join()
+
+        upstream.shutdown()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""多进程扩展性压测：分别用不同的worker数启动serve.py，测量吞吐量随进程数的变化
+
+使用config.py配置的MongoDB和Redis，需要先准备好数据(可以用bench/endpoints.py --backend real生成)。
+压测客户端运行在同一台机器上，会占用一部分CPU，--clients不宜超过核数太多。
+
+用法: python bench/serve_scaling.py --workers 1,2,4,8 --duration 20 --output bench_serve.json
+"""
+# 标准库导入
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import subprocess
+import http.client
+from multiprocessing import Pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATHS = [
+    "/api/video/list?count=10",
+    "/api/video/hot-list?start=1&count=10",
+    "/api/user/rank",
+    "/api/space/1",
+    "/api/comment/video/1",
+    "/api/online/get_last_24h_visits",
+]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def client(args):
+    """一个压测进程：在keep-alive连接上循环请求，返回(成功数, 失败数)"""
+    port, paths, duration, seed = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    ok = failed = 0
+    index = seed
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status < 500:
+                ok += 1
+            else:
+                failed += 1
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.close()
+    return ok, failed
+
+
+def run(workers, args, paths):
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py"),
+                               "--workers", str(workers), "--port", str(args.port)], cwd=ROOT)
+    try:
+        if not wait_for_port(args.port):
+            raise RuntimeError("serve.py启动超时")
+        time.sleep(args.warmup)
+        with Pool(args.clients) as pool:
+            begin = time.perf_counter()
+            results = pool.map(client, [(args.port, paths, args.duration, seed)
+                                        for seed in range(args.clients)])
+            elapsed = time.perf_counter() - begin
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    ok = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    return {"workers": workers, "requests": ok, "errors": failed, "throughput": ok / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, os.cpu_count()) if n <= os.cpu_count()),
+                        help="逗号分隔的worker数")
+    parser.add_argument("--clients", type=int, default=os.cpu_count() * 2, help="压测进程数")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--paths", default="", help="逗号分隔的请求路径，默认使用一组热门GET接口")
+    parser.add_argument("--output", default="bench_serve.json")
+    args = parser.parse_args()
+
+    paths = [path for path in args.paths.split(",") if path] or DEFAULT_PATHS
+    results = []
+    for workers in sorted({int(n) for n in args.workers.split(",")}):
+        result = run(workers, args, paths)
+        results.append(result)
+        speedup = result["throughput"] / results[0]["throughput"] if results[0]["throughput"] else 0
+        print(f"{workers:>3} workers: {result['throughput']:9.1f} 次/s  "
+              f"{result['errors']} 错误  相对{results[0]['workers']}个worker {speedup:.2f}x")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"cpu_count": os.cpu_count(), "clients": args.clients, "duration": args.duration,
+                   "paths": paths, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入{args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,20 +12,79 @@ TEMPLATE_FOLDER = './dist'
 VIDEO_UPLOAD_FOLDER = './videos'
 COVER_UPLOAD_FOLDER = './covers'
 FACE_UPLOAD_FOLDER = './faces'
+IMAGE_VARIANT_FOLDER = './variants'
+MERGE_WORKERS = 2  # 后台合并视频分片的线程数
+IMAGE_WORKERS = None  # 生成缩略图的进程数，None表示CPU核数
 
 # 数据库配置
 MONGO_URI = 'mongodb://localhost:27017/mao'
+MONGO_MAX_POOL_SIZE = 100  # 每个进程的MongoDB连接池大小
+INDEX_RECONCILE_ON_STARTUP = True  # 启动时创建缺少的索引，也可用flask index sync手动执行
+REDIS_URL = 'redis://localhost:6379/0'
+REDIS_MAX_CONNECTIONS = 50  # 每个进程的Redis连接池大小，用完时请求会等待
 RATELIMIT_STORAGE_URI = "redis://localhost:6379"
 
+# 生产环境入口serve.py配置
+SERVE_WORKERS = 0  # worker进程数，0表示CPU核数
+SERVE_CONNECTIONS = 1000  # 每个worker同时处理的最大连接数
+
+# Socket.IO配置
+SOCKETIO_MESSAGE_QUEUE = REDIS_URL  # 多进程部署时必须设置，单进程可设为None
+SOCKETIO_ASYNC_MODE = None  # None为自动选择，serve.py会设为gevent
+# 多个进程共用一个端口时长轮询请求会落到不同进程，需要设为['websocket']；
+# 或者使用serve.py --separate-ports并在反向代理上按IP保持会话
+SOCKETIO_TRANSPORTS = None
+
+# 定时任务配置(秒)
+HOT_LIST_REFRESH_INTERVAL = 5 * 60
+DANMAKU_BROADCAST_INTERVAL = 0.1  # 实时弹幕合并推送的时间窗口
+VIEW_FLUSH_INTERVAL = 10  # 播放量写入数据库的间隔
+TRAFFIC_FLUSH_INTERVAL = 60  # 访问统计写入数据库的间隔
+POINT_LOG_FLUSH_INTERVAL = 5  # 积分经验日志写入数据库的间隔
+METRICS_PUBLISH_INTERVAL = 15  # 各进程把指标写入Redis的间隔
+
+# ID分配配置，每个进程一次从数据库预留的ID数量
+# aid和uid对用户可见，进程重启会浪费未用完的ID，所以默认每次只预留1个
+ID_BLOCK_SIZES = {
+    'danmaku_id': 1000,
+    'video_aid': 1,
+    'user_uid': 1,
+}
+
 # 邮件配置
 MAIL_SERVER = 'smtp.exmail.qq.com'
 MAIL_PORT = 465
 MAIL_USERNAME = ''
 MAIL_PASSWORD = ''
+MAIL_SENDER = ''  # 发件人地址，为空时使用MAIL_USERNAME
+MAIL_USE_SSL = True  # 本地测试用的SMTP服务器设为False
+MAIL_TIMEOUT = 30
+MAIL_MAX_IDLE = 60  # 连接空闲超过该秒数后，发送前先用NOOP检查连接
+MAIL_BATCH_SIZE = 20  # worker每批最多取出的邮件数，同一批邮件使用同一个连接发送
 
 # 第三方服务配置 - 腾讯云COS
 COS_SECRET_ID = ''
 COS_SECRET_KEY = ''
 COS_ENDPOINT = ''
 COS_BUCKET = ''
-COS_PUBLIC_URL = ''
\ No newline at end of file
+COS_PUBLIC_URL = ''
+COS_PART_SIZE = 10  # 大于该大小(MB)的文件分块上传
+COS_UPLOAD_THREADS = 5  # 分块上传的并发线程数
+COS_BACKEND = 'cos'  # 设为'local'时上传到LOCAL_OBJECT_STORE_DIR，用于本地测试
+LOCAL_OBJECT_STORE_DIR = './object_store'
+
+# COS代理配置
+PROXY_POOL_SIZE = 50  # 到COS的连接池大小
+PROXY_CACHE_DIR = './proxy_cache'  # 封面和头像的本地磁盘缓存
+PROXY_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 监控配置
+METRICS_TOKEN = ''  # 设置后访问/api/metrics需要带Authorization: Bearer <token>；为空时只允许本机直接访问(不经过反向代理)
+PROFILER_ENABLED = True
+PROFILER_MODE = 'sample'  # sample: 定时采样调用栈；cprofile: 对部分请求运行cProfile，gevent下只能用cprofile
+PROFILER_SLOW_THRESHOLD = 0.5  # 耗时超过该秒数的请求会保存性能分析
+PROFILER_KEEP_RATE = 0.001  # 其余请求随机保留的比例
+PROFILER_CPROFILE_RATE = 0.05  # cprofile模式下运行cProfile的请求比例
+PROFILER_SAMPLE_INTERVAL = 0.01  # sample模式的采样间隔(秒)
+PROFILER_DIR = './profiles'
+PROFILER_MAX_FILES = 500  # 超过后删除最旧的分析结果
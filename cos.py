@@ -1,19 +1,52 @@
+# 标准库导入
+import os
+import shutil
 # 第三方库导入
 from qcloud_cos import CosConfig, CosS3Client
 # 应用/模块内部导入
 import config
 
 
-cos_config = CosConfig(Endpoint=config.COS_ENDPOINT,
-                       SecretId=config.COS_SECRET_ID, SecretKey=config.COS_SECRET_KEY)
-cos_client = CosS3Client(cos_config)
+_cos_client = None
+
+
+def _reset_client():
+    global _cos_client
+    _cos_client = None
+
+
+# 客户端内部的HTTP连接不能在fork出的进程间共用
+os.register_at_fork(after_in_child=_reset_client)
+
+
+def get_cos_client():
+    """首次使用时创建COS客户端"""
+    global _cos_client
+    if _cos_client is None:
+        cos_config = CosConfig(Endpoint=config.COS_ENDPOINT,
+                               SecretId=config.COS_SECRET_ID, SecretKey=config.COS_SECRET_KEY)
+        _cos_client = CosS3Client(cos_config)
+    return _cos_client
+
+
+def upload_to_local(local_file_path, cos_file_name):
+    """上传到本地目录模拟的对象存储，用于开发和测试"""
+    target_path = os.path.join(config.LOCAL_OBJECT_STORE_DIR, cos_file_name)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    shutil.copyfile(local_file_path, target_path)
 
 
 def upload_to_cos(local_file_path, cos_file_name):
     """上传文件到腾讯云对象存储"""
     try:
-        cos_client.upload_file(Bucket=config.COS_BUCKET,
-                               LocalFilePath=local_file_path, Key=cos_file_name)
+        if getattr(config, 'COS_BACKEND', 'cos') == 'local':
+            upload_to_local(local_file_path, cos_file_name)
+        else:
+            # 大于PartSize(MB)的文件使用多线程分块上传
+            get_cos_client().upload_file(Bucket=config.COS_BUCKET,
+                                         LocalFilePath=local_file_path, Key=cos_file_name,
+                                         PartSize=getattr(config, 'COS_PART_SIZE', 10),
+                                         MAXThread=getattr(config, 'COS_UPLOAD_THREADS', 5))
         return True, ""
     except Exception as e:
         return False, f'错误: {e}'
@@ -1,14 +1,42 @@
 # 标准库导入
+import os
 import logging
 # 第三方库导入
-from redis import Redis
+from redis import Redis, BlockingConnectionPool
+from werkzeug.local import LocalProxy
 from flask_pymongo import PyMongo
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
 from flask_socketio import SocketIO
 
-redis_client = Redis(host='localhost', port=6379, decode_responses=True)
+_redis = None
+_redis_pid = None
+_redis_settings = {"url": "redis://localhost:6379/0", "max_connections": 50}
+
+
+def init_redis(app):
+    """从配置读取Redis地址和连接池大小，客户端在首次使用时创建"""
+    global _redis
+    _redis_settings["url"] = app.config.get('REDIS_URL', _redis_settings["url"])
+    _redis_settings["max_connections"] = app.config.get('REDIS_MAX_CONNECTIONS', _redis_settings["max_connections"])
+    _redis = None
+
+
+def get_redis():
+    """当前进程的Redis客户端，fork出的子进程会创建自己的连接池"""
+    global _redis, _redis_pid
+    if _redis is None or _redis_pid != os.getpid():
+        # 连接用完时等待而不是报错，协程数多于连接数时也能正常工作
+        pool = BlockingConnectionPool.from_url(
+            _redis_settings["url"], max_connections=_redis_settings["max_connections"],
+            timeout=5, decode_responses=True)
+        _redis = Redis(connection_pool=pool)
+        _redis_pid = os.getpid()
+    return _redis
+
+
+redis_client = LocalProxy(get_redis)
 
 mongo = PyMongo()
 
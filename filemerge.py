@@ -0,0 +1,86 @@
+# 标准库导入
+import os
+import errno
+
+
+BUFFER_SIZE = 1024 * 1024  # 内核复制不可用时的缓冲区大小
+
+# 这些错误表示当前文件系统或内核不支持该复制方式，需要退回下一种方式
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+_use_copy_file_range = hasattr(os, 'copy_file_range')
+_use_sendfile = hasattr(os, 'sendfile')
+
+
+def _copy_fd(src_fd, dst_fd, size):
+    """将src_fd当前位置起的size字节复制到dst_fd当前位置，返回复制的字节数
+
+    依次尝试copy_file_range、sendfile，都不可用时用固定大小的缓冲区复制，
+    数据不会整块读入Python内存。
+    """
+    global _use_copy_file_range, _use_sendfile
+    copied = 0
+
+    if _use_copy_file_range:
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            _use_copy_file_range = False
+
+    if _use_sendfile:
+        try:
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, None, size - copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            _use_sendfile = False
+
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while copied < size:
+        n = os.readv(src_fd, [view[:min(BUFFER_SIZE, size - copied)]])
+        if n == 0:
+            break
+        written = 0
+        while written < n:
+            written += os.write(dst_fd, view[written:n])
+        copied += n
+    return copied
+
+
+def merge_files(dst_path, src_paths, preallocate=True):
+    """按顺序将src_paths拼接写入dst_path，返回写入的总字节数"""
+    sizes = [os.path.getsize(path) for path in src_paths]
+    total = sum(sizes)
+
+    with open(dst_path, 'wb') as dst:
+        dst_fd = dst.fileno()
+
+        # 预先分配磁盘空间，减少碎片，空间不足时也能尽早失败
+        if preallocate and total and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(dst_fd, 0, total)
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+
+        written = 0
+        for path, size in zip(src_paths, sizes):
+            with open(path, 'rb') as src:
+                written += _copy_fd(src.fileno(), dst_fd, size)
+
+        # 预分配的空间多于实际写入时截断
+        os.ftruncate(dst_fd, written)
+
+    return written
@@ -0,0 +1,95 @@
+# 标准库导入
+import time
+# 第三方库导入
+from pymongo import DESCENDING, UpdateOne
+# 应用/模块内部导入
+from extensions import mongo
+import indexes
+
+
+def _adjust_counts(follower, followee, delta):
+    """同步调整双方的关注数和粉丝数"""
+    mongo.db.user.bulk_write([
+        UpdateOne({"uid": follower}, {"$inc": {"following_count": delta}}),
+        UpdateOne({"uid": followee}, {"$inc": {"followers_count": delta}})
+    ], ordered=False)
+
+
+def follow(follower, followee):
+    """关注用户，返回是否新增了关注"""
+    # (follower, followee)上有唯一索引，并发的重复关注只会插入一次
+    result = mongo.db.follow.update_one(
+        {"follower": follower, "followee": followee},
+        {"$setOnInsert": {"time": time.time()}},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        return False
+    _adjust_counts(follower, followee, 1)
+    return True
+
+
+def unfollow(follower, followee):
+    """取消关注，返回是否真的删除了关注"""
+    result = mongo.db.follow.delete_one({"follower": follower, "followee": followee})
+    if not result.deleted_count:
+        return False
+    _adjust_counts(follower, followee, -1)
+    return True
+
+
+def get_following_set(follower, followees):
+    """批量查询follower关注了给定用户中的哪些"""
+    followees = list(followees)
+    if not follower or not followees:
+        return set()
+    cursor = mongo.db.follow.find(
+        {"follower": follower, "followee": {"$in": followees}}, {"_id": 0, "followee": 1})
+    return {edge["followee"] for edge in cursor}
+
+
+def get_followers(uid, skip, limit):
+    """按关注时间倒序获取粉丝，返回[(uid, 关注时间)]"""
+    cursor = (mongo.db.follow.find({"followee": uid}, {"_id": 0, "follower": 1, "time": 1})
+              .sort([("time", DESCENDING)]).skip(skip).limit(limit))
+    return [(edge["follower"], edge["time"]) for edge in cursor]
+
+
+def get_following(uid, skip, limit):
+    """按关注时间倒序获取关注的用户，返回[(uid, 关注时间)]"""
+    cursor = (mongo.db.follow.find({"follower": uid}, {"_id": 0, "followee": 1, "time": 1})
+              .sort([("time", DESCENDING)]).skip(skip).limit(limit))
+    return [(edge["followee"], edge["time"]) for edge in cursor]
+
+
+def recount():
+    """根据关注边重新计算所有用户的关注数和粉丝数"""
+    mongo.db.user.update_many({}, {"$set": {"followers_count": 0, "following_count": 0}})
+
+    operations = []
+    for field, count_field in (("$followee", "followers_count"), ("$follower", "following_count")):
+        for item in mongo.db.follow.aggregate([{"$group": {"_id": field, "count": {"$sum": 1}}}]):
+            operations.append(UpdateOne({"uid": item["_id"]}, {"$set": {count_field: item["count"]}}))
+    if operations:
+        mongo.db.user.bulk_write(operations, ordered=False)
+
+
+def migrate_from_arrays():
+    """将用户文档中的following/followers数组迁移为关注边，返回迁移的关注数"""
+    indexes.reconcile(["follow"])
+
+    count = 0
+    for user in mongo.db.user.find({"following": {"$exists": True}}, {"uid": 1, "following": 1}):
+        # 旧数据没有关注时间，按数组顺序给出递增的时间以保留先后
+        operations = [UpdateOne(
+            {"follower": user["uid"], "followee": followee},
+            {"$setOnInsert": {"time": index}},
+            upsert=True
+        ) for index, followee in enumerate(user.get("following", []))]
+        if operations:
+            mongo.db.follow.bulk_write(operations, ordered=False)
+            count += len(operations)
+
+    recount()
+    mongo.db.user.update_many({}, {"$unset": {"following": "", "followers": ""}})
+    return count
@@ -1,12 +1,18 @@
 # 标准库导入
+import os
+import math
 import time
 
 # 第三方库导入
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, jsonify, request, session, send_file
 
 # 应用/模块内部导入
 from extensions import mongo
-from utils import login_required, admin_required
+from utils import login_required, admin_required, adjust_points_and_exp_bulk
+from response_cache import invalidate
+import profiler
+from sessions import revoke_user_sessions
+from user_snapshot import invalidate_user_snapshot
 
 bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
@@ -31,4 +37,79 @@ def hide_video(aid):
     if result.matched_count == 0:
         return jsonify({"message": "视频未找到"}), 404
 
+    invalidate(f"video:{aid}", "video:list")
     return jsonify({"message": "视频已隐藏"})
+
+
+@bp.route('/revoke_sessions/<int:uid>', methods=['POST'])
+@login_required
+@admin_required
+def revoke_sessions(uid):
+    """强制用户退出所有设备的登录"""
+    count = revoke_user_sessions(uid)
+    # 通常伴随封禁或撤销管理员，重新读取用户状态
+    invalidate_user_snapshot(uid)
+    return jsonify({"message": f"已撤销{count}个会话"})
+
+
+@bp.route('/adjust_points', methods=['POST'])
+@login_required
+@admin_required
+def adjust_points():
+    """批量调整用户的积分和经验"""
+    data = request.get_json(silent=True)
+    adjustments = data.get('adjustments') if isinstance(data, dict) else None
+
+    if not isinstance(adjustments, list):
+        return jsonify({"message": "adjustments必须是列表"}), 400
+    if not adjustments or len(adjustments) > 1000:
+        return jsonify({"message": "一次需要调整1-1000个用户"}), 400
+
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+    operator_uid = session['user']['uid']
+
+    for item in adjustments:
+        if not isinstance(item, dict) or not isinstance(item.get("uid"), int) or isinstance(item["uid"], bool) \
+                or not is_number(item.get("points", 0)) or not is_number(item.get("exp", 0)) \
+                or not isinstance(item.get("reason", ''), str):
+            return jsonify({"message": "调整项格式错误"}), 400
+        item.setdefault("points", 0)
+        item["reason"] = f"管理员{operator_uid}调整: {item.get('reason', '')}"
+
+    results = adjust_points_and_exp_bulk(adjustments)
+
+    return jsonify({"message": "调整完成", "results": [
+        {"uid": item["uid"], **result} for item, result in zip(adjustments, results)]})
+
+
+@bp.route('/profiles', methods=['GET'])
+@login_required
+@admin_required
+def list_profiles():
+    """按耗时从高到低列出最近保存的请求性能分析"""
+    if profiler.store is None:
+        return jsonify({"message": "性能分析未开启"}), 404
+    limit = min(request.args.get('limit', default=50, type=int), 500)
+    endpoint = request.args.get('endpoint')
+
+    profiles = [meta for meta in profiler.store.list()
+                if not endpoint or meta.get("endpoint") == endpoint]
+    profiles.sort(key=lambda meta: meta["duration"], reverse=True)
+    return jsonify({"data": profiles[:limit]})
+
+
+@bp.route('/profiles/<string:profile_id>', methods=['GET'])
+@login_required
+@admin_required
+def download_profile(profile_id):
+    """下载性能分析文件，collapsed可直接用于flamegraph，pstats可用pstats或snakeviz查看"""
+    if profiler.store is None:
+        return jsonify({"message": "性能分析未开启"}), 404
+    found = profiler.store.get(profile_id)
+    if not found:
+        return jsonify({"message": "性能分析不存在或已被轮转删除"}), 404
+    path, meta = found
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path),
+                     mimetype='text/plain' if meta["format"] == "collapsed" else 'application/octet-stream')
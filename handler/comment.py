@@ -1,15 +1,55 @@
 # 标准库导入
 from datetime import datetime
 # 第三方库导入
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
 from flask import Blueprint, jsonify, request, session
 # 应用/模块内部导入
 from extensions import mongo
-from utils import login_required, adjust_points_and_exp, get_exp_rank
+from utils import login_required, adjust_points_and_exp
+from user_profile import get_user_profiles
+import leaderboard
 
 
 bp = Blueprint('comment', __name__, url_prefix='/api/comment')
 
 ALLOWED_PAGE_TYPES = ["video", "index", "log", "about", "faq", "rank"]
+COMMENT_PAGE_SIZE = 20
+MAX_COMMENT_PAGE_SIZE = 50
+
+
+def get_next_comment_floor(page_type, aid):
+    """原子地分配下一个评论楼层号"""
+    if aid is not None:
+        video = mongo.db.video.find_one_and_update(
+            {"aid": aid},
+            {"$inc": {"last_comment_floor": 1}},
+            projection={"last_comment_floor": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if video:
+            return video["last_comment_floor"]
+
+    # 没有对应视频的页面（首页、日志等）使用counter计数
+    counter = mongo.db.counter.find_one_and_update(
+        {"_id": f"comment_floor_{page_type}"},
+        {"$inc": {"sequence_value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["sequence_value"]
+
+
+def encode_cursor(comment):
+    """根据一页的最后一条评论生成翻页游标"""
+    return f"{comment['time']}_{comment['_id']}"
+
+
+def decode_cursor(cursor):
+    """解析翻页游标，格式错误时抛出ValueError或InvalidId"""
+    comment_time, comment_id = cursor.rsplit('_', 1)
+    return float(comment_time), ObjectId(comment_id)
 
 
 def is_on_cool_down(uid, content):
@@ -47,10 +87,7 @@ def post_comment(page_type, aid):
     if is_on_cool_down(uid, content):
         return jsonify({"message": "请等待3秒后再评论或确保内容不与上一次相同"}), 400
 
-    # 获取视频的最后一个评论楼层号
-    video = mongo.db.video.find_one({"aid": aid})
-    last_comment_floor = video.get("last_comment_floor", 0) if video else 0
-    new_floor = last_comment_floor + 1
+    new_floor = get_next_comment_floor(page_type, aid)
 
     comment = {
         "aid": aid,
@@ -63,10 +100,7 @@ def post_comment(page_type, aid):
         "page_type": page_type
     }
 
-    # 在插入评论后，更新视频的最后一个评论楼层号
     mongo.db.comment.insert_one(comment)
-    mongo.db.video.update_one(
-        {"aid": aid}, {"$set": {"last_comment_floor": new_floor}})
     mongo.db.comment_cool_down.update_one(
         {"uid": uid},
         {"$set": {"time": datetime.now().timestamp(), "content": content}},
@@ -134,39 +168,78 @@ def post_reply(page_type, comment_id):
 @bp.route('/<string:page_type>', defaults={'aid': None}, methods=['GET'])
 @bp.route('/<string:page_type>/<int:aid>', methods=['GET'])
 def get_comments(page_type, aid):
-    """获取评论"""
+    """按时间倒序分页获取评论"""
     if page_type not in ALLOWED_PAGE_TYPES:
         return jsonify({"message": "Invalid URL"}), 400
 
+    count = request.args.get('count', default=COMMENT_PAGE_SIZE, type=int)
+    count = min(max(count, 1), MAX_COMMENT_PAGE_SIZE)
+
     # 检索与给定类型和aid匹配的评论
     filter_criteria = {"page_type": page_type}
     if aid is not None:
         filter_criteria["aid"] = aid
 
-    cursor = mongo.db.comment.find(filter_criteria).sort("time", -1)
-    comments = list(cursor)
-
-    total_floor = len(comments)  # 获取评论的总数
-
-    for index, comment in enumerate(comments):
+    # 从游标位置继续往后翻页，(time, _id)保证顺序稳定
+    cursor_token = request.args.get('cursor')
+    if cursor_token:
+        try:
+            cursor_time, cursor_id = decode_cursor(cursor_token)
+        except (ValueError, InvalidId):
+            return jsonify({"message": "无效的翻页游标"}), 400
+        filter_criteria["$or"] = [
+            {"time": {"$lt": cursor_time}},
+            {"time": cursor_time, "_id": {"$lt": cursor_id}}
+        ]
+
+    comments = list(mongo.db.comment.find(filter_criteria)
+                    .sort([("time", -1), ("_id", -1)])
+                    .limit(count + 1))
+    has_more = len(comments) > count
+    comments = comments[:count]
+    next_cursor = encode_cursor(comments[-1]) if has_more else None
+
+    # 一次性查询本页所有评论和回复作者的名称与排名
+    uids = []
+    for comment in comments:
+        uids.append(comment["uid"])
+        uids.extend(reply["uid"] for reply in comment.get("replies", []))
+    profiles = get_user_profiles(uids)
+    ranks = leaderboard.get_ranks(profiles.keys())
+
+    for comment in comments:
         comment["_id"] = str(comment["_id"])
-
-        user = mongo.db.user.find_one({"uid": comment["uid"]})
-        comment["username"] = user["name"] if user else "未知"
-        if user:
-            comment["exp_rank"] = get_exp_rank(user['checkin']['experience'])
-        else:
-            comment["exp_rank"] = "未知"
-
-        for reply in comment['replies']:
-            reply_user = mongo.db.user.find_one({"uid": reply["uid"]})
-            reply['username'] = reply_user['name'] if reply_user else "未知"
-            if reply_user:
-                reply["exp_rank"] = get_exp_rank(
-                    reply_user['checkin']['experience'])
-            else:
-                reply["exp_rank"] = "未知"
-
-        comment["floor"] = total_floor - index  # 逆向分配楼层号
-
-    return jsonify(comments)
+        for item in [comment] + comment.get("replies", []):
+            profile = profiles.get(item["uid"])
+            item["username"] = profile["name"] if profile else "未知"
+            item["exp_rank"] = ranks.get(item["uid"], "未知")
+
+    return jsonify({"data": comments, "next_cursor": next_cursor, "hasMore": has_more})
+
+
+@bp.cli.command('renumber-floors')
+def renumber_floors_command():
+    """按发布时间重新计算已有评论的楼层号"""
+    groups = mongo.db.comment.aggregate([
+        {"$group": {"_id": {"page_type": "$page_type", "aid": "$aid"}}}
+    ])
+
+    for group in groups:
+        page_type, aid = group["_id"].get("page_type"), group["_id"].get("aid")
+        cursor = mongo.db.comment.find(
+            {"page_type": page_type, "aid": aid}, {"_id": 1}).sort([("time", 1), ("_id", 1)])
+        operations = [UpdateOne({"_id": comment["_id"]}, {"$set": {"floor": floor}})
+                      for floor, comment in enumerate(cursor, start=1)]
+        if not operations:
+            continue
+        mongo.db.comment.bulk_write(operations, ordered=False)
+        print(f"{page_type} {aid}: {len(operations)}层")
+
+        # 同步楼层计数器，保证新评论从正确的楼层继续
+        if aid is not None:
+            result = mongo.db.video.update_one(
+                {"aid": aid}, {"$set": {"last_comment_floor": len(operations)}})
+            if result.matched_count:
+                continue
+        mongo.db.counter.update_one({"_id": f"comment_floor_{page_type}"},
+                                    {"$set": {"sequence_value": len(operations)}}, upsert=True)
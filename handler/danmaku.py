@@ -1,26 +1,139 @@
 # 标准库导入
+import math
 import time
+import logging
+import threading
 # 标准库导入
 from datetime import datetime
 # 第三方库导入
-from flask import Blueprint, jsonify, request, session
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from flask import Blueprint, jsonify, request, session, current_app
+from flask_socketio import join_room, leave_room
 # 应用/模块内部导入
-from extensions import mongo
+from extensions import mongo, socketio
 from utils import login_required, adjust_points_and_exp
+from idgen import danmaku_ids
+from response_cache import cached, invalidate
+import indexes
 
 bp = Blueprint('danmaku', __name__, url_prefix='/api/danmaku')
+logger = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 6 * 60  # 每6分钟的弹幕存为一个分段
+# 每个分段文档最多保存的弹幕数，写满后存入同一分段的下一个part，避免热门视频的文档无限增长
+SEGMENT_MAX_DANMAKUS = 2000
+APPEND_ATTEMPTS = 5  # 并发写满part时最多向后尝试的part数
+SOCKET_NAMESPACE = '/danmaku'
+
+# 等待推送的弹幕，按aid分组，每个时间窗口合并推送一次
+_pending_broadcasts = {}
+_broadcast_lock = threading.Lock()
+_broadcaster_started = False
+
+
+def to_seconds(video_time):
+    """将前端传来的视频时间转换为秒数，无法解析或不是有限数时视为0"""
+    try:
+        seconds = float(video_time)
+    except (TypeError, ValueError):
+        return 0
+    return max(seconds, 0) if math.isfinite(seconds) else 0
+
+
+def get_segment(video_time):
+    """获取视频时间所在的分段编号"""
+    return int(to_seconds(video_time) // SEGMENT_SECONDS)
+
+
+def append_danmaku(aid, segment, danmaku):
+    """将弹幕写入分段的最后一个part，写满时新建下一个part"""
+    last = mongo.db.danmaku_segment.find_one(
+        {"aid": aid, "segment": segment}, {"_id": 0, "part": 1}, sort=[("part", -1)])
+    part = max(last.get("part", 0), 0) if last else 0
+    for attempt in range(APPEND_ATTEMPTS):
+        try:
+            # part已满时条件不匹配，upsert会因唯一索引冲突失败，改写下一个part
+            mongo.db.danmaku_segment.update_one(
+                {"aid": aid, "segment": segment, "part": part, "count": {"$lt": SEGMENT_MAX_DANMAKUS}},
+                {"$push": {"danmakus": danmaku}, "$inc": {"count": 1}},
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            # 还没有执行migrate-segments时旧的唯一索引也会冲突，不能无限重试
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+            part += 1
+
+
+def split_parts(danmakus):
+    """把迁移的弹幕按上限分成多个part，使用负的编号，不会和新写入的part冲突"""
+    chunks = [danmakus[i:i + SEGMENT_MAX_DANMAKUS] for i in range(0, len(danmakus), SEGMENT_MAX_DANMAKUS)]
+    return [(index - len(chunks), chunk) for index, chunk in enumerate(chunks)]
+
+
+def format_danmaku(dm):
+    """返回给前端的弹幕字段"""
+    return {
+        'danmaku_id': dm['danmaku_id'],
+        'content': dm['content'],
+        'video_time': dm['video_time'],
+        'color': dm['color'],
+        'type': dm['type']
+    }
+
+
+def _broadcast_loop(interval):
+    """每个时间窗口把积累的弹幕批量推送给对应视频的房间"""
+    global _pending_broadcasts
+    while True:
+        socketio.sleep(interval)
+        # 任务只启动一次，单次推送失败(如消息队列的Redis不可用)不能让循环退出
+        try:
+            with _broadcast_lock:
+                batch, _pending_broadcasts = _pending_broadcasts, {}
+            for aid, danmakus in batch.items():
+                try:
+                    socketio.emit('danmaku', danmakus, to=str(aid),
+                                  namespace=SOCKET_NAMESPACE)
+                except Exception:
+                    logger.exception("视频%s的%d条弹幕推送失败", aid, len(danmakus))
+        except Exception:
+            logger.exception("弹幕推送任务执行失败")
+
+
+def queue_broadcast(aid, danmaku):
+    """将新弹幕加入待推送队列，首次调用时启动推送任务"""
+    global _broadcaster_started
+    with _broadcast_lock:
+        _pending_broadcasts.setdefault(aid, []).append(danmaku)
+        if _broadcaster_started:
+            return
+        _broadcaster_started = True
+    interval = current_app.config.get('DANMAKU_BROADCAST_INTERVAL', 0.1)
+    socketio.start_background_task(_broadcast_loop, interval)
+
+
+@socketio.on('join', namespace=SOCKET_NAMESPACE)
+def on_join(data):
+    """进入视频的弹幕房间"""
+    try:
+        join_room(str(int(data.get('aid'))))
+    except (AttributeError, TypeError, ValueError):
+        return {"state": "error", "message": "无效的aid"}
+    return {"state": "succeed"}
+
+
+@socketio.on('leave', namespace=SOCKET_NAMESPACE)
+def on_leave(data):
+    """离开视频的弹幕房间"""
+    try:
+        leave_room(str(int(data.get('aid'))))
+    except (AttributeError, TypeError, ValueError):
+        return {"state": "error", "message": "无效的aid"}
+    return {"state": "succeed"}
 
-def get_next_danmaku_id():
-    """从counter数据库获取下一个弹幕ID"""
-    result = mongo.db.counter.find_one_and_update(
-        {"_id": "danmaku_id"},
-        {"$inc": {"sequence_value": 1}},
-        return_document=True,  # 返回更新后的文档
-        upsert=True,  # 如果文档不存在则创建
-        new=True  # 确保返回更新后的文档
-    )
-    return result["sequence_value"]
-    
 
 @bp.route('/send', methods=['POST'])
 @login_required
@@ -39,48 +152,94 @@ def send_danmaku():
     # 获取用户UID、当前时间戳和下一个弹幕ID
     uid = session['user']['uid']
     timestamp = time.time()
-    danmaku_id = get_next_danmaku_id()
-
-    # 更新数据库
-    mongo.db.danmaku.update_one(
-        {"aid": aid},
-        {
-            "$push": {
-                "danmakus": {
-                    "danmaku_id": danmaku_id,
-                    "uid": uid,
-                    "content": content,
-                    "color": color,
-                    "type": danmaku_type,
-                    "video_time": video_time,
-                    "timestamp": timestamp
-                }
-            }
-        },
-        upsert=True
-    )
+    danmaku_id = danmaku_ids.next()
+
+    danmaku = {
+        "danmaku_id": danmaku_id,
+        "uid": uid,
+        "content": content,
+        "color": color,
+        "type": danmaku_type,
+        "video_time": video_time,
+        "timestamp": timestamp
+    }
+
+    # 按视频时间存入对应分段
+    append_danmaku(aid, get_segment(video_time), danmaku)
     mongo.db.video.update_one({"aid": aid},{"$inc": {"data.danmaku": 1}})
     adjust_points_and_exp(session['user']['uid'], -0.2, 0.2, reason=f"在视频aid:{aid}下发送弹幕")
+    invalidate(f"danmaku:{aid}", f"video:{aid}")
+    queue_broadcast(aid, {**format_danmaku(danmaku), 'timestamp': timestamp})
     return jsonify(state="succeed", message="弹幕发送成功", danmaku_id=danmaku_id), 200
 
 
 @bp.route('/<int:aid>', methods=['GET'])
+@cached(ttl=10, tags=lambda aid: [f"danmaku:{aid}"])
 def get_danmakus(aid):
-    """获取指定视频的全部弹幕"""
+    """获取指定视频的弹幕，可用from和to(秒)只获取即将播放的区间"""
+    time_from = request.args.get('from', type=float)
+    time_to = request.args.get('to', type=float)
+    if any(value is not None and not math.isfinite(value) for value in (time_from, time_to)):
+        return jsonify(state="error", message="from和to必须是有限的数字"), 400
+
+    segment_filter = {"aid": aid}
+    if time_from is not None or time_to is not None:
+        segment_range = {}
+        if time_from is not None:
+            segment_range["$gte"] = get_segment(time_from)
+        if time_to is not None:
+            segment_range["$lte"] = get_segment(time_to)
+        segment_filter["segment"] = segment_range
+
+    segments = mongo.db.danmaku_segment.find(
+        segment_filter, {"_id": 0, "danmakus": 1}).sort([("segment", 1), ("part", 1)])
+
+    danmakus_filtered = []
+    for segment in segments:
+        for dm in segment.get('danmakus', []):
+            # 分段边界处的弹幕再按精确时间过滤
+            dm_time = to_seconds(dm['video_time'])
+            if time_from is not None and dm_time < time_from:
+                continue
+            if time_to is not None and dm_time >= time_to:
+                continue
+            danmakus_filtered.append(format_danmaku(dm))
+
+    return jsonify(danmakus=danmakus_filtered), 200
+
+
+def _write_parts(aid, segments):
+    """写入迁移的分段，返回写入的文档数
+
+    使用$addToSet，中途失败后重新执行不会产生重复弹幕
+    """
+    operations = [UpdateOne(
+        {"aid": aid, "segment": segment, "part": part},
+        {"$addToSet": {"danmakus": {"$each": chunk}}, "$set": {"count": len(chunk)}},
+        upsert=True
+    ) for segment, danmakus in segments.items() for part, chunk in split_parts(danmakus)]
+    if operations:
+        mongo.db.danmaku_segment.bulk_write(operations, ordered=False)
+    return len(operations)
 
-    video_data = mongo.db.danmaku.find_one({"aid": aid})
 
-    if video_data:
-        danmakus = video_data.get('danmakus', [])
+@bp.cli.command('migrate-segments')
+def migrate_segments_command():
+    """将旧的单文档弹幕和没有part的分段迁移为按时间分段、按数量分part存储"""
+    # 旧的(aid, segment)唯一索引不允许同一分段有多个part
+    if "aid_1_segment_1" in mongo.db.danmaku_segment.index_information():
+        mongo.db.danmaku_segment.drop_index("aid_1_segment_1")
+    indexes.reconcile(["danmaku_segment"])
 
-        danmakus_filtered = [{
-            'danmaku_id': dm['danmaku_id'],
-            'content': dm['content'],
-            'video_time': dm['video_time'],
-            'color': dm['color'],
-            'type': dm['type']
-        } for dm in danmakus]
-    else:
-        danmakus_filtered = []
+    for video_data in mongo.db.danmaku.find():
+        segments = {}
+        for dm in video_data.get('danmakus', []):
+            segments.setdefault(get_segment(dm.get('video_time')), []).append(dm)
+        parts = _write_parts(video_data["aid"], segments)
+        mongo.db.danmaku.delete_one({"_id": video_data["_id"]})
+        print(f"aid {video_data['aid']}: {len(video_data.get('danmakus', []))}条弹幕，{parts}个文档")
 
-    return jsonify(danmakus=danmakus_filtered), 200
\ No newline at end of file
+    for segment_data in mongo.db.danmaku_segment.find({"part": {"$exists": False}}):
+        parts = _write_parts(segment_data["aid"], {segment_data["segment"]: segment_data.get("danmakus", [])})
+        mongo.db.danmaku_segment.delete_one({"_id": segment_data["_id"]})
+        print(f"aid {segment_data['aid']} 分段{segment_data['segment']}: 拆分为{parts}个文档")
@@ -0,0 +1,32 @@
+# 标准库导入
+import ipaddress
+# 第三方库导入
+from flask import Blueprint, Response, current_app, request
+# 应用/模块内部导入
+import metrics
+
+bp = Blueprint('monitor', __name__, url_prefix='/api')
+
+
+def is_direct_local_request():
+    """请求是否由本机直接发起；经过反向代理转发的请求remote_addr也是本机，带转发头时不算"""
+    if request.headers.get('X-Forwarded-For') or request.headers.get('X-Real-IP'):
+        return False
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """以Prometheus文本格式输出所有进程的指标"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        authorized = request.headers.get('Authorization') == f"Bearer {token}"
+    else:
+        # 未设置token时只允许本机直接访问
+        authorized = is_direct_local_request()
+    if not authorized:
+        return Response("unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,48 +1,140 @@
 # 标准库导入
 import time
 # 第三方库导入
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from pymongo import UpdateOne
 # 应用/模块内部导入
-from extensions import mongo
+from extensions import mongo, redis_client
+from scheduler import periodic
 from utils import get_real_ip
+from response_cache import cached
 
 bp = Blueprint('online', __name__, url_prefix='/api/online')
 
+# 统计粒度及每个时间桶的秒数
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+PV_KEY = "traffic:pv:{}:{}"
+UV_KEY = "traffic:uv:{}:{}"
+DIRTY_KEY = "traffic:dirty"  # 有新访问、尚未写入数据库的时间桶
+CLOSE_GRACE_SECONDS = 5  # 时间桶结束后再等待一段时间才视为不再变化
+MAX_RANGE_BUCKETS = 1440
+
 
 @bp.route('/visited', methods=['POST'])
 def visited():
-    """接受前端的访问记录存入数据库"""
-    current_hour_timestamp = int(time.time()) // 3600 * 3600
-
-    visits_collection = mongo.db.visit
-    visit = visits_collection.find_one(
-        {'hour_timestamp': current_hour_timestamp})
+    """接受前端的访问记录，计入Redis中各粒度的访问量和独立访客"""
+    now = int(time.time())
+    client_ip = get_real_ip(request)
 
-    if visit:
-        visits_collection.update_one(
-            {'hour_timestamp': current_hour_timestamp}, {'$inc': {'count': 1}})
-    else:
-        visits_collection.insert_one(
-            {'hour_timestamp': current_hour_timestamp, 'count': 1})
+    pipe = redis_client.pipeline(transaction=False)
+    for resolution, seconds in RESOLUTIONS.items():
+        bucket = now // seconds * seconds
+        pv_key = PV_KEY.format(resolution, bucket)
+        uv_key = UV_KEY.format(resolution, bucket)
+        pipe.incr(pv_key)
+        pipe.pfadd(uv_key, client_ip)
+        # 保留到时间桶结束后一天，足够定时任务写入数据库
+        pipe.expire(pv_key, seconds + 86400)
+        pipe.expire(uv_key, seconds + 86400)
+        pipe.sadd(DIRTY_KEY, f"{resolution}:{bucket}")
+    pipe.execute()
 
     return jsonify({'message': '访问已经统计'}), 200
 
 
+@periodic('TRAFFIC_FLUSH_INTERVAL', 60)
+def flush_traffic():
+    """将Redis中的访问统计写入数据库，返回写入的时间桶数"""
+    now = time.time()
+    buckets = []
+    for member in redis_client.smembers(DIRTY_KEY):
+        resolution, bucket = member.split(':')
+        buckets.append((member, resolution, int(bucket)))
+    if not buckets:
+        return 0
+
+    pipe = redis_client.pipeline(transaction=False)
+    for _, resolution, bucket in buckets:
+        pipe.get(PV_KEY.format(resolution, bucket))
+        pipe.pfcount(UV_KEY.format(resolution, bucket))
+    results = pipe.execute()
+
+    # 写入的是绝对值，重复执行不会重复计数
+    operations = []
+    for index, (_, resolution, bucket) in enumerate(buckets):
+        pv, uv = results[index * 2], results[index * 2 + 1]
+        operations.append(UpdateOne(
+            {"resolution": resolution, "timestamp": bucket},
+            {"$set": {"pv": int(pv or 0), "uv": uv}},
+            upsert=True
+        ))
+    mongo.db.traffic.bulk_write(operations, ordered=False)
+
+    # 已经结束的时间桶不会再变化，之后无需再写入
+    closed = [member for member, resolution, bucket in buckets
+              if bucket + RESOLUTIONS[resolution] + CLOSE_GRACE_SECONDS < now]
+    if closed:
+        redis_client.srem(DIRTY_KEY, *closed)
+
+    return len(operations)
+
+
+def get_traffic(resolution, start, end):
+    """读取[start, end]内预聚合的访问统计，缺失的时间桶补0"""
+    seconds = RESOLUTIONS[resolution]
+    start = start // seconds * seconds
+    end = end // seconds * seconds
+
+    records = mongo.db.traffic.find(
+        {"resolution": resolution, "timestamp": {"$gte": start, "$lte": end}},
+        {"_id": 0, "timestamp": 1, "pv": 1, "uv": 1})
+    records = {record["timestamp"]: record for record in records}
+
+    return [{
+        "timestamp": bucket,
+        "pv": records.get(bucket, {}).get("pv", 0),
+        "uv": records.get(bucket, {}).get("uv", 0)
+    } for bucket in range(start, end + 1, seconds)]
+
+
+@bp.route('/traffic', methods=['GET'])
+def get_traffic_range():
+    """按指定粒度获取时间范围内的访问量(pv)和独立访客数(uv)"""
+    resolution = request.args.get('resolution', default='hour')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"message": "resolution只能是minute、hour或day"}), 400
+    seconds = RESOLUTIONS[resolution]
+
+    end = request.args.get('to', default=int(time.time()), type=int)
+    start = request.args.get('from', default=end - 23 * seconds, type=int)
+    if start > end:
+        return jsonify({"message": "from不能大于to"}), 400
+    if (end - start) // seconds >= MAX_RANGE_BUCKETS:
+        return jsonify({"message": f"一次最多查询{MAX_RANGE_BUCKETS}个时间段"}), 400
+
+    return jsonify(resolution=resolution, data=get_traffic(resolution, start, end)), 200
+
+
 @bp.route('/get_last_24h_visits', methods=['GET'])
+@cached(ttl=60)
 def get_last_24h_visits():
     """获取过去24小时的访问记录"""
-    current_hour_timestamp = int(time.time()) // 3600 * 3600
-    last_24_hour_timestamps = [
-        current_hour_timestamp - 3600*i for i in range(24)]
+    now = int(time.time())
+    traffic = get_traffic("hour", now - 23 * 3600, now)
 
-    visits_collection = mongo.db.visit
-    visits = list(visits_collection.find(
-        {'hour_timestamp': {'$in': last_24_hour_timestamps}}))
+    data = {str(item["timestamp"]): item["pv"] for item in reversed(traffic)}
 
-    data = {str(hour_timestamp)
-                : 0 for hour_timestamp in last_24_hour_timestamps}
+    return jsonify(data), 200
 
-    for visit in visits:
-        data[str(visit['hour_timestamp'])] = visit['count']
 
-    return jsonify(data), 200
+@bp.cli.command('migrate-visits')
+def migrate_visits_command():
+    """将旧的按小时访问记录导入新的统计集合"""
+    operations = [UpdateOne(
+        {"resolution": "hour", "timestamp": visit["hour_timestamp"]},
+        {"$setOnInsert": {"pv": visit["count"], "uv": 0}},
+        upsert=True
+    ) for visit in mongo.db.visit.find()]
+    if operations:
+        mongo.db.traffic.bulk_write(operations, ordered=False)
+    print(f"已导入{len(operations)}条小时访问记录")
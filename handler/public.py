@@ -1,31 +1,213 @@
+# 标准库导入
+import os
+import json
+import hashlib
+import tempfile
+import threading
 # 第三方库导入
 import requests
-from flask import request, Blueprint, make_response, current_app
+from requests.adapters import HTTPAdapter
+from flask import request, Blueprint, Response, current_app, jsonify, send_file
+from werkzeug.http import parse_date
+# 应用/模块内部导入
+import metrics
+from utils import login_required, admin_required
 
 
 bp = Blueprint('public', __name__, url_prefix='/api/public')
 
+CHUNK_SIZE = 64 * 1024
+# 只缓存封面和头像这类小文件，视频直接流式转发
+CACHEABLE_PREFIXES = ('covers', 'face')
+# 转发给COS的请求头
+FORWARD_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since',
+                   'Accept', 'User-Agent')
+# 逐跳头部不能原样返回
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer',
+                      'upgrade', 'proxy-authenticate', 'proxy-authorization'}
 
-@bp.route('/cos/<path:subpath>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+
+
+def _reset_session():
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+# 连接池中的连接不能在fork出的进程间共用
+os.register_at_fork(after_in_child=_reset_session)
+
+
+def get_session():
+    """复用连接池的HTTP会话，首次使用时创建"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = current_app.config.get('PROXY_POOL_SIZE', 50)
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+            _session = session
+    return _session
+
+
+class DiskLRUCache:
+    """按总大小限制的磁盘LRU缓存，最近访问时间记录在文件的mtime上"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory)
+                         if entry.is_file() and not entry.name.endswith(('.json', '.tmp')))
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """返回(文件路径, 元信息)，未命中返回None"""
+        path = self._path(key)
+        try:
+            with open(f"{path}.json", encoding='utf-8') as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return path, meta
+
+    def temp_file(self):
+        """在缓存目录中创建临时文件，写完后用put放入缓存"""
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+
+    def put(self, key, temp_path, meta):
+        path = self._path(key)
+        with open(f"{path}.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._size += meta["size"]
+            self.stats["stores"] += 1
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """删除最久未访问的文件，直到总大小降到上限的90%"""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.directory)
+                         if entry.is_file() and not entry.name.endswith(('.json', '.tmp')))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, path in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            for file_path in (path, f"{path}.json"):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            size -= file_size
+            self.stats["evictions"] += 1
+        with self._lock:
+            self._size = size
+
+
+def get_cache():
+    """封面和头像的磁盘缓存，首次使用时按配置创建"""
+    global _cache
+    if _cache is None:
+        _cache = DiskLRUCache(current_app.config.get('PROXY_CACHE_DIR', './proxy_cache'),
+                              current_app.config.get('PROXY_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+        metrics.register_cache("cos_proxy", _cache.stats)
+    return _cache
+
+
+def stream_upstream(upstream, cache=None, key=None, meta=None):
+    """逐块转发COS的响应，传入cache时同时写入缓存，完整读完才放入缓存"""
+    temp = cache.temp_file() if cache else None
+    complete = False
+    try:
+        for chunk in upstream.raw.stream(CHUNK_SIZE, decode_content=False):
+            if temp:
+                temp.write(chunk)
+            yield chunk
+        complete = True
+    finally:
+        upstream.close()
+        if temp:
+            temp.close()
+            if complete:
+                cache.put(key, temp.name, {**meta, "size": os.path.getsize(temp.name)})
+            else:
+                os.remove(temp.name)
+
+
+# 只读：上传和删除由后端直接调用COS接口完成，不能经由代理修改存储桶
+@bp.route('/cos/<path:subpath>', methods=['GET', 'HEAD'])
 def proxy(subpath):
     """代理COS资源"""
     method = request.method
-    data = request.get_data()
+    cacheable = method == 'GET' and subpath.startswith(CACHEABLE_PREFIXES)
+
+    # 命中缓存时直接返回本地文件，Range和If-None-Match由send_file处理
+    if cacheable:
+        cached = get_cache().get(subpath)
+        if cached:
+            path, meta = cached
+            last_modified = meta.get("last_modified")
+            response = send_file(path, mimetype=meta.get("content_type"), conditional=True,
+                                 etag=meta.get("etag") or True,
+                                 last_modified=parse_date(last_modified) if last_modified else None)
+            response.headers['X-Cache'] = 'HIT'
+            return response
 
-    resp = requests.request(
+    upstream = get_session().request(
         method=method,
         url=f"{current_app.config['COS_PUBLIC_URL']}/{subpath}",
-        headers={key: value for (key, value)
-                 in request.headers if key != 'Host'},
-        data=data,
-        cookies=request.cookies,
-        allow_redirects=False  # 让Flask处理重定向
+        headers={key: request.headers[key] for key in FORWARD_HEADERS if key in request.headers},
+        stream=True,
+        allow_redirects=False,  # 让Flask处理重定向
+        timeout=(5, 60)
     )
 
-    response = make_response(resp.content, resp.status_code)
-    for key, value in resp.headers.items():
-        # 排除Transfer-Encoding和Connection头部，因为会报错
-        if key.lower() not in ['transfer-encoding', 'connection']:
-            response.headers[key] = value
+    headers = [(key, value) for key, value in upstream.headers.items()
+               if key.lower() not in HOP_BY_HOP_HEADERS]
+
+    # 只缓存完整、未压缩的成功响应
+    if (cacheable and upstream.status_code == 200 and 'Range' not in request.headers
+            and 'Content-Encoding' not in upstream.headers):
+        body = stream_upstream(upstream, get_cache(), subpath, {
+            "content_type": upstream.headers.get('Content-Type'),
+            "etag": upstream.headers.get('ETag', '').strip('"') or None,
+            "last_modified": upstream.headers.get('Last-Modified')
+        })
+        headers.append(('X-Cache', 'MISS'))
+    else:
+        body = stream_upstream(upstream)
+
+    if method == 'HEAD':
+        upstream.close()
+        body = b''
+
+    return Response(body, status=upstream.status_code, headers=headers, direct_passthrough=True)
+
 
-    return response
+@bp.route('/cos-cache/stats', methods=['GET'])
+@login_required
+@admin_required
+def cache_stats():
+    """代理磁盘缓存的命中统计"""
+    cache = get_cache()
+    lookups = cache.stats["hits"] + cache.stats["misses"]
+    return jsonify({
+        **cache.stats,
+        "hit_rate": cache.stats["hits"] / lookups if lookups else 0,
+        "size": cache._size,
+        "max_size": cache.max_bytes
+    })
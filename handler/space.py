@@ -3,10 +3,15 @@ from flask import Blueprint, jsonify, request, session
 # 应用/模块内部导入
 from extensions import mongo
 from utils import get_exp_rank, login_required
+from user_profile import fill_video_user_names, get_user_profiles
+from likes import mark_liked
+import follows
 
 
 bp = Blueprint('space', __name__, url_prefix='/api/space')
 
+MAX_FOLLOW_PAGE_SIZE = 50
+
 
 @bp.route('/videos/<int:uid>', methods=['GET'])
 def get_videos_by_uid(uid):
@@ -30,16 +35,8 @@ def get_videos_by_uid(uid):
     for video in videos:
         del video["_id"]
 
-        user = mongo.db.user.find_one({"uid": video["uid"]})
-        video["uploader_name"] = user.get("name") if user else "未知"
-
-        if "hidden" in video and "uid" in video["hidden"]:
-            operator = mongo.db.user.find_one({"uid": video["hidden"]["uid"]})
-            video["hidden"]["operator_name"] = operator.get(
-                "name") if operator else "未知"
-            video["hidden"].pop("uid", None)
-        elif "hidden" in video:
-            video["hidden"]["operator_name"] = "未知"
+    fill_video_user_names(videos)
+    mark_liked(session.get('user', {}).get('uid'), videos)
 
     return jsonify({"data": videos, "hasMore": has_more})
 
@@ -47,7 +44,8 @@ def get_videos_by_uid(uid):
 @bp.route('/<int:uid>', methods=['GET'])
 def get_uid_info(uid):
     """获取指定用户的信息"""
-    user_info = mongo.db.user.find_one({'uid': uid})
+    user_info = mongo.db.user.find_one(
+        {'uid': uid}, {"name": 1, "time": 1, "checkin": 1, "followers_count": 1, "following_count": 1})
 
     if not user_info:
         return jsonify(state='error', message='用户名未找到'), 404
@@ -59,8 +57,8 @@ def get_uid_info(uid):
         "registration_time": user_info.get("time"),
         "experience": user_exp,
         "exp_rank": get_exp_rank(user_exp),  # 添加用户的经验排名
-        "followers_count": len(user_info.get("followers", [])),
-        "following_count": len(user_info.get("following", []))
+        "followers_count": user_info.get("followers_count", 0),
+        "following_count": user_info.get("following_count", 0)
     }
 
     return jsonify(data)
@@ -75,44 +73,87 @@ def follow_user(target_uid):  # target_uid 表示想关注或取消关注的用
     if current_uid == target_uid:
         return jsonify(state='error', message='不能关注自己')
 
-    coll = mongo.db.user
-    target_user = coll.find_one({"uid": target_uid})
-
-    if not target_user:
+    if not mongo.db.user.find_one({"uid": target_uid}, {"_id": 1}):
         return jsonify(state='error', message='用户名不存在'), 404
 
-    current_user = coll.find_one({"uid": current_uid})
-
     # 如果用户已经关注了这个UP主，则取消关注
-    if target_uid in current_user.get("following", []):
-        coll.update_one({"uid": current_uid}, {
-                        "$pull": {"following": target_uid}})
-        coll.update_one({"uid": target_uid}, {
-                        "$pull": {"followers": current_uid}})
+    if follows.unfollow(current_uid, target_uid):
         return jsonify(state='succeed', message='取消关注成功')
 
     # 否则，添加到关注列表中
-    coll.update_one({"uid": current_uid}, {"$push": {"following": target_uid}})
-    coll.update_one({"uid": target_uid}, {"$push": {"followers": current_uid}})
+    follows.follow(current_uid, target_uid)
     return jsonify(state='succeed', message='关注成功')
 
 
 @bp.route('/is_following/<int:target_uid>', methods=['GET'])
 def is_following(target_uid):
     """检查当前用户是否关注了目标用户"""
-    current_uid = session['user']['uid']
+    current_uid = session.get('user', {}).get('uid')
 
     if not current_uid:
         return jsonify(state='error', message='用户未登录'), 401
 
-    coll = mongo.db.user
+    if target_uid in follows.get_following_set(current_uid, [target_uid]):
+        return jsonify(state='succeed', isFollowing=True, message='当前用户已关注目标用户')
+
+    return jsonify(state='succeed', isFollowing=False, message='当前用户未关注目标用户')
 
-    current_user = coll.find_one({"uid": current_uid})
 
-    if not current_user:
-        return jsonify(state='error', message='当前用户不存在'), 404
+@bp.route('/is_following', methods=['GET'])
+def is_following_many():
+    """批量检查当前用户是否关注了uids中的用户，uids用逗号分隔"""
+    current_uid = session.get('user', {}).get('uid')
 
-    if target_uid in current_user.get("following", []):
-        return jsonify(state='succeed', isFollowing=True, message='当前用户已关注目标用户')
+    if not current_uid:
+        return jsonify(state='error', message='用户未登录'), 401
 
-    return jsonify(state='succeed', isFollowing=False, message='当前用户未关注目标用户')
+    try:
+        target_uids = [int(uid) for uid in request.args.get('uids', '').split(',') if uid]
+    except ValueError:
+        return jsonify(state='error', message='uids格式错误'), 400
+    if len(target_uids) > 100:
+        return jsonify(state='error', message='一次最多查询100个用户'), 400
+
+    following = follows.get_following_set(current_uid, target_uids)
+    return jsonify(state='succeed', data={str(uid): uid in following for uid in target_uids})
+
+
+def follow_list_response(get_page, uid):
+    """分页返回关注或粉丝列表"""
+    start = request.args.get('start', default=1, type=int)
+    count = request.args.get('count', default=20, type=int)
+    count = min(max(count, 1), MAX_FOLLOW_PAGE_SIZE)
+
+    page_number = max((start - 1) // count, 0)
+    skip_amount = page_number * count
+
+    edges = get_page(uid, skip_amount, count + 1)
+    has_more = len(edges) > count
+    edges = edges[:count]
+
+    profiles = get_user_profiles([edge_uid for edge_uid, _ in edges])
+    data = [{
+        "uid": edge_uid,
+        "name": profiles.get(edge_uid, {}).get("name", "未知"),
+        "follow_time": follow_time
+    } for edge_uid, follow_time in edges]
+
+    return jsonify({"data": data, "hasMore": has_more})
+
+
+@bp.route('/<int:uid>/followers', methods=['GET'])
+def get_followers(uid):
+    """获取指定用户的粉丝列表"""
+    return follow_list_response(follows.get_followers, uid)
+
+
+@bp.route('/<int:uid>/following', methods=['GET'])
+def get_following(uid):
+    """获取指定用户关注的用户列表"""
+    return follow_list_response(follows.get_following, uid)
+
+
+@bp.cli.command('migrate-follows')
+def migrate_follows_command():
+    """将用户文档中的关注数组迁移为关注边"""
+    print(f"已迁移{follows.migrate_from_arrays()}条关注记录")
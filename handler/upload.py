@@ -1,20 +1,53 @@
 # 标准库导入
 import os
+import re
+import sys
 import time
+import logging
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 # 第三方库导入
 from uuid import uuid4
 from flask import Blueprint, request, jsonify, current_app, session
 from werkzeug.utils import secure_filename
-from redis.lock import Lock
-import redis
+from redis.client import NEVER_DECODE
+import click
 # 应用/模块内部导入
-from extensions import mongo, limiter
+from extensions import mongo, limiter, redis_client
 from utils import login_required, adjust_points_and_exp, get_real_ip
-from cos import upload_to_cos
+from idgen import video_aids
+from filemerge import merge_files
+from imaging import schedule_variants
+from upload_queue import enqueue_upload, run_worker
+from response_cache import invalidate
 
 bp = Blueprint('upload', __name__, url_prefix='/api/upload')
-r = redis.StrictRedis(host='localhost', port=6379, db=0)
+
+# 分片上传的接收情况记录在Redis位图中
+CHUNK_BITMAP_KEY = "upload:chunks:{}"
+CHUNK_META_KEY = "upload:chunk_meta:{}"
+CHUNK_TTL = 24 * 3600  # 一天内可以断点续传
+MAX_CHUNKS = 10000
+UNIQUE_ID_PATTERN = re.compile(r'^[0-9a-zA-Z_-]{1,64}$')
+MERGE_STATUS_KEY = "upload:merge:{}"
+# 超过该秒数仍为merging的任务视为进程崩溃后遗留，可以重新合并
+MERGE_STALE_SECONDS = 3600
+
+# 没有合并任务、上次失败或上次合并已超时时才开始新的合并
+CLAIM_MERGE_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+local updated_at = tonumber(redis.call('HGET', KEYS[1], 'updated_at') or '0')
+if state and state ~= 'error' and not (state == 'merging' and tonumber(ARGV[1]) - updated_at > tonumber(ARGV[2])) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', 'merging', 'message', '', 'uid', ARGV[3], 'updated_at', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+logger = logging.getLogger(__name__)
+_merge_executor = None
 
 
 def get_video_upload_folder():
@@ -32,23 +65,6 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower()
 
 
-def get_next_sequence_value(sequence_name):
-    """从counter数据库获取下一个视频ID"""
-    coll = mongo.db.counter
-    sequence_document = coll.find_one_and_update(
-        {'_id': sequence_name},
-        {'$inc': {'sequence_value': 1}},
-        upsert=True,
-        return_document=True
-    )
-
-    if not sequence_document:
-        coll.insert_one({'_id': sequence_name, 'sequence_value': 1})
-        return 1
-    else:
-        return sequence_document["sequence_value"]
-
-
 # def retry(exception_to_check, tries=3, delay=2, backoff=2):
 #     """
 #     重试装饰
@@ -113,7 +129,7 @@ def submit_form():
     """提交视频"""
     client_ip = get_real_ip(request)
     lock_name = f"submit_lock_{client_ip}"
-    lock = Lock(r, lock_name, timeout=60)  # 锁定60秒
+    lock = redis_client.lock(lock_name, timeout=60)  # 锁定60秒
 
     forbidden_tags = ["自制", "转载", "游戏", "生活", "知识", "科技",
                       "音乐", "鬼畜", "动画", "时尚", "舞蹈", "娱乐", "美食", "动物"]
@@ -144,22 +160,8 @@ def submit_form():
         video_path = os.path.join(video_upload_folder, f"{unique_id}.mp4")
         video_extension = "mp4"  # 合并后的文件是MP4格式
 
-        cover_filename = secure_filename(cover_file.filename)
-        cover_path = os.path.join(cover_upload_folder, cover_filename)
-        _, cover_extension = os.path.splitext(cover_filename)
-        cover_extension = cover_extension[1:].lower()
-
-        cover_file.save(cover_path)
-
-        current_aid = get_next_sequence_value("video_aid")
-
-        # 修改上传到 COS 的路径名
-        cos_video_path = f"videos_original/{current_aid}.{video_extension}"
-        cos_cover_path = f"covers_original/{current_aid}.jpg"
-
-        upload_to_cos(video_path, cos_video_path)
-
-        upload_to_cos(cover_path, cos_cover_path)
+        _, cover_extension = os.path.splitext(secure_filename(cover_file.filename))
+        cover_extension = cover_extension.lower()
 
         tags = request.form.get("tags").split(',')
         if len(tags) != len(set(tags)):
@@ -180,6 +182,16 @@ def submit_form():
         if len(tags) != len(set(tags)):
             return "标签重复，请检查并重新提交", 400
 
+        current_aid = video_aids.next()
+
+        # 封面由后台worker稍后读取，按aid命名，避免同名文件被其它投稿覆盖
+        cover_path = os.path.join(cover_upload_folder, f"{current_aid}{cover_extension}")
+        cover_file.save(cover_path)
+
+        # 修改上传到 COS 的路径名
+        cos_video_path = f"videos_original/{current_aid}.{video_extension}"
+        cos_cover_path = f"covers_original/{current_aid}.jpg"
+
         coll = mongo.db.video
         coll.insert_one({
             'aid': current_aid,
@@ -204,8 +216,18 @@ def submit_form():
                 "is_hidden": False,  # 默认不隐藏
                 'reason': '',
                 'grade': ''  # TODO: 视频封禁等级 1:仅隐藏，不删除视频 2:直接删除视频
+            },
+            "upload_status": {
+                "video": "pending",
+                "cover": "pending"
             }
         })
+
+        # 上传到COS由后台worker完成，不占用当前请求
+        enqueue_upload(video_path, cos_video_path, aid=current_aid, kind="video")
+        enqueue_upload(cover_path, cos_cover_path, aid=current_aid, kind="cover")
+        schedule_variants(cover_path, "cover", "video", {"aid": current_aid})
+        invalidate("video:list")
         adjust_points_and_exp(
             session['user']['uid'], -1, 1, reason=f"发布{current_aid}视频")
     finally:
@@ -214,66 +236,240 @@ def submit_form():
     return jsonify(state='success', message='提交成功', aid=current_aid)
 
 
+def get_chunk_upload(unique_id):
+    """读取分片上传的元信息，不存在时返回None"""
+    meta = redis_client.hgetall(CHUNK_META_KEY.format(unique_id))
+    if not meta:
+        return None
+    return {
+        'uid': int(meta['uid']),
+        'total': int(meta['total']),
+        'size': int(meta['size']) if meta.get('size') else None
+    }
+
+
+def get_missing_chunks(unique_id, total):
+    """根据位图找出还没有收到的分片序号"""
+    # 一次读出整个位图在本地解析；客户端开启了decode_responses，位图需要按原始字节读取
+    bitmap = redis_client.execute_command('GET', CHUNK_BITMAP_KEY.format(unique_id), **{NEVER_DECODE: []}) or b''
+    # Redis位图中第i位是第i // 8个字节从高位起的第i % 8位
+    return [i for i in range(total)
+            if i // 8 >= len(bitmap) or not bitmap[i // 8] >> (7 - i % 8) & 1]
+
+
+def get_chunk_path(video_upload_folder, unique_id, chunk_index):
+    """分片文件的路径"""
+    return os.path.join(video_upload_folder, f"{unique_id}_chunk_{chunk_index}.part")
+
+
 @bp.route('/video/chunk', methods=['POST'])
 @login_required
 def upload_video_chunk():
-    """上传视频分片"""
+    """上传视频分片，分片可以并行、乱序上传"""
     if 'file' not in request.files:
         return jsonify(state='error', message='无文件'), 400
 
     chunk = request.files['file']
-    unique_id = request.form.get('unique_id')
-    chunk_index = int(request.form.get('index', 0))
+    unique_id = request.form.get('unique_id', '')
+    chunk_index = request.form.get('index', default=0, type=int)
+    total_chunks = request.form.get('total', type=int)
+    total_size = request.form.get('size', type=int)
+    uid = session['user']['uid']
+
+    if not UNIQUE_ID_PATTERN.match(unique_id):
+        return jsonify(state='error', message='无效的unique_id'), 400
+
+    # 第一个到达的分片登记分片总数和文件大小
+    meta_key = CHUNK_META_KEY.format(unique_id)
+    if not redis_client.exists(meta_key):
+        if not total_chunks or not 0 < total_chunks <= MAX_CHUNKS:
+            return jsonify(state='error', message=f'分片总数total需要在1-{MAX_CHUNKS}之间'), 400
+        pipe = redis_client.pipeline()
+        pipe.hsetnx(meta_key, 'uid', uid)
+        pipe.hsetnx(meta_key, 'total', total_chunks)
+        if total_size:
+            pipe.hsetnx(meta_key, 'size', total_size)
+        pipe.expire(meta_key, CHUNK_TTL)
+        pipe.execute()
+
+    upload_info = get_chunk_upload(unique_id)
+    if not upload_info:
+        return jsonify(state='error', message='上传记录已过期，请重新上传'), 404
+    if upload_info['uid'] != uid:
+        return jsonify(state='error', message='无权上传该视频的分片'), 403
+    if not 0 <= chunk_index < upload_info['total']:
+        return jsonify(state='error', message='分片序号超出范围'), 400
 
     video_upload_folder = get_video_upload_folder()
 
     if not os.path.exists(video_upload_folder):
-        os.makedirs(video_upload_folder)
+        os.makedirs(video_upload_folder, exist_ok=True)
 
-    chunk_filename = f"{unique_id}_chunk_{chunk_index}.part"
-    chunk_path = os.path.join(video_upload_folder, chunk_filename)
+    chunk_path = get_chunk_path(video_upload_folder, unique_id, chunk_index)
     chunk.save(chunk_path)
 
-    coll = mongo.db.video_chunk
-    coll.insert_one({
-        'chunk_filename': chunk_filename,
-        'index': chunk_index,
-        'unique_id': unique_id,
-        'uploaded_at': time.time(),
-        'uid': session['user']['uid']
-    })
+    # 文件保存成功后才在位图中标记该分片
+    bitmap_key = CHUNK_BITMAP_KEY.format(unique_id)
+    pipe = redis_client.pipeline()
+    pipe.setbit(bitmap_key, chunk_index, 1)
+    pipe.expire(bitmap_key, CHUNK_TTL)
+    pipe.expire(meta_key, CHUNK_TTL)
+    pipe.execute()
 
-    return jsonify(state='success', message='分片上传成功', chunk_filename=chunk_filename)
+    return jsonify(state='success', message='分片上传成功', chunk_filename=os.path.basename(chunk_path))
+
+
+@bp.route('/video/chunk/<string:unique_id>', methods=['GET'])
+@login_required
+def get_chunk_status(unique_id):
+    """查询分片上传进度，返回缺失的分片序号以便断点续传"""
+    upload_info = get_chunk_upload(unique_id) if UNIQUE_ID_PATTERN.match(unique_id) else None
+    if not upload_info:
+        return jsonify(state='error', message='上传记录不存在或已过期'), 404
+    if upload_info['uid'] != session['user']['uid']:
+        return jsonify(state='error', message='无权查看该上传'), 403
+
+    missing = get_missing_chunks(unique_id, upload_info['total'])
+
+    return jsonify(state='success', total=upload_info['total'], size=upload_info['size'],
+                   received=upload_info['total'] - len(missing), missing=missing)
 
 
 @bp.route('/video/merge', methods=['POST'])
 @login_required
 def merge_video_chunk():
     """合并视频分片"""
-    unique_id = request.json.get('unique_id')
-    total_chunks = int(request.json.get('total', 0))
+    unique_id = request.json.get('unique_id', '')
+
+    upload_info = get_chunk_upload(unique_id) if UNIQUE_ID_PATTERN.match(unique_id) else None
+    if not upload_info:
+        return jsonify(state='error', message='上传记录不存在或已过期'), 404
+    if upload_info['uid'] != session['user']['uid']:
+        return jsonify(state='error', message='无权合并该视频'), 403
+
+    # 一次位图计数确认分片是否齐全，不齐全时再找出缺失的分片
+    total_chunks = upload_info['total']
+    if redis_client.bitcount(CHUNK_BITMAP_KEY.format(unique_id)) != total_chunks:
+        missing = get_missing_chunks(unique_id, total_chunks)
+        return jsonify(state='error', message=f'分片 {missing[0]} 丢失', missing=missing), 400
 
     video_upload_folder = get_video_upload_folder()
     merged_video_path = os.path.join(video_upload_folder, f"{unique_id}.mp4")
 
-    # 为了效率，预先生成所有要合并的分片的文件路径
-    chunk_paths = []
-    for i in range(total_chunks):
-        chunk_info = mongo.db.video_chunk.find_one(
-            {'unique_id': unique_id, 'index': i})
-        if not chunk_info:
-            return jsonify(state='error', message=f'分片 {i} 丢失'), 500
-        chunk_paths.append(os.path.join(
-            video_upload_folder, chunk_info['chunk_filename']))
-
-    # 使用with语句确保文件描述符在完成后关闭
-    with open(merged_video_path, 'wb') as merged_file:
-        for chunk_path in chunk_paths:
-            with open(chunk_path, 'rb') as chunk_file:
-                merged_file.write(chunk_file.read())
-            os.remove(chunk_path)  # 确保删除每个已合并的分片
-
-    # 删除与此 unique_id 相关的所有分片记录
-    mongo.db.video_chunk.delete_many({'unique_id': unique_id})
-
-    return jsonify(state='success', message='视频合并成功', filename=f"{unique_id}.mp4")
+    chunk_paths = [get_chunk_path(video_upload_folder, unique_id, i)
+                   for i in range(total_chunks)]
+
+    if upload_info['size'] and sum(os.path.getsize(path) for path in chunk_paths) != upload_info['size']:
+        return jsonify(state='error', message='分片总大小与声明的文件大小不一致'), 400
+
+    # 同一个视频只允许一个合并任务，上次合并失败或超时未完成时可以重试
+    if not redis_client.eval(CLAIM_MERGE_SCRIPT, 1, MERGE_STATUS_KEY.format(unique_id),
+                             time.time(), MERGE_STALE_SECONDS, upload_info['uid'], CHUNK_TTL):
+        return get_merge_status(unique_id)
+
+    # 合并在后台进行，客户端轮询合并状态
+    start_merge(unique_id, merged_video_path, chunk_paths)
+
+    return jsonify(state='merging', message='视频合并中', filename=f"{unique_id}.mp4"), 202
+
+
+@bp.route('/video/merge/<string:unique_id>', methods=['GET'])
+@login_required
+def get_merge_status(unique_id):
+    """查询视频合并状态"""
+    status = redis_client.hgetall(MERGE_STATUS_KEY.format(unique_id))
+    # 只有上传者可以查询，其他人得到与不存在相同的结果
+    if not status or status.get('uid') != str(session['user']['uid']):
+        return jsonify(state='error', message='合并任务不存在或已过期'), 404
+
+    if status['state'] == 'done':
+        return jsonify(state='success', message='视频合并成功', filename=f"{unique_id}.mp4")
+    if status['state'] == 'error':
+        return jsonify(state='error', message=status.get('message') or '视频合并失败'), 500
+    return jsonify(state='merging', message='视频合并中', filename=f"{unique_id}.mp4"), 202
+
+
+def _gevent_patched():
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    return bool(gevent_monkey and gevent_monkey.is_module_patched('threading'))
+
+
+def get_merge_executor():
+    """合并任务线程池，首次使用时按配置创建
+
+    gevent下普通线程是协程，合并文件的系统调用会阻塞整个进程，这时返回gevent的原生线程池。
+    """
+    global _merge_executor
+    if _merge_executor is None:
+        max_workers = current_app.config.get('MERGE_WORKERS', 2)
+        if _gevent_patched():
+            from gevent.threadpool import ThreadPool
+            _merge_executor = ThreadPool(max_workers)
+        else:
+            _merge_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='merge')
+    return _merge_executor
+
+
+def start_merge(unique_id, merged_video_path, chunk_paths):
+    """在后台合并分片"""
+    executor = get_merge_executor()
+    if _gevent_patched():
+        # Redis客户端的连接池和套接字都是gevent对象，不能在原生线程中使用：
+        # 只有文件操作交给线程池，合并状态由协程写入
+        import gevent
+        gevent.spawn(run_merge, unique_id, merged_video_path, chunk_paths,
+                     lambda func, *args: executor.apply(func, args))
+    else:
+        executor.submit(run_merge, unique_id, merged_video_path, chunk_paths)
+
+
+def _remove_files(paths):
+    """删除文件，返回删除失败的数量"""
+    failed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            failed += 1
+    return failed
+
+
+def run_merge(unique_id, merged_video_path, chunk_paths, run_blocking=None):
+    """合并分片，完成后更新合并状态；run_blocking(func, *args)决定文件操作在哪个线程执行"""
+    run_blocking = run_blocking or (lambda func, *args: func(*args))
+    status_key = MERGE_STATUS_KEY.format(unique_id)
+    try:
+        run_blocking(merge_files, merged_video_path, chunk_paths)
+    except Exception as e:
+        logger.exception("视频%s合并失败", unique_id)
+        redis_client.hset(status_key, mapping={
+            'state': 'error', 'message': f'视频合并失败: {e}', 'updated_at': time.time()})
+        return
+
+    # 合并成功后删除分片文件和分片记录，清理失败不影响合并结果
+    try:
+        failed = run_blocking(_remove_files, chunk_paths)
+        if failed:
+            logger.warning("视频%s有%d个分片文件删除失败", unique_id, failed)
+        redis_client.delete(CHUNK_BITMAP_KEY.format(unique_id), CHUNK_META_KEY.format(unique_id))
+    except Exception:
+        logger.exception("视频%s合并后清理分片失败", unique_id)
+    redis_client.hset(status_key, mapping={'state': 'done', 'updated_at': time.time()})
+
+
+def _run_upload_worker():
+    from main import app
+    run_worker(app)
+
+
+@bp.cli.command('worker')
+@click.option('--processes', default=2, help='worker进程数')
+def upload_worker_command(processes):
+    """启动上传到对象存储的worker"""
+    # 使用spawn，子进程各自创建MongoDB和Redis连接
+    ctx = get_context('spawn')
+    workers = [ctx.Process(target=_run_upload_worker) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -3,21 +3,24 @@ import time
 import random
 import os
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.header import Header
 # 第三方库导入
 import bcrypt
-import smtplib
+import click
 from flask import Blueprint, request, session, jsonify, current_app
-import redis
-from redis.lock import Lock
 # 应用/模块内部导入
-from extensions import mongo, limiter
+from extensions import mongo, limiter, redis_client
 from utils import login_required, adjust_points_and_exp, get_exp_rank, get_real_ip
-from cos import upload_to_cos
+from user_profile import get_user_profiles, invalidate_user_profile
+from user_snapshot import get_user_snapshot, invalidate_user_snapshot
+from sessions import revoke_user_sessions
+from idgen import user_uids
+import leaderboard
+from upload_queue import enqueue_upload
+from imaging import schedule_variants
+from response_cache import cached
+from mailer import enqueue_mail
 
 bp = Blueprint('user', __name__, url_prefix='/api/user')
-r = redis.StrictRedis(host='localhost', port=6379, db=0)
 
 
 def bcrypt_hash(password):
@@ -39,6 +42,7 @@ def signin():
     user = coll.find_one({'email': request_json['email']})
     if user is not None:
         if bcrypt_check(str(request_json['password']), user['password']):
+            session.regenerate()
             session['user'] = {
                 'uid': user['uid'],
                 'signin': True,
@@ -56,7 +60,7 @@ def signup():
     """注册"""
     client_ip = get_real_ip(request)
     lock_name = f"signup_lock_{client_ip}"
-    lock = Lock(r, lock_name, timeout=300)  # 锁定300秒，限制每个IP每5分钟只能注册一次
+    lock = redis_client.lock(lock_name, timeout=300)  # 锁定300秒，限制每个IP每5分钟只能注册一次
 
     # 非阻塞模式下尝试获取锁
     if not lock.acquire(blocking=False):
@@ -85,10 +89,7 @@ def signup():
             return jsonify(state='error', message='名字长度需要在3-10之间')
 
         if coll.find_one({'email': email}) is None:
-            if coll.find_one() is None:
-                uid = 1
-            else:
-                uid = coll.find_one(sort=[('_id', -1)])['uid'] + 1
+            uid = user_uids.next()
             hashed_password, salt = bcrypt_hash(str(request_json['password']))
             document = {
                 'uid': uid,
@@ -100,6 +101,7 @@ def signup():
                 'status': 0,
             }
             coll.insert_one(document)
+            leaderboard.update_experience(uid, 0)
             return jsonify(state='succeed', message='注册成功')
         else:
             return jsonify(state='error', message='电子邮件已存在')
@@ -115,11 +117,6 @@ def signup_auth():
 
     request_json = request.get_json()
 
-    smtp = smtplib.SMTP_SSL(
-        current_app.config['MAIL_SERVER'], current_app.config['MAIL_PORT'])
-    smtp.login(user=current_app.config['MAIL_USERNAME'],
-               password=current_app.config['MAIL_PASSWORD'])
-    # TODO: 这里或许可以优化
     mail_msg = f'''
     <div style="border:3px solid #25ACE3; border-radius: 7px; margin: 10px; padding: 20px;">
     <div style="text-align: center;">
@@ -138,14 +135,6 @@ def signup_auth():
         <span style='text-align: center; font-size:2px color: #666;'>BiliRZ 2023 © All Rights Reserved</span>
     </div>
     '''
-    message = MIMEText(mail_msg, 'html', 'utf-8')
-    message['From'] = current_app.config['MAIL_USERNAME']
-    message['To'] = request_json['email']
-    message['Subject'] = Header('猫猫站 - 点击查看验证码', 'utf-8')
-
-    smtp.sendmail(from_addr=current_app.config['MAIL_USERNAME'],
-                  to_addrs=request_json['email'], msg=message.as_string())
-
     document = {
         'email': request_json['email'],
         'auth': auth,
@@ -154,6 +143,8 @@ def signup_auth():
 
     mongo.db.user_auth.replace_one(
         {'email': request_json['email']}, document, upsert=True)
+    # 由邮件worker通过保持的SMTP连接发送，不阻塞当前请求
+    enqueue_mail(request_json['email'], '猫猫站 - 点击查看验证码', mail_msg)
 
     return jsonify(state='succeed', message='验证邮件已发送')
 
@@ -164,14 +155,13 @@ def checkin():
     """签到"""
     # 获取当前用户
     uid = session['user']['uid']
-    user = mongo.db.user.find_one({"uid": uid})
+    user = get_user_snapshot(uid)
 
     if not user:
         return jsonify(state='error', message='用户不存在')
 
     # 获取上次签到时间
-    last_checkin_timestamp = user["checkin"].get(
-        'last_checkin') if "checkin" in user else None
+    last_checkin_timestamp = user["last_checkin"]
     last_checkin = datetime.fromtimestamp(
         last_checkin_timestamp) if last_checkin_timestamp else None
 
@@ -180,12 +170,19 @@ def checkin():
     if last_checkin and now - last_checkin < timedelta(hours=8):
         return jsonify(state='error', message='还未到签到时间，每8小时可签到一次。')
 
-    mongo.db.user.update_one(
-        {"uid": uid},
+    # 快照可能是旧的，由带条件的更新保证8小时内只能签到一次
+    result = mongo.db.user.update_one(
+        {"uid": uid, "$or": [
+            {"checkin.last_checkin": None},
+            {"checkin.last_checkin": {"$lte": (now - timedelta(hours=8)).timestamp()}},
+        ]},
         {
             "$set": {"checkin.last_checkin": now.timestamp()},
         }
     )
+    if not result.modified_count:
+        return jsonify(state='error', message='还未到签到时间，每8小时可签到一次。')
+    invalidate_user_snapshot(uid)
     # 更新签到时间、经验和积分
     adjust_points_and_exp(uid, 10, 10, reason=f"签到")
 
@@ -195,28 +192,20 @@ def checkin():
 @bp.route('/session/get', methods=['GET'])
 def getSession():
     """获取session"""
-    coll = mongo.db.user
     if 'user' in session:
-        user = coll.find_one({"uid": session['user']['uid']})
-
-        # 检查并初始化checkin字段
-        if "checkin" not in user:
-            user["checkin"] = {
-                'last_checkin': None,
-                'experience': 0,
-                'points': 0
-            }
-            coll.update_one({"uid": session['user']['uid']}, {
-                            "$set": {"checkin": user["checkin"]}})
+        # 用户快照缓存在Redis中，不需要查询数据库
+        user = get_user_snapshot(session['user']['uid'])
+        if not user:
+            session.clear()
+            return jsonify({'signin': False, 'status': 0, 'state': 'no_session'})
 
-        last_checkin_timestamp = user["checkin"].get(
-            'last_checkin') if "checkin" in user else None
+        last_checkin_timestamp = user['last_checkin']
         now_timestamp = datetime.now().timestamp()
 
         can_checkin = not last_checkin_timestamp or now_timestamp - \
             last_checkin_timestamp >= 8 * 3600  # 8 hours in seconds
 
-        user_exp = user["checkin"].get('experience', 0)
+        user_exp = user['experience']
 
         return jsonify({
             **session['user'],
@@ -227,7 +216,7 @@ def getSession():
                 'can_checkin': can_checkin,
                 'last_checkin': last_checkin_timestamp,  # 直接返回时间戳
                 'experience': user_exp,
-                'points': user["checkin"].get('points', 0),
+                'points': user['points'],
                 'exp_rank': get_exp_rank(user_exp)  # 返回经验排名
             }
         })
@@ -242,6 +231,14 @@ def signout():
     return jsonify(state='succeed', message='成功登出')
 
 
+@bp.route('/sessions/revoke', methods=['POST'])
+@login_required
+def revoke_other_sessions():
+    """退出当前设备以外的所有登录"""
+    count = revoke_user_sessions(session['user']['uid'], keep_sid=session.sid)
+    return jsonify(state='succeed', message=f'已退出{count}个其它设备的登录')
+
+
 @bp.route('/update', methods=['POST'])
 @login_required
 def update_profile():
@@ -254,7 +251,6 @@ def update_profile():
         return jsonify(state='error', message='名字为必填项'), 400
 
     uid = session['user'].get('uid')
-    error_message = None
 
     adjust_points_and_exp(uid, -5, 5, reason="修改头像或名字")
 
@@ -263,43 +259,70 @@ def update_profile():
             return jsonify(state='error', message='封面大小超过5M，请重新上传'), 400
 
         filename = f"{uid}.jpg"
-        temp_path = os.path.join(
+        face_path = os.path.join(
             current_app.config['FACE_UPLOAD_FOLDER'], filename)
-        face_file.save(temp_path)
-
-        cos_file_path = f"face_original/{filename}"
-        success, error_message = upload_to_cos(temp_path, cos_file_path)
-
-        os.remove(temp_path)
+        face_file.save(face_path)
 
-        # 如果上传到COS出现错误，返回错误消息
-        if not success:
-            return jsonify(state='error', message=error_message), 500
+        # 原图上传和缩略图生成都在后台完成
+        enqueue_upload(face_path, f"face_original/{filename}")
+        schedule_variants(face_path, "face", "user", {"uid": uid})
 
     # 更新数据库
     coll.update_one({"uid": uid}, {"$set": {"name": new_name}})
+    invalidate_user_profile(uid)
+    invalidate_user_snapshot(uid)
     return jsonify(state='succeed', message='名字修改成功'), 200
 
 
+def format_rank_entries(entries):
+    """将排行榜条目补充上用户名和注册时间"""
+    profiles = get_user_profiles([uid for uid, _, _ in entries])
+
+    result = []
+    for uid, experience, rank in entries:
+        profile = profiles.get(uid, {})
+        result.append({
+            "name": profile.get("name"),
+            "uid": uid,
+            "experience": experience,
+            "time": profile.get("time"),
+            "rank": rank
+        })
+    return result
+
+
 @bp.route('/rank', methods=['GET'])
+@cached(ttl=60)
 def get_rank():
     """获取经验排行榜"""
-    top_users_cursor = mongo.db.user.find().sort(
-        [("checkin.experience", -1)]).limit(30)
+    return jsonify(format_rank_entries(leaderboard.get_top(30)))
 
-    top_users_list = list(top_users_cursor)
 
-    result = []
-    rank = 1  # 初始化排名计数器
-    for user in top_users_list:
-        user_data = {
-            "name": user.get("name"),
-            "uid": user.get("uid"),
-            "experience": user.get("checkin", {}).get("experience", 0),
-            "time": user.get("time"),
-            "rank": rank  # 在每个用户数据中加入排名信息
-        }
-        result.append(user_data)
-        rank += 1  # 更新排名计数器
-
-    return jsonify(result)
+@bp.route('/rank/around', methods=['GET'])
+@login_required
+def get_rank_around():
+    """获取当前用户前后的经验排名"""
+    radius = min(request.args.get('radius', default=5, type=int), 50)
+    entries = leaderboard.get_around(session['user']['uid'], radius)
+    return jsonify(format_rank_entries(entries))
+
+
+@bp.cli.command('rebuild-rank')
+def rebuild_rank_command():
+    """从MongoDB重建经验排行榜"""
+    count = leaderboard.rebuild()
+    print(f"排行榜重建完成，共{count}个用户")
+
+
+@bp.cli.command('set-status')
+@click.argument('uid', type=int)
+@click.argument('status', type=int)
+def set_status_command(uid, status):
+    """设置用户状态(1为管理员，0为普通用户)"""
+    result = mongo.db.user.update_one({"uid": uid}, {"$set": {"status": status}})
+    if not result.matched_count:
+        print(f"用户{uid}不存在")
+        return
+    # 管理员权限由缓存的用户状态判断，修改后立即失效
+    invalidate_user_snapshot(uid)
+    print(f"用户{uid}的状态已设为{status}")
@@ -1,17 +1,29 @@
-# 标准库导入
-import math
-from datetime import datetime, timedelta
 # 第三方库导入
 from flask import Blueprint, jsonify, request, session
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from redis.exceptions import ResponseError
 # 应用/模块内部导入
-from extensions import mongo
+from extensions import mongo, redis_client
+from scheduler import periodic
 from utils import login_required, adjust_points_and_exp, get_real_ip
+from user_profile import fill_video_user_names
+from likes import toggle_like, get_liked_aids, mark_liked, get_liked_page, migrate_from_arrays
+import hotlist
+from response_cache import cached, invalidate
 
 
 bp = Blueprint('video', __name__, url_prefix='/api/video')
 
+VIEW_DEDUP_SECONDS = 30 * 60
+VIEW_DEDUP_KEY = "view:dedup:{}:{}"
+PENDING_VIEWS_KEY = "view:pending"
+FLUSHING_VIEWS_KEY = "view:flushing"
+
 
 @bp.route('/list', methods=['GET'])
+@cached(ttl=30, tags=lambda: ["video:list"], per_user=True,
+        skip=lambda: request.args.get('sort_by') == "random")
 def get_videos():
     """获取视频列表"""
     start = request.args.get('start', default=1, type=int)
@@ -44,19 +56,9 @@ def get_videos():
     for video in videos:
         video.pop('_id', None)
 
-        # 查询上传者的名称
-        user = mongo.db.user.find_one({"uid": video["uid"]})
-        video["uploader_name"] = user.get("name") if user else "未知"
-
-        # 如果视频被隐藏，查询操作人的名称
-        if "hidden" in video and "uid" in video["hidden"]:
-            operator = mongo.db.user.find_one({"uid": video["hidden"]["uid"]})
-            video["hidden"]["operator_name"] = operator.get(
-                "name") if operator else "未知"
-            # 删除uid字段，只留下operator_name字段
-            video["hidden"].pop("uid", None)
-        elif "hidden" in video:
-            video["hidden"]["operator_name"] = "未知"
+    # 批量查询上传者和操作人的名称
+    fill_video_user_names(videos)
+    mark_liked(session.get('user', {}).get('uid'), videos)
 
     return jsonify({"data": videos, "hasMore": has_more})
 
@@ -65,29 +67,59 @@ def get_videos():
 def add_view(aid):
     """增加视频播放量"""
     client_ip = get_real_ip(request)
-    ip_record = mongo.db.video_ip_view.find_one({"ip": client_ip})
-    now = datetime.now().timestamp()  # 获取当前时间戳
-    thirty_minutes_ago = now - 30 * 60  # 30分钟前的时间戳
-
-    # IP记录还不存在
-    if not ip_record:
-        mongo.db.video_ip_view.insert_one(
-            {"ip": client_ip, "views": {str(aid): now}})
-        mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.view": 1}})
-        return jsonify({"message": "播放量增加成功"})
-    else:
-        last_viewed = ip_record["views"].get(str(aid), None)
-        if not last_viewed or last_viewed < thirty_minutes_ago:
-            ip_record["views"][str(aid)] = now
-            mongo.db.video_ip_view.update_one(
-                {"ip": client_ip}, {"$set": {"views": ip_record["views"]}})
-            mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.view": 1}})
-            return jsonify({"message": "播放量增加成功"})
-        else:
-            return jsonify({"message": "播放量增加失败(30)"})
+
+    # 30分钟内同一IP对同一视频只计一次
+    if not redis_client.set(VIEW_DEDUP_KEY.format(client_ip, aid), 1,
+                            nx=True, ex=VIEW_DEDUP_SECONDS):
+        return jsonify({"message": "播放量增加失败(30)"})
+
+    # 先累计在Redis中，由flush_views定期写入数据库
+    redis_client.hincrby(PENDING_VIEWS_KEY, aid, 1)
+    return jsonify({"message": "播放量增加成功"})
+
+
+@periodic('VIEW_FLUSH_INTERVAL', 10)
+def flush_views():
+    """将Redis中累计的播放量批量写入数据库，返回更新的视频数
+
+    部分视频写入失败时，已写入的视频从flushing中删除，下次只重试失败的部分，不会重复计数。
+    连接在服务器已执行写入后才断开时无法得知结果，下次会整批重试，这部分可能多计
+    (副本集上pymongo的可重试写入会由服务器去重一次)。
+    """
+    # 上一次写入中途失败时会留下flushing，先处理它，保证计数不丢失
+    if not redis_client.exists(FLUSHING_VIEWS_KEY):
+        try:
+            redis_client.rename(PENDING_VIEWS_KEY, FLUSHING_VIEWS_KEY)
+        except ResponseError:  # 没有待写入的播放量
+            return 0
+
+    counts = redis_client.hgetall(FLUSHING_VIEWS_KEY)
+    aids = list(counts)
+    operations = [UpdateOne({"aid": int(aid)}, {"$inc": {"data.view": int(counts[aid])}})
+                  for aid in aids]
+    if operations:
+        try:
+            mongo.db.video.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False时writeErrors之外的操作都已执行，从flushing中删除以免重试时重复计数
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            written = [aid for index, aid in enumerate(aids) if index not in failed]
+            if written:
+                redis_client.hdel(FLUSHING_VIEWS_KEY, *written)
+            raise
+    redis_client.delete(FLUSHING_VIEWS_KEY)
+
+    return len(operations)
+
+
+@bp.cli.command('flush-views')
+def flush_views_command():
+    """立即将累计的播放量写入数据库"""
+    print(f"已更新{flush_views()}个视频的播放量")
 
 
 @bp.route('/get/<int:aid>', methods=['GET'])
+@cached(ttl=30, tags=lambda aid: [f"video:{aid}"], per_user=True)
 def get_video_info(aid):
     """获取视频信息"""
     # 查询指定aid的视频信息
@@ -99,11 +131,7 @@ def get_video_info(aid):
 
     # 如果用户已登录，检查是否用户已点赞
     if uid:
-        user_record = mongo.db.video_like.find_one({"uid": uid})
-        is_liked = False
-        if user_record and aid in user_record.get("liked_videos", []):
-            is_liked = True
-        video["is_liked"] = is_liked
+        video["is_liked"] = aid in get_liked_aids(uid, [aid])
 
     video.pop('_id', None)
     return jsonify(video)
@@ -114,130 +142,86 @@ def get_video_info(aid):
 def toggle_like_video(aid):
     """点赞或取消点赞视频"""
     uid = session['user']['uid']
-    user_record = mongo.db.video_like.find_one({"uid": uid})
 
-    video_record = mongo.db.video.find_one({"aid": aid})
+    video_record = mongo.db.video.find_one({"aid": aid}, {"uid": 1})
     if not video_record:
         return jsonify({"message": "视频不存在", "likes": 0}), 404
 
     video_uploader_uid = video_record["uid"]
 
-    # 用户记录还不存在
-    if not user_record:
-        mongo.db.video_like.insert_one({"uid": uid, "liked_videos": [aid]})
-        mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.like": 1}})
+    liked = toggle_like(uid, aid)
+    # 列表页中也有点赞数和当前用户的is_liked
+    invalidate(f"video:{aid}", "video:list")
+    if liked:
         adjust_points_and_exp(video_uploader_uid, 10,
                               reason=f"视频{aid}被点赞")  # 加10积分
         return jsonify({"message": "点赞成功", "likes": 1})
-
-    else:
-        # 用户已点赞
-        if aid in user_record["liked_videos"]:
-            user_record["liked_videos"].remove(aid)
-            mongo.db.video_like.update_one(
-                {"uid": uid}, {"$set": {"liked_videos": user_record["liked_videos"]}})
-            mongo.db.video.update_one(
-                {"aid": aid}, {"$inc": {"data.like": -1}})
-            adjust_points_and_exp(video_uploader_uid, -10,
-                                  reason=f"视频{aid}点赞被取消")  # 扣10积分
-            return jsonify({"message": "取消点赞成功", "likes": -1})
-
-        # 用户还未点赞
-        else:
-            user_record["liked_videos"].append(aid)
-            mongo.db.video_like.update_one(
-                {"uid": uid}, {"$set": {"liked_videos": user_record["liked_videos"]}})
-            mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.like": 1}})
-            adjust_points_and_exp(video_uploader_uid, 10,
-                                  reason=f"视频{aid}被点赞")  # 加10积分
-            return jsonify({"message": "点赞成功", "likes": 1})
-
-
-@bp.route('/hot-list', methods=['GET'])
-def get_hot_videos():
-    """获取热门视频列表"""
-    start = int(request.args.get('start', 1)) - 1  # 转换为基于0的索引
-    count = int(request.args.get('count', 10))
-    within_two_weeks = request.args.get(
-        'within_two_weeks', 'true').lower() == 'true'  # 默认为false
-
-    now = datetime.now()
-
-    # 如果within_two_weeks为true，则只选取两周内的视频
-    if within_two_weeks:
-        two_weeks_ago = now - timedelta(days=14)
-        video_filter = {"time": {"$gte": two_weeks_ago.timestamp()}}
+    elif liked is False:
+        adjust_points_and_exp(video_uploader_uid, -10,
+                              reason=f"视频{aid}点赞被取消")  # 扣10积分
+        return jsonify({"message": "取消点赞成功", "likes": -1})
     else:
-        video_filter = {}  # 否则选取所有视频
+        # 同时发出的另一个请求已经取消了点赞
+        return jsonify({"message": "取消点赞成功", "likes": 0})
 
-    videos_cursor = mongo.db.video.find(video_filter)
 
-    comments_cursor = mongo.db.comment.aggregate([
-        {"$group": {"_id": "$aid", "total_comments": {"$sum": 1}}}
-    ])
-
-    # 创建评论计数映射
-    comments_map = {item["_id"]: item["total_comments"]
-                    for item in comments_cursor}
+@bp.route('/liked', methods=['GET'])
+@login_required
+def get_liked_videos():
+    """获取当前用户点赞过的视频列表"""
+    start = request.args.get('start', default=1, type=int)
+    count = request.args.get('count', default=10, type=int)
 
-    video_scores = []
-    SMOOTHING = 10
+    page_number = max((start - 1) // count, 0)
+    skip_amount = page_number * count
 
-    for video in videos_cursor:
-        aid = video["aid"]
-        views = video["data"]["view"]
+    aids = get_liked_page(session['user']['uid'], skip_amount, count + 1)
+    has_more = len(aids) > count
+    aids = aids[:count]
 
-        # 排除播放量小于10的视频
-        if views < 10:
-            continue
+    videos_map = {video["aid"]: video for video in mongo.db.video.find(
+        {"aid": {"$in": aids}}, {"_id": 0})}
+    videos = [videos_map[aid] for aid in aids if aid in videos_map]
 
-        video_date = datetime.utcfromtimestamp(video["time"])
-        days_since_release = (now - video_date).days
-        time_decay_factor = 1 / (1 + math.log(1 + days_since_release))
+    fill_video_user_names(videos)
+    for video in videos:
+        video["is_liked"] = True
 
-        likes = video["data"]["like"]
-        comments = comments_map.get(aid, 0)
+    return jsonify({"data": videos, "hasMore": has_more})
 
-        like_view_ratio = (likes + SMOOTHING) / (views + SMOOTHING)
-        comment_view_ratio = (comments + SMOOTHING) / (views + SMOOTHING)
 
-        score = (
-            views * 3 +
-            likes * 6 +
-            comments * 1.5 +
-            like_view_ratio * 50 +
-            comment_view_ratio * 40 +
-            time_decay_factor
-        )
+@bp.cli.command('migrate-likes')
+def migrate_likes_command():
+    """将旧的点赞数组迁移为点赞边并建立唯一索引"""
+    print(f"已迁移{migrate_from_arrays()}条点赞记录")
 
-        video_scores.append((video, score))
 
-    # 按分数排序
-    video_scores.sort(key=lambda x: x[1], reverse=True)
+@bp.route('/hot-list', methods=['GET'])
+def get_hot_videos():
+    """获取热门视频列表"""
+    start = max(int(request.args.get('start', 1)) - 1, 0)  # 转换为基于0的索引
+    count = int(request.args.get('count', 10))
+    within_two_weeks = request.args.get(
+        'within_two_weeks', 'true').lower() == 'true'  # 默认为true
 
-    # 分页
-    end = start + count
-    paged_video_objects = [video[0] for video in video_scores[start:end]]
+    # 热度分数由后台任务定期计算，这里只读取对应的区间
+    aids, total = hotlist.get_page(within_two_weeks, start, count)
 
-    formatted_videos = []
-    for video in paged_video_objects:
-        video.pop('_id', None)
+    videos_map = {video["aid"]: video for video in mongo.db.video.find(
+        {"aid": {"$in": aids}}, {"_id": 0})}
+    formatted_videos = [videos_map[aid] for aid in aids if aid in videos_map]
 
-        user = mongo.db.user.find_one({"uid": video["uid"]})
-        video["uploader_name"] = user.get("name") if user else "未知"
+    # 批量查询上传者和操作人的名称
+    fill_video_user_names(formatted_videos)
+    mark_liked(session.get('user', {}).get('uid'), formatted_videos)
 
-        # 如果视频被隐藏，查询操作人的名称
-        if "hidden" in video and "uid" in video["hidden"]:
-            operator = mongo.db.user.find_one({"uid": video["hidden"]["uid"]})
-            video["hidden"]["operator_name"] = operator.get(
-                "name") if operator else "未知"
-            # 删除uid字段，只留下operator_name字段
-            video["hidden"].pop("uid", None)
-        elif "hidden" in video:
-            video["hidden"]["operator_name"] = "未知"
+    has_more = total > start + count
 
-        formatted_videos.append(video)
+    return jsonify({"data": formatted_videos, "hasMore": has_more})
 
-    has_more = len(video_scores) > end
 
-    return jsonify({"data": formatted_videos, "hasMore": has_more})
+@bp.cli.command('recompute-hot')
+def recompute_hot_command():
+    """重新计算热门视频榜单"""
+    count = hotlist.recompute()
+    print(f"热门榜单计算完成，共{count}个视频")
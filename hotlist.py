@@ -0,0 +1,106 @@
+# 标准库导入
+import time
+from uuid import uuid4
+# 第三方库导入
+import numpy as np
+# 应用/模块内部导入
+from extensions import mongo, redis_client
+from scheduler import periodic
+
+
+HOT_LIST_KEYS = {
+    True: "hot_list:two_weeks",  # 两周内的视频
+    False: "hot_list:all"
+}
+UPDATED_AT_KEY = "hot_list:updated_at"
+REBUILD_LOCK_KEY = "hot_list:rebuild_lock"
+REBUILD_LOCK_TIMEOUT = 120
+TWO_WEEKS = 14 * 24 * 3600
+SMOOTHING = 10
+MIN_VIEWS = 10  # 排除播放量小于10的视频
+
+
+def compute_hot_scores(views, likes, comments, times, now):
+    """向量化计算热度分数，参数均为等长的NumPy数组"""
+    days_since_release = np.maximum((now - times) // 86400, 0)
+    time_decay_factor = 1 / (1 + np.log1p(days_since_release))
+
+    like_view_ratio = (likes + SMOOTHING) / (views + SMOOTHING)
+    comment_view_ratio = (comments + SMOOTHING) / (views + SMOOTHING)
+
+    return (
+        views * 3 +
+        likes * 6 +
+        comments * 1.5 +
+        like_view_ratio * 50 +
+        comment_view_ratio * 40 +
+        time_decay_factor
+    )
+
+
+def _replace_zset(key, aids, scores):
+    """先写入临时key再原子替换，读取方不会看到写了一半的榜单"""
+    if len(aids) == 0:
+        redis_client.delete(key)
+        return
+
+    # 每次计算使用自己的临时key，周期任务和冷启动重建同时进行时不会互相覆盖
+    tmp_key = f"{key}:tmp:{uuid4().hex}"
+    for begin in range(0, len(aids), 10000):
+        end = begin + 10000
+        redis_client.zadd(tmp_key, dict(
+            zip(aids[begin:end].tolist(), scores[begin:end].tolist())))
+    redis_client.rename(tmp_key, key)
+
+
+@periodic('HOT_LIST_REFRESH_INTERVAL', 5 * 60)
+def recompute():
+    """重新计算所有视频的热度并写入Redis，返回参与排名的视频数"""
+    now = time.time()
+
+    videos = list(mongo.db.video.find(
+        {"data.view": {"$gte": MIN_VIEWS}},
+        {"_id": 0, "aid": 1, "time": 1, "data.view": 1, "data.like": 1}
+    ))
+
+    comments_map = {item["_id"]: item["total_comments"] for item in mongo.db.comment.aggregate([
+        {"$match": {"aid": {"$ne": None}}},
+        {"$group": {"_id": "$aid", "total_comments": {"$sum": 1}}}
+    ])}
+
+    count = len(videos)
+    aids = np.fromiter((v["aid"] for v in videos), dtype=np.int64, count=count)
+    times = np.fromiter((v["time"] for v in videos), dtype=np.float64, count=count)
+    views = np.fromiter((v["data"]["view"] for v in videos), dtype=np.float64, count=count)
+    likes = np.fromiter((v["data"]["like"] for v in videos), dtype=np.float64, count=count)
+    comments = np.fromiter((comments_map.get(v["aid"], 0) for v in videos),
+                           dtype=np.float64, count=count)
+
+    scores = compute_hot_scores(views, likes, comments, times, now)
+
+    recent = times >= now - TWO_WEEKS
+    _replace_zset(HOT_LIST_KEYS[False], aids, scores)
+    _replace_zset(HOT_LIST_KEYS[True], aids[recent], scores[recent])
+    redis_client.set(UPDATED_AT_KEY, now)
+
+    return count
+
+
+def get_page(within_two_weeks, start, count):
+    """读取热门榜的一页，返回(aid列表, 榜单总数)"""
+    # 首次部署或Redis被清空时同步计算一次；只有拿到锁的请求计算，其它请求先返回现有(可能为空)的榜单
+    if not redis_client.exists(UPDATED_AT_KEY):
+        lock = redis_client.lock(REBUILD_LOCK_KEY, timeout=REBUILD_LOCK_TIMEOUT)
+        if lock.acquire(blocking=False):
+            try:
+                if not redis_client.exists(UPDATED_AT_KEY):
+                    recompute()
+            finally:
+                lock.release()
+
+    key = HOT_LIST_KEYS[within_two_weeks]
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zrevrange(key, start, start + count - 1)
+    pipe.zcard(key)
+    aids, total = pipe.execute()
+    return [int(aid) for aid in aids], total
@@ -0,0 +1,78 @@
+# 标准库导入
+import os
+import threading
+# 第三方库导入
+from flask import current_app
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+# 应用/模块内部导入
+from extensions import mongo
+
+
+class SequenceAllocator:
+    """从counter集合按块预留ID，块内的ID在进程内分配，不再每个ID访问一次数据库
+
+    不同进程各自持有不同的块，所以ID全局唯一，但只在同一块内单调递增。
+    """
+
+    def __init__(self, name, default_block_size=1000, seed=None):
+        self.name = name
+        self.default_block_size = default_block_size
+        self.seed = seed  # counter不存在时返回当前最大ID的函数
+        self._seeded = False  # counter一旦存在就不会被删除，确认过一次后不再查询
+        self._reset()
+        # fork出的子进程不能继续使用父进程预留的块，否则会分配出重复ID
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._next = 1
+        self._end = 0
+
+    def _block_size(self):
+        block_sizes = current_app.config.get('ID_BLOCK_SIZES', {})
+        return max(int(block_sizes.get(self.name, self.default_block_size)), 1)
+
+    def _ensure_seeded(self):
+        if self._seeded:
+            return
+        if not mongo.db.counter.find_one({"_id": self.name}, {"_id": 1}):
+            try:
+                mongo.db.counter.insert_one({"_id": self.name, "sequence_value": self.seed()})
+            except DuplicateKeyError:  # 其它进程已经初始化
+                pass
+        self._seeded = True
+
+    def _reserve(self):
+        if self.seed:
+            self._ensure_seeded()
+        block_size = self._block_size()
+        counter = mongo.db.counter.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"sequence_value": block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._end = counter["sequence_value"]
+        self._next = self._end - block_size + 1
+
+    def next(self):
+        """获取下一个ID"""
+        with self._lock:
+            if self._next > self._end:
+                self._reserve()
+            value = self._next
+            self._next += 1
+            return value
+
+
+def _max_field(collection, field):
+    def seed():
+        document = mongo.db[collection].find_one(sort=[(field, -1)])
+        return document[field] if document else 0
+    return seed
+
+
+danmaku_ids = SequenceAllocator("danmaku_id", 1000)
+video_aids = SequenceAllocator("video_aid", 1, seed=_max_field("video", "aid"))
+user_uids = SequenceAllocator("user_uid", 1, seed=_max_field("user", "uid"))
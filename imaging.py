@@ -0,0 +1,110 @@
+# 标准库导入
+import os
+import hashlib
+import logging
+from uuid import uuid4
+from functools import partial
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+# 第三方库导入
+from PIL import Image, ImageOps
+# 应用/模块内部导入
+from extensions import mongo
+from upload_queue import enqueue_upload
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# 各类图片需要生成的尺寸，列表页、详情页和头像分别使用
+VARIANT_SIZES = {
+    "cover": {"list": (320, 180), "detail": (960, 540)},
+    "face": {"small": (64, 64), "medium": (160, 160)},
+}
+VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+COS_PREFIXES = {"cover": "covers", "face": "faces"}
+
+_pool = None
+
+
+def _reset_pool():
+    global _pool
+    _pool = None
+
+
+# fork出的子进程不能使用父进程的进程池
+os.register_at_fork(after_in_child=_reset_pool)
+
+
+def get_pool():
+    """处理图片的进程池，首次使用时创建"""
+    global _pool
+    if _pool is None:
+        # 使用spawn，子进程不会继承gevent的猴子补丁和父进程的数据库连接
+        _pool = ProcessPoolExecutor(max_workers=getattr(config, 'IMAGE_WORKERS', None) or os.cpu_count(),
+                                    mp_context=get_context('spawn'))
+    return _pool
+
+
+def make_variants(src_path, out_dir, name, kind):
+    """生成各尺寸、各格式的图片，返回[(尺寸名, 扩展名, 文件路径)]，在子进程中运行"""
+    results = []
+    with Image.open(src_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for size_name, size in VARIANT_SIZES[kind].items():
+            # 按目标比例居中裁剪后缩放
+            variant = ImageOps.fit(image, size, Image.LANCZOS)
+            for ext, image_format in VARIANT_FORMATS.items():
+                path = os.path.join(out_dir, f"{name}_{size_name}.{ext}")
+                variant.save(path, image_format, quality=82, optimize=True)
+                results.append((size_name, ext, path))
+    return results
+
+
+def _on_variants_done(digest, kind, collection, query, src_copy, future):
+    """图片处理完成后上传并记录各尺寸的地址"""
+    try:
+        os.remove(src_copy)
+    except OSError:
+        pass
+    try:
+        results = future.result()
+    except Exception:
+        logger.exception("%s图片%s处理失败", kind, digest)
+        return
+
+    variants = {}
+    for size_name, ext, path in results:
+        cos_key = f"{COS_PREFIXES[kind]}/{digest}_{size_name}.{ext}"
+        enqueue_upload(path, cos_key, delete_after=True)
+        variants.setdefault(size_name, {})[ext] = f"/api/public/cos/{cos_key}"
+
+    mongo.db.image_variant.update_one(
+        {"_id": digest}, {"$setOnInsert": {"kind": kind, "variants": variants}}, upsert=True)
+    mongo.db[collection].update_one(query, {"$set": {f"{kind}_variants": variants}})
+
+
+def schedule_variants(src_path, kind, collection, query):
+    """在后台为封面或头像生成各尺寸图片，完成后写入collection中匹配query的文档
+
+    相同内容的图片只处理一次，直接复用之前生成的地址。
+    """
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    processed = mongo.db.image_variant.find_one({"_id": digest}, {"variants": 1})
+    if processed:
+        mongo.db[collection].update_one(query, {"$set": {f"{kind}_variants": processed["variants"]}})
+        return
+
+    out_dir = getattr(config, 'IMAGE_VARIANT_FOLDER', './variants')
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 进程池稍后才读取图片，交给它一份单独的副本，原文件被之后的上传覆盖也不影响
+    src_copy = os.path.join(out_dir, f"{digest}_{uuid4().hex}.src")
+    with open(src_copy, 'wb') as f:
+        f.write(data)
+
+    future = get_pool().submit(make_variants, src_copy, out_dir, digest, kind)
+    future.add_done_callback(partial(_on_variants_done, digest, kind, collection, query, src_copy))
@@ -0,0 +1,167 @@
+# 第三方库导入
+from flask.cli import AppGroup
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+# 应用/模块内部导入
+from extensions import mongo
+
+
+# 各集合需要的索引，名称由pymongo按字段生成，_id索引不需要列出
+INDEXES = {
+    "video": [
+        IndexModel([("aid", ASCENDING)], unique=True),
+        IndexModel([("time", DESCENDING)]),
+        IndexModel([("data.view", DESCENDING)]),
+        IndexModel([("uid", ASCENDING), ("time", DESCENDING)]),
+    ],
+    "user": [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "user_auth": [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "comment": [
+        IndexModel([("page_type", ASCENDING), ("aid", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("page_type", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "comment_cool_down": [
+        IndexModel([("uid", ASCENDING)], unique=True),
+    ],
+    "danmaku_segment": [
+        IndexModel([("aid", ASCENDING), ("segment", ASCENDING), ("part", ASCENDING)], unique=True),
+    ],
+    "video_like_edge": [
+        IndexModel([("uid", ASCENDING), ("aid", ASCENDING)], unique=True),
+        IndexModel([("uid", ASCENDING), ("time", DESCENDING)]),
+    ],
+    "follow": [
+        IndexModel([("follower", ASCENDING), ("followee", ASCENDING)], unique=True),
+        IndexModel([("follower", ASCENDING), ("time", DESCENDING)]),
+        IndexModel([("followee", ASCENDING), ("time", DESCENDING)]),
+    ],
+    "traffic": [
+        IndexModel([("resolution", ASCENDING), ("timestamp", ASCENDING)], unique=True),
+    ],
+    "point_exp_log": [
+        IndexModel([("uid", ASCENDING), ("time", DESCENDING)]),
+    ],
+    # 以下集合只按_id读写
+    "counter": [],
+    "upload_job": [],
+    "image_variant": [],
+}
+
+# 接口中使用的查询：(集合, 条件, 排序)，审计时逐个explain
+AUDIT_QUERIES = [
+    ("video", {"aid": 1}, None),
+    ("video", {"aid": {"$in": [1, 2]}}, None),
+    ("video", {}, [("time", -1)]),
+    ("video", {}, [("data.view", -1)]),
+    ("video", {"uid": 1}, [("time", -1)]),
+    ("video", {"data.view": {"$gte": 1}}, None),
+    ("video", {}, [("aid", -1)]),
+    ("user", {"uid": 1}, None),
+    ("user", {"uid": {"$in": [1, 2]}}, None),
+    ("user", {"email": "user@example.com"}, None),
+    ("user", {}, [("uid", -1)]),
+    ("user_auth", {"email": "user@example.com"}, None),
+    ("comment", {"page_type": "video", "aid": 1}, [("time", -1), ("_id", -1)]),
+    ("comment", {"page_type": "video", "aid": 1, "$or": [
+        {"time": {"$lt": 1}}, {"time": 1, "_id": {"$lt": ObjectId("0" * 24)}}
+    ]}, [("time", -1), ("_id", -1)]),
+    ("comment", {"page_type": "index"}, [("time", -1), ("_id", -1)]),
+    ("comment_cool_down", {"uid": 1}, None),
+    ("danmaku_segment", {"aid": 1}, [("segment", 1), ("part", 1)]),
+    ("danmaku_segment", {"aid": 1, "segment": {"$gte": 0, "$lte": 1}}, [("segment", 1), ("part", 1)]),
+    ("danmaku_segment", {"aid": 1, "segment": 0}, [("part", -1)]),
+    ("video_like_edge", {"uid": 1, "aid": {"$in": [1, 2]}}, None),
+    ("video_like_edge", {"uid": 1}, [("time", -1)]),
+    ("follow", {"follower": 1, "followee": {"$in": [1, 2]}}, None),
+    ("follow", {"follower": 1}, [("time", -1)]),
+    ("follow", {"followee": 1}, [("time", -1)]),
+    ("traffic", {"resolution": "hour", "timestamp": {"$gte": 0, "$lte": 3600}}, None),
+    ("counter", {"_id": "video_aid"}, None),
+]
+
+index_cli = AppGroup('index', help='数据库索引管理')
+
+
+def reconcile(collections=None):
+    """创建缺少的索引，返回每个集合新建、定义不一致、创建失败和多余的索引名"""
+    report = {}
+    for name in collections or INDEXES:
+        collection = mongo.db[name]
+        existing = collection.index_information()
+        result = {"created": [], "conflicts": [], "failed": [], "unexpected": []}
+
+        expected = set()
+        for model in INDEXES[name]:
+            document = model.document
+            expected.add(document["name"])
+            current = existing.get(document["name"])
+            if current is None:
+                try:
+                    collection.create_indexes([model])
+                    result["created"].append(document["name"])
+                except OperationFailure as e:
+                    # 已有数据违反唯一约束等情况，需要人工处理
+                    result["failed"].append(f"{document['name']}: {e}")
+            elif bool(current.get("unique")) != bool(document.get("unique")):
+                result["conflicts"].append(document["name"])
+
+        result["unexpected"] = [index for index in existing if index != "_id_" and index not in expected]
+        report[name] = result
+    return report
+
+
+def _plan_stages(plan):
+    """递归取出执行计划中的所有stage"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def audit():
+    """explain所有接口查询，返回使用全表扫描或内存排序的查询
+
+    集合不存在时执行计划为空，需要先同步索引
+    """
+    problems = []
+    for name, query, sort in AUDIT_QUERIES:
+        cursor = mongo.db[name].find(query).limit(20)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = set(_plan_stages(cursor.explain()["queryPlanner"]["winningPlan"]))
+        bad_stages = stages & {"COLLSCAN", "SORT"}
+        if bad_stages:
+            problems.append((name, query, sort, sorted(bad_stages)))
+    return problems
+
+
+@index_cli.command('sync')
+def sync_command():
+    """创建缺少的索引并报告多余的索引"""
+    for name, result in reconcile().items():
+        for key, label in (("created", "新建"), ("conflicts", "定义不一致"),
+                           ("failed", "创建失败"), ("unexpected", "未登记")):
+            for index in result[key]:
+                print(f"{name}: {label} {index}")
+    print("索引同步完成")
+
+
+@index_cli.command('audit')
+def audit_command():
+    """检查接口查询的执行计划，有全表扫描或内存排序时以非零状态退出"""
+    problems = audit()
+    for name, query, sort, stages in problems:
+        print(f"{name}: {query} sort={sort} 使用了 {', '.join(stages)}")
+    if problems:
+        raise SystemExit(1)
+    print(f"{len(AUDIT_QUERIES)}个查询均使用了索引")
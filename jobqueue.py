@@ -0,0 +1,155 @@
+# 标准库导入
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+# 应用/模块内部导入
+from extensions import redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """基于Redis列表的可靠任务队列
+
+    任务被取出时原子地移入该worker自己的processing列表，处理成功后才删除；
+    worker崩溃后，其processing列表中的任务会被其它worker放回队列。
+    失败的任务按指数退避延迟重试，超过最大次数后放弃。
+    """
+
+    def __init__(self, name, max_attempts=5, base_delay=2, max_delay=300, heartbeat_ttl=300):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.heartbeat_ttl = heartbeat_ttl  # 需要大于单个任务的最长处理时间
+        self.ready_key = f"queue:{name}:ready"
+        self.delayed_key = f"queue:{name}:delayed"
+        self.worker_id = None
+
+    def _processing_key(self, worker_id):
+        return f"queue:{self.name}:processing:{worker_id}"
+
+    def _heartbeat_key(self, worker_id):
+        return f"queue:{self.name}:heartbeat:{worker_id}"
+
+    def enqueue(self, payload):
+        """加入队列，返回任务ID"""
+        job = {"id": uuid.uuid4().hex, "attempts": 0, "payload": payload}
+        redis_client.lpush(self.ready_key, json.dumps(job))
+        return job["id"]
+
+    def _promote_delayed(self):
+        """把已到重试时间的任务移回队列"""
+        for raw in redis_client.zrangebyscore(self.delayed_key, 0, time.time(), start=0, num=100):
+            # 多个worker同时处理时，只有成功ZREM的那个会放回队列
+            if redis_client.zrem(self.delayed_key, raw):
+                redis_client.lpush(self.ready_key, raw)
+
+    def heartbeat(self):
+        """标记当前worker存活，processing列表不会被回收"""
+        redis_client.set(self._heartbeat_key(self.worker_id), 1, ex=self.heartbeat_ttl)
+
+    def recover_orphans(self):
+        """将已失去心跳的worker正在处理的任务放回队列，返回放回的任务数"""
+        recovered = 0
+        for key in redis_client.scan_iter(match=self._processing_key("*")):
+            worker_id = key[len(self._processing_key("")):]
+            if worker_id == self.worker_id or redis_client.exists(self._heartbeat_key(worker_id)):
+                continue
+            while redis_client.rpoplpush(key, self.ready_key):
+                recovered += 1
+        return recovered
+
+    def reserve(self, timeout=5):
+        """取出一个任务，返回(原始数据, 任务)，超时返回None"""
+        self._promote_delayed()
+        raw = redis_client.brpoplpush(
+            self.ready_key, self._processing_key(self.worker_id), timeout)
+        if raw is None:
+            return None
+        return raw, json.loads(raw)
+
+    def reserve_batch(self, max_count, timeout=5):
+        """阻塞取出第一个任务后，再不等待地取出已在队列中的任务，最多max_count个"""
+        first = self.reserve(timeout)
+        if first is None:
+            return []
+        items = [first]
+        while len(items) < max_count:
+            raw = redis_client.rpoplpush(self.ready_key, self._processing_key(self.worker_id))
+            if raw is None:
+                break
+            items.append((raw, json.loads(raw)))
+        return items
+
+    def ack(self, raw):
+        """任务处理完成"""
+        redis_client.lrem(self._processing_key(self.worker_id), 1, raw)
+
+    def retry(self, raw, job, error):
+        """任务失败，安排延迟重试；超过最大次数时返回False"""
+        job["attempts"] += 1
+        job["error"] = error
+        pipe = redis_client.pipeline()
+        pipe.lrem(self._processing_key(self.worker_id), 1, raw)
+        if job["attempts"] >= self.max_attempts:
+            pipe.execute()
+            return False
+        delay = min(self.base_delay * 2 ** (job["attempts"] - 1), self.max_delay)
+        pipe.zadd(self.delayed_key, {json.dumps(job): time.time() + delay})
+        pipe.execute()
+        return True
+
+    def run_worker(self, handler, on_give_up=None):
+        """循环处理任务：handler(payload)抛出异常视为失败，放弃时调用on_give_up(payload, error)"""
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        logger.info("队列%s的worker %s已启动", self.name, self.worker_id)
+
+        while True:
+            self.heartbeat()
+            self.recover_orphans()
+
+            item = self.reserve()
+            if item is None:
+                continue
+            raw, job = item
+
+            try:
+                handler(job["payload"])
+            except Exception as e:
+                logger.exception("队列%s的任务%s第%d次执行失败", self.name, job["id"], job["attempts"] + 1)
+                if not self.retry(raw, job, f"{e}") and on_give_up:
+                    on_give_up(job["payload"], f"{e}")
+            else:
+                self.ack(raw)
+
+    def run_batch_worker(self, handler, batch_size, on_give_up=None):
+        """循环批量处理任务：handler(payloads)返回与之对应的错误信息列表，None表示成功"""
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        logger.info("队列%s的worker %s已启动，每批最多%d个任务", self.name, self.worker_id, batch_size)
+
+        while True:
+            self.heartbeat()
+            self.recover_orphans()
+
+            items = self.reserve_batch(batch_size)
+            if not items:
+                continue
+
+            try:
+                errors = handler([job["payload"] for _, job in items])
+            except Exception as e:
+                logger.exception("队列%s的一批%d个任务执行失败", self.name, len(items))
+                errors = [f"{e}"] * len(items)
+
+            for (raw, job), error in zip(items, errors):
+                if error is None:
+                    self.ack(raw)
+                    continue
+                logger.warning("队列%s的任务%s第%d次执行失败: %s", self.name, job["id"], job["attempts"] + 1, error)
+                if not self.retry(raw, job, error) and on_give_up:
+                    on_give_up(job["payload"], error)
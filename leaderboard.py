@@ -0,0 +1,138 @@
+# 标准库导入
+import time
+from uuid import uuid4
+# 应用/模块内部导入
+from extensions import mongo, redis_client
+
+
+# 经验排行榜，member为uid，score为经验值
+LEADERBOARD_KEY = "leaderboard:experience"
+# 完整重建过一次后才设置；只看排行榜是否存在不够，重建前的update_experience也会创建它
+BUILT_KEY = "leaderboard:experience:built"
+LOCK_KEY = "leaderboard:experience:lock"
+REBUILDING_KEY = "leaderboard:experience:rebuilding"  # 正在写入的临时键名
+REBUILD_TIMEOUT = 600
+CHECK_INTERVAL = 60  # 每60秒最多检查一次排行榜是否已重建
+
+_last_checked = 0
+
+# 重建期间的经验变化同时写入临时键，替换后不会丢失
+UPDATE_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+local tmp_key = redis.call('GET', KEYS[2])
+if tmp_key then
+    redis.call('ZADD', tmp_key, ARGV[2], ARGV[1])
+end
+"""
+
+SWAP_SCRIPT = """
+if redis.call('GET', KEYS[3]) == ARGV[1] then
+    redis.call('DEL', KEYS[3])
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+redis.call('SET', KEYS[4], 1)
+"""
+
+
+def update_experience(uid, experience):
+    """更新用户在排行榜中的经验值"""
+    redis_client.eval(UPDATE_SCRIPT, 2, LEADERBOARD_KEY, REBUILDING_KEY, uid, experience)
+
+
+def rebuild(blocking=True):
+    """从MongoDB重建排行榜，返回写入的用户数；blocking为False且其它进程正在重建时返回None"""
+    lock = redis_client.lock(LOCK_KEY, timeout=REBUILD_TIMEOUT)
+    if not lock.acquire(blocking=blocking):
+        return None
+
+    tmp_key = f"{LEADERBOARD_KEY}:rebuild:{uuid4().hex}"
+    try:
+        redis_client.set(REBUILDING_KEY, tmp_key, ex=REBUILD_TIMEOUT)
+        count = 0
+        batch = {}
+        cursor = mongo.db.user.find({}, {"_id": 0, "uid": 1, "checkin.experience": 1})
+        for user in cursor:
+            batch[user["uid"]] = user.get("checkin", {}).get("experience", 0)
+            if len(batch) >= 1000:
+                # nx: 重建期间update_experience写入的值更新，不能被游标读到的旧值覆盖
+                redis_client.zadd(tmp_key, batch, nx=True)
+                count += len(batch)
+                batch = {}
+        if batch:
+            redis_client.zadd(tmp_key, batch, nx=True)
+            count += len(batch)
+
+        # 重建完成后原子替换，避免读到一半的数据
+        redis_client.eval(SWAP_SCRIPT, 4, tmp_key, LEADERBOARD_KEY, REBUILDING_KEY, BUILT_KEY, tmp_key)
+    finally:
+        redis_client.delete(tmp_key)  # 替换失败时清理
+        lock.release()
+    return count
+
+
+def ensure_built():
+    """没有完整重建过排行榜时（例如刚部署或Redis被清空）从MongoDB重建
+
+    只有一个进程执行重建，其它进程在此期间直接读取现有的（可能不完整的）排行榜。
+    """
+    global _last_checked
+    now = time.monotonic()
+    if now - _last_checked < CHECK_INTERVAL:
+        return
+    if redis_client.exists(BUILT_KEY) or rebuild(blocking=False) is not None:
+        _last_checked = now
+
+
+def get_rank_by_exp(exp=0):
+    """获取指定经验值的排名，经验相同的用户排名相同"""
+    ensure_built()
+    return redis_client.zcount(LEADERBOARD_KEY, f"({exp}", "+inf") + 1
+
+
+def get_ranks(uids):
+    """批量获取用户排名，返回{uid: rank}，不在排行榜中的用户不返回"""
+    uids = list(set(uids))
+    if not uids:
+        return {}
+    ensure_built()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for uid in uids:
+        pipe.zscore(LEADERBOARD_KEY, uid)
+    scores = pipe.execute()
+    ranked = [(uid, score) for uid, score in zip(uids, scores) if score is not None]
+
+    pipe = redis_client.pipeline(transaction=False)
+    for _, score in ranked:
+        pipe.zcount(LEADERBOARD_KEY, f"({score}", "+inf")
+    higher_counts = pipe.execute()
+
+    return {uid: higher + 1 for (uid, _), higher in zip(ranked, higher_counts)}
+
+
+def get_rank(uid):
+    """获取单个用户的排名"""
+    return get_ranks([uid]).get(uid)
+
+
+def get_top(count=30, start=0):
+    """获取排行榜区间，返回[(uid, experience, 名次)]"""
+    ensure_built()
+    entries = redis_client.zrevrange(
+        LEADERBOARD_KEY, start, start + count - 1, withscores=True)
+    return [(int(uid), int(score), start + index + 1)
+            for index, (uid, score) in enumerate(entries)]
+
+
+def get_around(uid, radius=5):
+    """获取用户前后各radius名的用户"""
+    ensure_built()
+    position = redis_client.zrevrank(LEADERBOARD_KEY, uid)
+    if position is None:
+        return []
+    start = max(position - radius, 0)
+    return get_top(position + radius - start + 1, start)
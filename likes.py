@@ -0,0 +1,76 @@
+# 标准库导入
+import time
+# 第三方库导入
+from pymongo import DESCENDING, UpdateOne
+# 应用/模块内部导入
+from extensions import mongo
+import indexes
+
+
+def toggle_like(uid, aid):
+    """原子地切换点赞状态，返回True(已点赞)、False(已取消)或None(并发请求已取消，无变化)"""
+    edges = mongo.db.video_like_edge
+
+    # (uid, aid)上有唯一索引，upsert只会有一个请求真正插入
+    result = edges.update_one(
+        {"uid": uid, "aid": aid},
+        {"$setOnInsert": {"time": time.time()}},
+        upsert=True
+    )
+    if result.upserted_id is not None:
+        mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.like": 1}})
+        return True
+
+    if edges.delete_one({"uid": uid, "aid": aid}).deleted_count:
+        mongo.db.video.update_one({"aid": aid}, {"$inc": {"data.like": -1}})
+        return False
+
+    return None
+
+
+def get_liked_aids(uid, aids):
+    """批量查询用户点赞了给定视频中的哪些"""
+    aids = list(aids)
+    if not uid or not aids:
+        return set()
+    cursor = mongo.db.video_like_edge.find(
+        {"uid": uid, "aid": {"$in": aids}}, {"_id": 0, "aid": 1})
+    return {edge["aid"] for edge in cursor}
+
+
+def mark_liked(uid, videos):
+    """为视频列表填充当前用户的is_liked字段，未登录时不填充"""
+    if not uid:
+        return videos
+    liked = get_liked_aids(uid, [video["aid"] for video in videos])
+    for video in videos:
+        video["is_liked"] = video["aid"] in liked
+    return videos
+
+
+def get_liked_page(uid, skip, limit):
+    """按点赞时间倒序获取用户点赞过的视频aid"""
+    cursor = (mongo.db.video_like_edge.find({"uid": uid}, {"_id": 0, "aid": 1})
+              .sort([("time", DESCENDING)])
+              .skip(skip)
+              .limit(limit))
+    return [edge["aid"] for edge in cursor]
+
+
+def migrate_from_arrays():
+    """将旧的video_like.liked_videos数组迁移为点赞边，返回迁移的点赞数"""
+    edges = mongo.db.video_like_edge
+    indexes.reconcile(["video_like_edge"])
+
+    count = 0
+    for record in mongo.db.video_like.find():
+        # 旧数据没有点赞时间，按数组顺序给出递增的时间以保留先后
+        operations = [UpdateOne(
+            {"uid": record["uid"], "aid": aid},
+            {"$setOnInsert": {"time": index}},
+            upsert=True
+        ) for index, aid in enumerate(record.get("liked_videos", []))]
+        if operations:
+            edges.bulk_write(operations, ordered=False)
+            count += len(operations)
+    return count
@@ -0,0 +1,168 @@
+# 标准库导入
+import time
+import smtplib
+import logging
+from multiprocessing import get_context
+from email.mime.text import MIMEText
+from email.header import Header
+# 第三方库导入
+import click
+from flask.cli import AppGroup
+# 应用/模块内部导入
+from jobqueue import JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+# 验证码5分钟内有效，重试间隔不宜过长
+mail_queue = JobQueue("mail", max_attempts=5, base_delay=5, max_delay=60, heartbeat_ttl=5 * 60)
+
+
+def enqueue_mail(to, subject, html):
+    """将邮件放入发送队列，返回任务ID"""
+    return mail_queue.enqueue({"to": to, "subject": subject, "html": html})
+
+
+def build_message(from_addr, to, subject, html):
+    message = MIMEText(html, 'html', 'utf-8')
+    message['From'] = from_addr
+    message['To'] = to
+    message['Subject'] = Header(subject, 'utf-8')
+    return message.as_string()
+
+
+class SMTPConnection:
+    """保持登录状态的SMTP连接
+
+    空闲超过max_idle秒后先发送NOOP确认连接可用，服务器断开时重新连接并重发一次。
+    """
+
+    def __init__(self, host, port, username='', password='', use_ssl=True, timeout=30, max_idle=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._smtp = None
+        self._last_used = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['MAIL_SERVER'], config['MAIL_PORT'],
+                   config.get('MAIL_USERNAME', ''), config.get('MAIL_PASSWORD', ''),
+                   use_ssl=config.get('MAIL_USE_SSL', True),
+                   timeout=config.get('MAIL_TIMEOUT', 30),
+                   max_idle=config.get('MAIL_MAX_IDLE', 60))
+
+    def connect(self):
+        self.close()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            # 本地测试用的SMTP服务器不需要登录
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._last_used = time.monotonic()
+
+    def _ensure_connected(self):
+        if self._smtp is None:
+            self.connect()
+        elif time.monotonic() - self._last_used > self.max_idle:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.connect()
+            except (smtplib.SMTPException, OSError):
+                self.connect()
+
+    def send(self, from_addr, to, message):
+        """发送一封邮件，连接失效时重新连接后再试一次"""
+        for attempt in range(2):
+            self._ensure_connected()
+            try:
+                self._smtp.sendmail(from_addr, to, message)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                self.close()
+                if attempt:
+                    raise
+
+    @property
+    def connected(self):
+        return self._smtp is not None
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+def send_batch(connection, from_addr, mails):
+    """用同一个连接依次发送一批邮件，返回每封邮件的错误信息，None表示成功"""
+    errors = []
+    for index, mail in enumerate(mails):
+        try:
+            connection.send(from_addr, mail["to"], build_message(from_addr, mail["to"], mail["subject"], mail["html"]))
+        except smtplib.SMTPRecipientsRefused as e:
+            # 收件地址被拒绝重试也不会成功；发件人被拒绝多为限流或配置问题，按普通错误稍后重试
+            logger.warning("邮件发送到%s被拒绝: %s", mail["to"], e)
+            errors.append(None)
+        except (smtplib.SMTPException, OSError) as e:
+            errors.append(f"{e}")
+            if not connection.connected:
+                # 重新连接也失败，服务器暂时不可用，剩下的邮件稍后一起重试
+                errors += [f"{e}"] * (len(mails) - index - 1)
+                break
+        else:
+            errors.append(None)
+    return errors
+
+
+def run_worker(app):
+    """在当前进程中循环发送邮件，整个进程共用一个SMTP连接"""
+    connection = SMTPConnection.from_config(app.config)
+    from_addr = app.config.get('MAIL_SENDER') or app.config['MAIL_USERNAME']
+
+    def handler(mails):
+        return send_batch(connection, from_addr, mails)
+
+    def on_give_up(mail, error):
+        logger.error("邮件发送到%s失败，已放弃: %s", mail["to"], error)
+
+    try:
+        mail_queue.run_batch_worker(handler, app.config.get('MAIL_BATCH_SIZE', 20), on_give_up)
+    finally:
+        connection.close()
+
+
+mail_cli = AppGroup('mail', help='邮件发送队列')
+
+
+def _run_mail_worker():
+    from main import app
+    run_worker(app)
+
+
+@mail_cli.command('worker')
+@click.option('--processes', default=1, help='worker进程数，每个进程保持一个SMTP连接')
+def mail_worker_command(processes):
+    """启动发送邮件的worker"""
+    # 使用spawn，子进程各自创建Redis和SMTP连接
+    ctx = get_context('spawn')
+    workers = [ctx.Process(target=_run_mail_worker) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -1,18 +1,32 @@
 # 第三方库导入
 from flask import Flask, jsonify, send_from_directory
 # 应用/模块内部导入
-from extensions import mongo, limiter, cors, socketio
-from handler import user, upload, video, admin, ai, space, comment, online, danmaku
+from extensions import mongo, limiter, cors, socketio, init_redis
+from handler import user, upload, video, admin, ai, space, comment, online, danmaku, public, monitor
+from scheduler import start_periodic_jobs
+from indexes import index_cli, reconcile
+from mailer import mail_cli
+import metrics
+import profiler
+from sessions import RedisSessionInterface
 import config
 
 
 app = Flask(__name__, static_folder="./dist")
 app.config.from_object(config)
+app.session_interface = RedisSessionInterface()
 
-mongo.init_app(app)
+init_redis(app)
+metrics.init_app(app)  # 需要在创建MongoClient之前注册命令监听
+# connect=False: 第一次查询时才建立连接，preload的主进程fork前不持有连接
+mongo.init_app(app, maxPoolSize=app.config.get('MONGO_MAX_POOL_SIZE', 100), connect=False)
+profiler.init_app(app)
 limiter.init_app(app)
 cors.init_app(app)
-socketio.init_app(app)
+# 多进程时通过Redis转发消息，房间广播能到达连接在其它进程上的客户端
+socketio.init_app(app, message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+                  async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+                  transports=app.config.get('SOCKETIO_TRANSPORTS'))
 
 app.register_blueprint(user.bp)
 app.register_blueprint(upload.bp)
@@ -23,6 +37,11 @@ app.register_blueprint(space.bp)
 app.register_blueprint(comment.bp)
 app.register_blueprint(online.bp)
 app.register_blueprint(danmaku.bp)
+app.register_blueprint(public.bp)
+app.register_blueprint(monitor.bp)
+
+app.cli.add_command(index_cli)
+app.cli.add_command(mail_cli)
 
 
 @app.route('/', defaults={'path': ''})
@@ -42,4 +61,8 @@ def ratelimit_error(e):
 
 
 if __name__ == '__main__':
+    if app.config.get('INDEX_RECONCILE_ON_STARTUP', True):
+        with app.app_context():
+            reconcile()
+    start_periodic_jobs(app)
     app.run()
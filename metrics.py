@@ -0,0 +1,211 @@
+# 标准库导入
+import os
+import json
+import time
+import socket
+import threading
+from functools import wraps
+# 第三方库导入
+from flask import g, request, has_request_context
+from pymongo import monitoring
+from redis.client import Redis, Pipeline
+# 应用/模块内部导入
+from extensions import redis_client
+from scheduler import periodic
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# 指标名: (类型, 说明, 标签名, 直方图分桶)
+METRICS = {
+    "http_requests_total": ("counter", "请求数", ("endpoint", "method", "status"), None),
+    "http_request_exceptions_total": ("counter", "未处理异常数", ("endpoint",), None),
+    "http_request_duration_seconds": ("histogram", "请求处理时间", ("endpoint",), LATENCY_BUCKETS),
+    "http_request_mongo_commands": ("histogram", "每个请求的MongoDB命令数", ("endpoint",), COUNT_BUCKETS),
+    "http_request_redis_commands": ("histogram", "每个请求的Redis命令数", ("endpoint",), COUNT_BUCKETS),
+    "mongo_command_duration_seconds": ("histogram", "MongoDB命令耗时", ("endpoint", "command"), LATENCY_BUCKETS),
+    "mongo_command_failures_total": ("counter", "失败的MongoDB命令数", ("endpoint", "command"), None),
+    "redis_command_duration_seconds": ("histogram", "Redis命令耗时", ("endpoint", "command"), LATENCY_BUCKETS),
+    "cache_requests_total": ("counter", "缓存查询数", ("cache", "result"), None),
+}
+
+SNAPSHOT_KEY = "metrics:snapshot:{}"
+SNAPSHOT_TTL = 60  # 进程退出后快照保留的时间
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+_cache_stats = {}
+_installed = False
+
+
+def inc(name, labels, value=1):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+def observe(name, labels, value):
+    buckets = METRICS[name][3]
+    index = len(buckets)
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            index = i
+            break
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            # 各分桶计数(最后一个为+Inf)、总和、次数
+            histogram = _histograms[(name, labels)] = [[0] * (len(buckets) + 1), 0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def register_cache(name, stats):
+    """登记缓存的命中统计，stats为包含hits和misses的字典"""
+    _cache_stats[name] = stats
+
+
+def current_endpoint():
+    """当前命令所属的接口，不在请求中时为background"""
+    if not has_request_context():
+        return "background"
+    return request.endpoint or "unmatched"
+
+
+class CommandListener(monitoring.CommandListener):
+    """记录每条MongoDB命令的耗时，并计入发出命令的接口"""
+
+    def started(self, event):
+        if has_request_context():
+            g.metrics_mongo_commands = g.get("metrics_mongo_commands", 0) + 1
+
+    def succeeded(self, event):
+        observe("mongo_command_duration_seconds", (current_endpoint(), event.command_name),
+                event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = (current_endpoint(), event.command_name)
+        observe("mongo_command_duration_seconds", labels, event.duration_micros / 1e6)
+        inc("mongo_command_failures_total", labels)
+
+
+def _timed(execute, command_name):
+    @wraps(execute)
+    def timed_execute(self, *args, **options):
+        begin = time.perf_counter()
+        try:
+            return execute(self, *args, **options)
+        finally:
+            elapsed = time.perf_counter() - begin
+            if has_request_context():
+                g.metrics_redis_commands = g.get("metrics_redis_commands", 0) + 1
+            observe("redis_command_duration_seconds",
+                    (current_endpoint(), command_name(args)), elapsed)
+    return timed_execute
+
+
+def init_app(app):
+    """注册MongoDB命令监听和请求钩子，需要在mongo.init_app之前调用"""
+    global _installed
+    if not _installed:
+        # 对之后创建的所有MongoClient生效
+        monitoring.register(CommandListener())
+        # Redis没有命令钩子，在客户端类上计时，所有连接和pipeline都会统计
+        Redis.execute_command = _timed(Redis.execute_command, lambda args: str(args[0]).upper())
+        Pipeline.execute = _timed(Pipeline.execute, lambda args: "PIPELINE")
+        _installed = True
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        start = g.get("metrics_start")
+        if start is None:
+            return
+        endpoint = current_endpoint()
+        status = 500 if exc is not None else g.get("metrics_status", 500)
+        if exc is not None:
+            inc("http_request_exceptions_total", (endpoint,))
+        inc("http_requests_total", (endpoint, request.method, str(status)))
+        observe("http_request_duration_seconds", (endpoint,), time.perf_counter() - start)
+        observe("http_request_mongo_commands", (endpoint,), g.get("metrics_mongo_commands", 0))
+        observe("http_request_redis_commands", (endpoint,), g.get("metrics_redis_commands", 0))
+
+
+def snapshot():
+    """当前进程的指标，缓存命中数在这里从各缓存的统计中读取"""
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [[name, list(labels), [list(h[0]), h[1], h[2]]]
+                      for (name, labels), h in _histograms.items()]
+    for cache, stats in _cache_stats.items():
+        for result in ("hits", "misses"):
+            counters.append(["cache_requests_total", [cache, result], stats.get(result, 0)])
+    return {"counters": counters, "histograms": histograms}
+
+
+@periodic('METRICS_PUBLISH_INTERVAL', 15, exclusive=False)
+def publish_snapshot():
+    """把当前进程的指标写入Redis，/api/metrics汇总所有进程"""
+    redis_client.set(SNAPSHOT_KEY.format(f"{socket.gethostname()}:{os.getpid()}"),
+                     json.dumps(snapshot()), ex=SNAPSHOT_TTL)
+
+
+def collect():
+    """汇总所有存活进程的指标，返回(计数器, 直方图)"""
+    publish_snapshot()
+    counters, histograms = {}, {}
+    for key in redis_client.scan_iter(match=SNAPSHOT_KEY.format("*")):
+        raw = redis_client.get(key)
+        if raw is None:
+            continue
+        data = json.loads(raw)
+        for name, labels, value in data["counters"]:
+            counters[(name, tuple(labels))] = counters.get((name, tuple(labels)), 0) + value
+        for name, labels, (buckets, total, count) in data["histograms"]:
+            merged = histograms.setdefault((name, tuple(labels)), [[0] * len(buckets), 0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    """按Prometheus文本格式输出所有指标"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, description, label_names, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(label_names, labels)} {value}")
+            continue
+        for (metric, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(label_names, labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_names, labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(label_names, labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,198 @@
+# 标准库导入
+import os
+import re
+import sys
+import json
+import time
+import random
+import cProfile
+import threading
+from uuid import uuid4
+from collections import Counter
+# 第三方库导入
+from flask import g, request
+
+
+PROFILE_ID_PATTERN = re.compile(r'^\d+-[0-9a-f]{8}$')
+FORMAT_EXTENSIONS = {"collapsed": "collapsed", "pstats": "pstats"}
+
+_active = {}  # 正在处理请求的线程: 该请求的调用栈采样计数
+_active_lock = threading.Lock()
+_sampler = None
+
+
+def _collapse(frame):
+    """把调用栈转为flamegraph使用的折叠格式：根在前，用分号分隔"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_loop(interval):
+    """定时采样所有正在处理请求的线程的调用栈"""
+    while True:
+        time.sleep(interval)
+        # 只在锁内复制一份，遍历调用栈时不阻塞请求的开始和结束
+        with _active_lock:
+            active = list(_active.items())
+        if not active:
+            continue
+        frames = sys._current_frames()
+        samples = [(thread_id, stacks, _collapse(frames[thread_id]))
+                   for thread_id, stacks in active if thread_id in frames]
+        # 计数在锁内进行，已结束的请求正在写出的Counter不会再被修改
+        with _active_lock:
+            for thread_id, stacks, stack in samples:
+                if _active.get(thread_id) is stacks:
+                    stacks[stack] += 1
+
+
+def _ensure_sampler(interval):
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = threading.Thread(target=_sample_loop, args=(interval,), daemon=True, name="profiler")
+        _sampler.start()
+
+
+class ProfileStore:
+    """保存在本地目录中的性能分析结果，超过数量上限时删除最旧的"""
+
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, profile_id, profile_format):
+        return os.path.join(self.directory, f"{profile_id}.{FORMAT_EXTENSIONS[profile_format]}")
+
+    def save(self, meta, write):
+        """write(路径)写入分析数据，元信息写入同名json文件"""
+        profile_id = f"{int(time.time() * 1000)}-{uuid4().hex[:8]}"
+        meta = {**meta, "id": profile_id}
+        write(self.path(profile_id, meta["format"]))
+        with open(os.path.join(self.directory, f"{profile_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self.rotate()
+        return profile_id
+
+    def rotate(self):
+        with self._lock:
+            metas = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+            # 文件名以毫秒时间戳开头，按名称排序即按时间排序
+            for name in metas[:max(len(metas) - self.max_files, 0)]:
+                profile_id = name[:-len('.json')]
+                for extension in ['json', *FORMAT_EXTENSIONS.values()]:
+                    try:
+                        os.remove(os.path.join(self.directory, f"{profile_id}.{extension}"))
+                    except OSError:
+                        pass
+
+    def list(self):
+        """所有保存的分析结果的元信息"""
+        metas = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    metas.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # 可能刚被轮转删除
+        return metas
+
+    def get(self, profile_id):
+        """返回(文件路径, 元信息)，不存在时返回None"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json"), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self.path(profile_id, meta["format"])
+        return (path, meta) if os.path.exists(path) else None
+
+
+store = None
+
+
+def init_app(app):
+    """为请求注册性能分析钩子
+
+    sample模式由后台线程定时采样调用栈，开销小，可以对所有请求开启；
+    cprofile模式按PROFILER_CPROFILE_RATE的比例对请求运行cProfile。
+    两种模式都只保存耗时超过PROFILER_SLOW_THRESHOLD秒的请求和按
+    PROFILER_KEEP_RATE随机保留的请求。
+    """
+    global store
+    if not app.config.get('PROFILER_ENABLED', True):
+        return
+    mode = app.config.get('PROFILER_MODE', 'sample')
+    threshold = app.config.get('PROFILER_SLOW_THRESHOLD', 0.5)
+    keep_rate = app.config.get('PROFILER_KEEP_RATE', 0.001)
+    cprofile_rate = app.config.get('PROFILER_CPROFILE_RATE', 0.05)
+    interval = app.config.get('PROFILER_SAMPLE_INTERVAL', 0.01)
+    store = ProfileStore(app.config.get('PROFILER_DIR', './profiles'),
+                         app.config.get('PROFILER_MAX_FILES', 500))
+
+    @app.before_request
+    def start_profiling():
+        g.profile_start = time.perf_counter()
+        if mode == 'sample':
+            _ensure_sampler(interval)
+            g.profile_thread = threading.get_ident()
+            with _active_lock:
+                _active[g.profile_thread] = Counter()
+        elif random.random() < cprofile_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return  # Python 3.12起同一时间只能有一个cProfile在运行
+            g.profile = profile
+
+    @app.teardown_request
+    def finish_profiling(exc):
+        start = g.get('profile_start')
+        if start is None:
+            return
+        profile = g.get('profile')
+        if profile is not None:
+            profile.disable()
+        stacks = None
+        if g.get('profile_thread') is not None:
+            with _active_lock:
+                stacks = _active.pop(g.profile_thread, None)
+
+        duration = time.perf_counter() - start
+        if duration >= threshold:
+            reason = "slow"
+        elif random.random() < keep_rate:
+            reason = "random"
+        else:
+            return
+        if profile is None and not stacks:
+            return
+
+        meta = {
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": request.full_path,
+            "duration": duration,
+            "time": time.time(),
+            "reason": reason,
+            "format": "pstats" if profile is not None else "collapsed",
+        }
+        if profile is not None:
+            store.save(meta, profile.dump_stats)
+        else:
+            def write_collapsed(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            meta["samples"] = sum(stacks.values())
+            store.save(meta, write_collapsed)
@@ -0,0 +1,136 @@
+# 标准库导入
+import json
+import math
+import time
+import random
+import hashlib
+from functools import wraps
+# 第三方库导入
+from flask import request, session, make_response, Response
+# 应用/模块内部导入
+from extensions import redis_client
+from utils import TTLCache
+import metrics
+
+
+ENTRY_KEY = "resp_cache:{}"
+TAG_KEY = "resp_cache_tag:{}"
+LOCK_KEY = "resp_cache_lock:{}"
+STALE_FACTOR = 3  # 过期后仍保留一段时间，重新计算期间其它请求返回旧数据
+LOCK_TIMEOUT = 30
+LOCK_WAIT_INTERVAL = 0.05
+LOCK_WAIT_TRIES = 40
+EARLY_REFRESH_BETA = 1.0
+
+_local_entries = TTLCache(maxsize=2000, ttl=5)
+
+stats = {"hits": 0, "misses": 0, "stale": 0, "not_modified": 0}
+metrics.register_cache("response", stats)
+metrics.register_cache("response_local", _local_entries.stats)
+
+
+def invalidate(*tags):
+    """使带有这些标签的缓存失效"""
+    pipe = redis_client.pipeline(transaction=False)
+    for tag in tags:
+        pipe.incr(TAG_KEY.format(tag))
+    pipe.execute()
+
+
+def _load(key):
+    entry = _local_entries.get(key)
+    if entry is None:
+        raw = redis_client.get(ENTRY_KEY.format(key))
+        if raw is not None:
+            entry = json.loads(raw)
+            _local_entries.set(key, entry)
+    return entry
+
+
+def _build(f, args, kwargs, key, ttl):
+    """执行视图函数，成功的JSON响应写入缓存；返回(缓存条目, 响应)"""
+    begin = time.time()
+    response = make_response(f(*args, **kwargs))
+    if response.status_code != 200 or response.mimetype != 'application/json':
+        return None, response
+
+    body = response.get_data(as_text=True)
+    entry = {
+        "body": body,
+        "mimetype": response.mimetype,
+        "etag": hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        "created": time.time(),
+        "compute_time": time.time() - begin
+    }
+    redis_client.set(ENTRY_KEY.format(key), json.dumps(entry), ex=max(int(ttl * STALE_FACTOR), 1))
+    _local_entries.set(key, entry)
+    return entry, None
+
+
+def _respond(entry, state):
+    """根据缓存条目生成响应，If-None-Match匹配时返回304"""
+    if entry["etag"] in request.if_none_match:
+        stats["not_modified"] += 1
+        response = Response(status=304)
+    else:
+        response = Response(entry["body"], mimetype=entry["mimetype"])
+    response.set_etag(entry["etag"])
+    response.headers['X-Cache'] = state
+    return response
+
+
+def _should_refresh(entry, ttl):
+    """过期或按概率提前刷新，越接近过期、计算越慢，提前刷新的概率越大"""
+    age = time.time() - entry["created"]
+    return age - entry["compute_time"] * EARLY_REFRESH_BETA * math.log(random.random() or 1e-12) >= ttl
+
+
+def cached(ttl, tags=None, per_user=False, skip=None):
+    """缓存GET接口的JSON响应
+
+    ttl: 缓存秒数
+    tags: 接收视图参数、返回标签列表的函数，invalidate(标签)时缓存失效
+    per_user: 响应与登录用户有关时为True，每个用户单独缓存
+    skip: 接收视图参数、返回True时本次请求不使用缓存，例如每次结果都应不同的请求
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if skip and skip(**kwargs):
+                return f(*args, **kwargs)
+            uid = session.get('user', {}).get('uid') if per_user else None
+            tag_list = tags(**kwargs) if tags else []
+            # 标签版本号是缓存key的一部分，失效后旧条目不会再被读到
+            versions = redis_client.mget([TAG_KEY.format(tag) for tag in tag_list]) if tag_list else []
+            key = hashlib.sha1(json.dumps(
+                [request.endpoint, request.full_path, uid, versions]).encode('utf-8')).hexdigest()
+            lock_key = LOCK_KEY.format(key)
+
+            entry = _load(key)
+            if entry is not None and not _should_refresh(entry, ttl):
+                stats["hits"] += 1
+                return _respond(entry, 'HIT')
+
+            # 只让一个请求重新计算
+            locked = redis_client.set(lock_key, 1, nx=True, ex=LOCK_TIMEOUT)
+            if not locked:
+                if entry is not None:
+                    stats["stale"] += 1
+                    return _respond(entry, 'STALE')
+                # 其它请求正在计算，等待它的结果，超时后自己计算
+                for _ in range(LOCK_WAIT_TRIES):
+                    time.sleep(LOCK_WAIT_INTERVAL)
+                    entry = _load(key)
+                    if entry is not None:
+                        stats["hits"] += 1
+                        return _respond(entry, 'HIT')
+
+            stats["misses"] += 1
+            try:
+                entry, response = _build(f, args, kwargs, key, ttl)
+            finally:
+                if locked:
+                    redis_client.delete(lock_key)
+            return _respond(entry, 'MISS') if entry else response
+        return decorated_function
+    return decorator
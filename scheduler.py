@@ -0,0 +1,47 @@
+# 标准库导入
+import os
+import logging
+# 应用/模块内部导入
+from extensions import redis_client, socketio
+
+
+logger = logging.getLogger(__name__)
+
+_jobs = []
+
+
+def periodic(interval_key, default_interval, exclusive=True):
+    """注册周期任务，执行间隔(秒)从配置项interval_key读取
+
+    exclusive为True时每轮只在一个进程中执行，处理进程内数据的任务应设为False
+    """
+    def decorator(f):
+        _jobs.append((f, interval_key, default_interval, exclusive))
+        return f
+    return decorator
+
+
+def run_job_once(app, f, interval, exclusive=True):
+    """执行一次周期任务，exclusive时同一轮次内多个进程只有一个会真正执行"""
+    lock_key = f"job_lock:{f.__module__}.{f.__name__}"
+    if exclusive and not redis_client.set(lock_key, os.getpid(), nx=True, ex=max(int(interval), 1)):
+        return
+    with app.app_context():
+        f()
+
+
+def _run_forever(app, f, interval_key, default_interval, exclusive):
+    while True:
+        interval = app.config.get(interval_key, default_interval)
+        socketio.sleep(interval)
+        try:
+            run_job_once(app, f, interval, exclusive)
+        except Exception:
+            logger.exception("周期任务%s执行失败", f.__name__)
+
+
+def start_periodic_jobs(app):
+    """为所有已注册的周期任务启动后台任务"""
+    for f, interval_key, default_interval, exclusive in _jobs:
+        socketio.start_background_task(
+            _run_forever, app, f, interval_key, default_interval, exclusive)
@@ -0,0 +1,146 @@
+"""生产环境入口：主进程监听端口后fork出多个gevent worker
+
+每个worker在fork之后才打猴子补丁、导入应用并创建MongoDB/Redis连接，主进程不持有
+任何连接。worker异常退出时由主进程重新启动，SIGTERM/SIGINT时通知所有worker退出。
+
+多个worker共用一个端口时，Socket.IO需要在配置中设置SOCKETIO_TRANSPORTS = ['websocket']；
+也可以用--separate-ports让每个worker监听port+序号，由反向代理按客户端IP保持会话。
+
+用法: python serve.py --workers 4 --port 5000
+"""
+# 标准库导入
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+# 应用/模块内部导入
+import config
+
+
+logger = logging.getLogger("serve")
+
+RESTART_DELAY = 1  # worker退出后重新启动前等待的秒数，避免启动即崩溃时空转
+
+
+def create_listener(host, port, backlog):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+def run_worker(listener, index, args):
+    """在fork出的子进程中启动gevent服务器，不会返回"""
+    # Ctrl+C会发给整个进程组，由主进程统一通知worker退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from gevent import monkey
+    monkey.patch_all()
+
+    import gevent
+    from gevent import pywsgi
+
+    # 补丁之后socket.socket是gevent的实现，接管继承来的监听套接字
+    listener = socket.socket(fileno=listener.detach())
+
+    config.SOCKETIO_ASYNC_MODE = 'gevent'
+    if getattr(config, 'PROFILER_MODE', 'sample') == 'sample':
+        # 协程共用一个线程，采样无法区分请求
+        config.PROFILER_MODE = 'cprofile'
+
+    from main import app
+    from scheduler import start_periodic_jobs
+    from indexes import reconcile
+
+    if index == 0 and app.config.get('INDEX_RECONCILE_ON_STARTUP', True):
+        with app.app_context():
+            reconcile()
+    # 独占的周期任务由Redis锁保证每轮只在一个worker中执行
+    start_periodic_jobs(app)
+
+    try:
+        from geventwebsocket.handler import WebSocketHandler as handler_class
+    except ImportError:
+        handler_class = pywsgi.WSGIHandler
+
+    server = pywsgi.WSGIServer(listener, app, handler_class=handler_class, spawn=args.connections,
+                               log='default' if args.access_log else None)
+    gevent.signal_handler(signal.SIGTERM, server.stop, 10)
+    logger.info("worker %d (pid %d) 开始处理请求", index, os.getpid())
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=getattr(config, 'SERVE_WORKERS', 0),
+                        help="worker进程数，0表示CPU核数")
+    parser.add_argument("--connections", type=int, default=getattr(config, 'SERVE_CONNECTIONS', 1000),
+                        help="每个worker同时处理的最大连接数")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--separate-ports", action="store_true", help="每个worker监听port+序号")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    workers = args.workers or os.cpu_count()
+
+    if args.separate_ports:
+        listeners = [create_listener(args.host, args.port + i, args.backlog) for i in range(workers)]
+    else:
+        listeners = [create_listener(args.host, args.port, args.backlog)] * workers
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(listeners[index], index, args)
+            except Exception:
+                logger.exception("worker %d 异常退出", index)
+                os._exit(1)
+            os._exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+    logger.info("已启动%d个worker，监听%s:%d", workers, args.host, args.port)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning("worker %d (pid %d) 退出，状态%d，重新启动", index, pid, status)
+        time.sleep(RESTART_DELAY)
+        spawn(index)
+
+    logger.info("所有worker已退出")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# 标准库导入
+import secrets
+# 第三方库导入
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+# 应用/模块内部导入
+from extensions import redis_client
+
+
+SESSION_KEY = "session:{}"
+USER_SESSIONS_KEY = "user_sessions:{}"  # 用户的所有会话ID，用于强制下线
+MAX_SID_LENGTH = 64
+
+serializer = TaggedJSONSerializer()
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class RedisSession(CallbackDict, SessionMixin):
+    """保存在Redis中的会话，cookie中只有随机的会话ID"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.old_sid = None
+        self.loaded_uid = self.get('user', {}).get('uid')  # 加载时会话所属的用户
+
+    def regenerate(self):
+        """登录时更换会话ID，防止会话固定攻击"""
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = new_sid()
+        self.modified = True
+
+
+class RedisSessionInterface(SessionInterface):
+    """把会话保存到Redis，可以按用户撤销所有会话"""
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= MAX_SID_LENGTH:
+            raw = redis_client.get(SESSION_KEY.format(sid))
+            if raw is not None:
+                return RedisSession(serializer.loads(raw), sid=sid)
+        return RedisSession(sid=new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        uid = session.get('user', {}).get('uid')
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        pipe = redis_client.pipeline()
+        if session.old_sid is not None:
+            pipe.delete(SESSION_KEY.format(session.old_sid))
+            if session.loaded_uid is not None:
+                pipe.srem(USER_SESSIONS_KEY.format(session.loaded_uid), session.old_sid)
+
+        # 会话被清空(登出)时删除记录和cookie
+        if not session:
+            if session.modified:
+                if not session.new:
+                    pipe.delete(SESSION_KEY.format(session.sid))
+                    if session.loaded_uid is not None:
+                        pipe.srem(USER_SESSIONS_KEY.format(session.loaded_uid), session.sid)
+                pipe.execute()
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        if session.modified:
+            pipe.set(SESSION_KEY.format(session.sid), serializer.dumps(dict(session)), ex=ttl)
+            if uid is not None:
+                pipe.sadd(USER_SESSIONS_KEY.format(uid), session.sid)
+                pipe.expire(USER_SESSIONS_KEY.format(uid), ttl)
+            if session.loaded_uid is not None and session.loaded_uid != uid:
+                pipe.srem(USER_SESSIONS_KEY.format(session.loaded_uid), session.sid)
+        elif self.should_set_cookie(app, session):
+            # 内容没有变化，只延长有效期
+            pipe.expire(SESSION_KEY.format(session.sid), ttl)
+        else:
+            return
+        pipe.execute()
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+
+
+def revoke_user_sessions(uid, keep_sid=None):
+    """删除用户的所有会话(可保留keep_sid)，返回删除的会话数"""
+    key = USER_SESSIONS_KEY.format(uid)
+    sids = [sid for sid in redis_client.smembers(key) if sid != keep_sid]
+    if not sids:
+        return 0
+    pipe = redis_client.pipeline()
+    pipe.delete(*[SESSION_KEY.format(sid) for sid in sids])
+    pipe.srem(key, *sids)
+    pipe.execute()
+    return len(sids)
@@ -0,0 +1,75 @@
+# 标准库导入
+import os
+import time
+from uuid import uuid4
+# 应用/模块内部导入
+from extensions import mongo
+from jobqueue import JobQueue
+from cos import upload_to_cos
+from response_cache import invalidate
+
+
+# 上传100MB视频最多需要几分钟，心跳超时要留足余量
+cos_queue = JobQueue("cos_upload", max_attempts=6, base_delay=5, heartbeat_ttl=30 * 60)
+
+
+def _set_state(job_id, aid, kind, state, error=''):
+    """同时更新任务记录和视频文档上的上传状态"""
+    mongo.db.upload_job.update_one({"_id": job_id}, {"$set": {
+        "state": state, "error": error, "updated_at": time.time()}})
+    if aid is not None:
+        mongo.db.video.update_one({"aid": aid}, {"$set": {f"upload_status.{kind}": state}})
+        invalidate(f"video:{aid}")
+
+
+def enqueue_upload(local_path, cos_key, aid=None, kind=None, delete_after=False):
+    """将本地文件加入上传队列，返回任务ID"""
+    job = {
+        "job_id": uuid4().hex,
+        "local_path": local_path,
+        "cos_key": cos_key,
+        "aid": aid,
+        "kind": kind,  # 对应视频文档upload_status中的字段，如video、cover
+        "delete_after": delete_after
+    }
+    # 先持久化任务记录，再放入队列
+    mongo.db.upload_job.insert_one({
+        "_id": job["job_id"],
+        **{key: value for key, value in job.items() if key != "job_id"},
+        "state": "pending",
+        "attempts": 0,
+        "error": '',
+        "created_at": time.time(),
+        "updated_at": time.time()
+    })
+    cos_queue.enqueue(job)
+    return job["job_id"]
+
+
+def process_upload(job):
+    """上传一个文件，失败时抛出异常由队列重试"""
+    job_id, aid, kind = job["job_id"], job["aid"], job["kind"]
+    mongo.db.upload_job.update_one({"_id": job_id}, {"$inc": {"attempts": 1}})
+    _set_state(job_id, aid, kind, "uploading")
+
+    success, error_message = upload_to_cos(job["local_path"], job["cos_key"])
+    if not success:
+        _set_state(job_id, aid, kind, "retrying", error_message)
+        raise RuntimeError(error_message)
+
+    _set_state(job_id, aid, kind, "done")
+    if job["delete_after"] and os.path.exists(job["local_path"]):
+        os.remove(job["local_path"])
+
+
+def run_worker(app):
+    """在当前进程中循环处理上传任务"""
+    def handler(job):
+        with app.app_context():
+            process_upload(job)
+
+    def on_give_up(job, error):
+        with app.app_context():
+            _set_state(job["job_id"], job["aid"], job["kind"], "failed", error)
+
+    cos_queue.run_worker(handler, on_give_up)
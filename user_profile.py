@@ -0,0 +1,92 @@
+# 标准库导入
+import json
+# 应用/模块内部导入
+from extensions import mongo, redis_client
+from utils import TTLCache
+import metrics
+
+
+# 列表页只需要用户的公开资料
+PROFILE_PROJECTION = {"_id": 0, "uid": 1, "name": 1, "time": 1}
+PROFILE_KEY = "user_profile:{}"
+PROFILE_REDIS_TTL = 10 * 60  # Redis中缓存10分钟
+PROFILE_LOCAL_TTL = 30  # 进程内缓存30秒，其它进程的改名最多延迟30秒可见
+
+_local_profiles = TTLCache(maxsize=10000, ttl=PROFILE_LOCAL_TTL)
+metrics.register_cache("user_profile_local", _local_profiles.stats)
+
+
+def get_user_profiles(uids):
+    """批量获取用户公开资料，依次查询进程内缓存、Redis和MongoDB，返回{uid: profile}"""
+    profiles = {}
+
+    missing = []
+    for uid in set(uids):
+        if uid is None:
+            continue
+        profile = _local_profiles.get(uid)
+        if profile is None:
+            missing.append(uid)
+        else:
+            profiles[uid] = profile
+
+    if not missing:
+        return profiles
+
+    # 进程内未命中的部分一次性从Redis中读取
+    not_in_redis = []
+    for uid, raw in zip(missing, redis_client.mget([PROFILE_KEY.format(uid) for uid in missing])):
+        if raw is None:
+            not_in_redis.append(uid)
+            continue
+        profile = json.loads(raw)
+        profiles[uid] = profile
+        _local_profiles.set(uid, profile)
+
+    if not not_in_redis:
+        return profiles
+
+    # 剩下的用一次$in查询从MongoDB中读取并回填缓存
+    pipe = redis_client.pipeline(transaction=False)
+    for user in mongo.db.user.find({"uid": {"$in": not_in_redis}}, PROFILE_PROJECTION):
+        profiles[user["uid"]] = user
+        _local_profiles.set(user["uid"], user)
+        pipe.set(PROFILE_KEY.format(user["uid"]),
+                 json.dumps(user), ex=PROFILE_REDIS_TTL)
+    pipe.execute()
+
+    return profiles
+
+
+def get_user_profile(uid):
+    """获取单个用户的公开资料"""
+    return get_user_profiles([uid]).get(uid)
+
+
+def invalidate_user_profile(uid):
+    """用户资料变更后使缓存失效"""
+    _local_profiles.pop(uid)
+    redis_client.delete(PROFILE_KEY.format(uid))
+
+
+def fill_video_user_names(videos):
+    """为视频列表批量填充上传者名称和隐藏操作人名称"""
+    uids = []
+    for video in videos:
+        uids.append(video["uid"])
+        if "hidden" in video and "uid" in video["hidden"]:
+            uids.append(video["hidden"]["uid"])
+
+    profiles = get_user_profiles(uids)
+
+    for video in videos:
+        uploader = profiles.get(video["uid"])
+        video["uploader_name"] = uploader.get("name") if uploader else "未知"
+
+        # 删除uid字段，只留下operator_name字段
+        if "hidden" in video:
+            operator = profiles.get(video["hidden"].pop("uid", None))
+            video["hidden"]["operator_name"] = operator.get(
+                "name") if operator else "未知"
+
+    return videos
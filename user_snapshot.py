@@ -0,0 +1,80 @@
+# 标准库导入
+import json
+# 应用/模块内部导入
+from extensions import mongo, redis_client
+
+
+# /session/get和签到需要的字段，保存在Redis哈希中，每个字段的值为JSON
+SNAPSHOT_KEY = "user_snapshot:{}"
+SNAPSHOT_TTL = 24 * 3600
+# 每次删除快照时加一，读取MongoDB期间快照被删除过时不回填旧数据
+VERSION_KEY = "user_snapshot_version:{}"
+# 权限检查使用的用户状态单独缓存，直接在数据库中修改状态时最多延迟STATUS_TTL秒生效
+STATUS_KEY = "user_status:{}"
+STATUS_TTL = 60
+SNAPSHOT_PROJECTION = {"_id": 0, "uid": 1, "name": 1, "email": 1, "status": 1, "checkin": 1}
+
+# 版本号和读取MongoDB之前相同时才写入快照
+FILL_IF_UNCHANGED_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+
+def _from_user(user):
+    checkin = user.get("checkin") or {}
+    return {
+        "uid": user["uid"],
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "status": user.get("status", 0),
+        "points": checkin.get("points", 0),
+        "experience": checkin.get("experience", 0),
+        "last_checkin": checkin.get("last_checkin"),
+    }
+
+
+def get_user_snapshot(uid):
+    """获取用户快照，缓存未命中时从MongoDB读取；用户不存在返回None"""
+    key = SNAPSHOT_KEY.format(uid)
+    raw = redis_client.hgetall(key)
+    if raw:
+        return {field: json.loads(value) for field, value in raw.items()}
+
+    version = redis_client.get(VERSION_KEY.format(uid)) or ''
+    user = mongo.db.user.find_one({"uid": uid}, SNAPSHOT_PROJECTION)
+    if not user:
+        return None
+    snapshot = _from_user(user)
+    args = [version, SNAPSHOT_TTL]
+    for field, value in snapshot.items():
+        args += [field, json.dumps(value)]
+    redis_client.eval(FILL_IF_UNCHANGED_SCRIPT, 2, key, VERSION_KEY.format(uid), *args)
+    return snapshot
+
+
+def get_user_status(uid):
+    """获取用户状态(1为管理员)，用户不存在返回None"""
+    key = STATUS_KEY.format(uid)
+    status = redis_client.get(key)
+    if status is not None:
+        return int(status)
+
+    user = mongo.db.user.find_one({"uid": uid}, {"_id": 0, "status": 1})
+    if not user:
+        return None
+    status = user.get("status", 0)
+    redis_client.set(key, status, ex=STATUS_TTL)
+    return status
+
+
+def invalidate_user_snapshot(uid):
+    """用户数据写入数据库后删除快照和状态缓存，下次读取时重新加载"""
+    version_key = VERSION_KEY.format(uid)
+    pipe = redis_client.pipeline()
+    pipe.delete(SNAPSHOT_KEY.format(uid), STATUS_KEY.format(uid))
+    pipe.incr(version_key)
+    pipe.expire(version_key, SNAPSHOT_TTL)
+    pipe.execute()
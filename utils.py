@@ -1,10 +1,66 @@
 # 标准库导入
 import time
+import atexit
+import threading
+from collections import OrderedDict
 from functools import wraps
 # 第三方库导入
 from flask import jsonify, session
+from pymongo import ReturnDocument, UpdateOne
 # 应用/模块内部导入
 from extensions import mongo
+from scheduler import periodic
+from user_snapshot import get_user_status, invalidate_user_snapshot
+import leaderboard
+
+
+LOG_BUFFER_SIZE = 200  # 积分经验日志攒够这么多条后批量写入
+
+_log_buffer = []
+_log_lock = threading.Lock()
+
+
+class TTLCache:
+    """带过期时间的进程内LRU缓存"""
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            # 超出容量时淘汰最久未使用的条目
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
 
 
 def login_required(f):
@@ -21,50 +77,116 @@ def admin_required(f):
     """判断是否是管理员"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        uid = session['user']['uid']
-        user = mongo.db.user.find_one({"uid": uid})
-        if not user or user.get("status", 0) != 1:
+        if get_user_status(session['user']['uid']) != 1:
             return jsonify({"message": "您没有权限进行此操作"}), 403
         return f(*args, **kwargs)
     return decorated_function
 
 
+@periodic('POINT_LOG_FLUSH_INTERVAL', 5, exclusive=False)
+def flush_point_exp_logs():
+    """将缓冲的积分经验日志批量写入数据库"""
+    global _log_buffer
+    with _log_lock:
+        logs, _log_buffer = _log_buffer, []
+    if logs:
+        mongo.db.point_exp_log.insert_many(logs, ordered=False)
+
+
+atexit.register(flush_point_exp_logs)
+
+
+def _buffer_log(log):
+    with _log_lock:
+        _log_buffer.append(log)
+        is_full = len(_log_buffer) >= LOG_BUFFER_SIZE
+    if is_full:
+        flush_point_exp_logs()
+
+
 def adjust_points_and_exp(uid, points, exp=0, reason=''):
     """为用户调整积分和经验"""
 
-    user = mongo.db.user.find_one({"uid": uid})
-    if not user:
-        return {"status": "error", "message": "用户不存在"}
+    # 余额检查和增减在同一次原子更新中完成，并发调整不会丢失或透支
+    query = {"uid": uid}
+    if points < 0:
+        query["checkin.points"] = {"$gte": -points}
 
-    # 判断用户积分是否足够扣除
-    if points < 0 and abs(points) > user["checkin"]["points"]:
+    user = mongo.db.user.find_one_and_update(
+        query,
+        {"$inc": {"checkin.points": points, "checkin.experience": exp}},
+        projection={"_id": 0, "checkin.points": 1, "checkin.experience": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if not user:
+        if not mongo.db.user.count_documents({"uid": uid}, limit=1):
+            return {"status": "error", "message": "用户不存在"}
         return {"status": "error", "message": f"积分不足，{reason}需要消耗{abs(points)}积分"}
 
-    user["checkin"]["points"] += points
-    user["checkin"]["experience"] += exp
+    leaderboard.update_experience(uid, user["checkin"]["experience"])
+    invalidate_user_snapshot(uid)
+    _log_change(uid, points, exp, reason)
+
+    return {"status": "success", "message": "积分和经验调整成功"}
 
-    mongo.db.user.update_one({"uid": uid}, {"$set": {
-        "checkin.points": user["checkin"]["points"],
-        "checkin.experience": user["checkin"]["experience"]
-    }})
 
-    # 记录积分和经验的变动
-    log = {
+def _log_change(uid, points, exp, reason):
+    """记录积分和经验的变动，由flush_point_exp_logs批量写入"""
+    _buffer_log({
         "uid": uid,
         "points_change": points,
         "exp_change": exp,
         "time": time.time(),
         "reason": reason
-    }
-    mongo.db.point_exp_log.insert_one(log)
-
-    return {"status": "success", "message": "积分和经验调整成功"}
+    })
+
+
+def adjust_points_and_exp_bulk(adjustments):
+    """批量调整积分和经验，adjustments为包含uid、points、exp、reason的字典列表，返回每项的结果
+
+    不扣积分的调整不需要检查余额，用一次bulk_write完成；扣积分的调整逐个使用带条件的更新。
+    """
+    results = [None] * len(adjustments)
+    credits = []
+    for index, item in enumerate(adjustments):
+        if item["points"] < 0:
+            results[index] = adjust_points_and_exp(item["uid"], item["points"], item.get("exp", 0),
+                                                   item.get("reason", ''))
+        else:
+            credits.append((index, item))
+
+    if credits:
+        uids = list({item["uid"] for _, item in credits})
+        existing = {user["uid"] for user in mongo.db.user.find({"uid": {"$in": uids}}, {"_id": 0, "uid": 1})}
+        applied = [(index, item) for index, item in credits if item["uid"] in existing]
+        for index, item in credits:
+            if item["uid"] not in existing:
+                results[index] = {"status": "error", "message": "用户不存在"}
+
+        if applied:
+            mongo.db.user.bulk_write([UpdateOne(
+                {"uid": item["uid"]},
+                {"$inc": {"checkin.points": item["points"], "checkin.experience": item.get("exp", 0)}}
+            ) for _, item in applied], ordered=False)
+
+            # 写入后一次读出最新经验值，同步排行榜
+            updated = mongo.db.user.find({"uid": {"$in": list({item["uid"] for _, item in applied})}},
+                                         {"_id": 0, "uid": 1, "checkin.experience": 1})
+            for user in updated:
+                leaderboard.update_experience(user["uid"], user["checkin"]["experience"])
+                invalidate_user_snapshot(user["uid"])
+            for index, item in applied:
+                _log_change(item["uid"], item["points"], item.get("exp", 0), item.get("reason", ''))
+                results[index] = {"status": "success", "message": "积分和经验调整成功"}
+
+    flush_point_exp_logs()
+    return results
 
 
 def get_exp_rank(exp=0):
     """获取当前用户的经验值排名"""
-    rank = mongo.db.user.count_documents({"checkin.experience": {"$gt": exp}})
-    return rank + 1  # 因为count_documents会返回高于给定经验值的用户数，所以需要+1来得到实际的排名
+    return leaderboard.get_rank_by_exp(exp)
 
 
 def get_real_ip(request):